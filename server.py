@@ -1,50 +1,273 @@
-from server.playerHandler import PlayerHandler
+from server.playerHandler import PlayerHandler, DEFAULT_VIEW_RADIUS, view_radius
+from server.httpServer import make_server, SERVER_MODES, DEFAULT_MODE, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from server.protocol import (
+    MapTable, BINARY_CONTENT_TYPE, decode_update, decode_sync_request, encode_sync_response, check_state
+)
+from server.snapshot import SnapshotBroadcaster, DEFAULT_TICK_RATE
+from server.metrics import RequestMetrics, METRICS_CONTENT_TYPE, gauge
+from server.accessLog import AccessLog
+from server.shard import ShardRouter, ShardError, parse_shards
+from server.datagram import DatagramServer
+from server.capture import Capture
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import argparse
 import json
+import struct
+import sys
+import threading
+import time
+from collections import Counter
 PORT = 8989
+# Seconds a connection may stall in the middle of a request (e.g. in rfile.read) before its
+# worker gives up on it
+REQUEST_TIMEOUT = 10.0
+# Seconds a kept-alive connection may idle before its next request line. Shorter than
+# REQUEST_TIMEOUT: in pool mode an idle connection still holds a worker
+KEEPALIVE_TIMEOUT = 2.0
 
-PLAYER_HANDLER = PlayerHandler()
-PLAYER_HANDLER.start()
+# Push streams (/stream)
+# Each subscriber holds one pool worker, and its kept-alive /sync connection usually a second,
+# so streams get this share of the workers by default: their syncs take about as many again,
+# and the rest stays free for /register and polling clients
+STREAM_WORKER_SHARE = 1 / 3
+STREAM_KEEPALIVE = 5.0       # seconds of silence before a keep-alive comment is sent
+
+# Map name <-> id table for the binary wire format, also used for the player table's map column
+MAP_TABLE = MapTable()
+PLAYER_HANDLER = PlayerHandler(maps=MAP_TABLE)
+# Reads are served from a snapshot rebuilt at most once per tick
+BROADCASTER = SnapshotBroadcaster(PLAYER_HANDLER, MAP_TABLE, log=lambda text: ACCESS_LOG.message("-", text))
+STREAM_SLOTS = threading.BoundedSemaphore(max(1, int(DEFAULT_WORKERS * STREAM_WORKER_SHARE)))
+# Request counts, latency and response sizes for /metrics
+METRICS = RequestMetrics(("/", "/register", "/maps", "/players", "/stats", "/metrics", "/chat", "/stream", "/sync"))
+# Written by a background thread; configured and started in main
+ACCESS_LOG = AccessLog()
+# Sharded mode (--shards): players live in per-map worker processes, this process keeps ids,
+# map ids and chat. PLAYER_HANDLER then only holds the chat.
+SHARDS: ShardRouter | None = None
+# Optional UDP transport for positions and snapshots (--udp-port)
+DATAGRAMS: DatagramServer | None = None
+# UDP port announced at registration when clients reach DATAGRAMS through something else (--udp-public-port)
+UDP_PUBLIC_PORT: int | None = None
+# Every request and response, for tools/replay.py (--capture); disabled unless configured in main
+CAPTURE = Capture()
     
 class Handler(BaseHTTPRequestHandler):
-    # def log_message(self, fmt, *args):
-    #     return
+    timeout = REQUEST_TIMEOUT
+    # HTTP/1.1 keeps connections alive between requests (every response sets Content-Length)
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY a kept-alive connection
+    # waits on the client's delayed ACK (~40 ms) for every response
+    disable_nagle_algorithm = True
+
+    def log_request(self, code="-", size="-") -> None:
+        # Requests are logged with their latency and size at the end of handle_one_request
+        return
+
+    def log_message(self, fmt, *args) -> None:
+        # Never write from the request thread
+        ACCESS_LOG.message(self.address_string(), fmt % args)
+
+    # Per-request metrics state, set once the request line and headers are parsed
+    _started: float | None = None
+    _status: int = 0
+    _response_bytes: int = 0
+    # Capture state: connection number, start on the capture clock and the bodies exchanged
+    _capture_source: int = 0
+    _capture_t: float = 0.0
+    _request_body: bytes = b""
+    _response_body: bytes = b""
+    _response_type: str = ""
+
+    def handle_one_request(self) -> None:
+        self._started = None
+        # parse_request restores the request timeout once the request line is in
+        self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        super().handle_one_request()
+        # No request line if the connection idled out before sending one
+        if getattr(self, "raw_requestline", None) and hasattr(self.server, "count_request"):
+            self.server.count_request()
+        if self._started is not None:
+            # No path if the request line itself was malformed
+            raw_path = getattr(self, "path", "-")
+            path = urlsplit(raw_path).path
+            elapsed = time.perf_counter() - self._started
+            # A push stream lasts as long as the subscriber, keep it out of the latency histograms
+            METRICS.observe(self.command or "-", path, self._status, None if path == "/stream" else elapsed, self._response_bytes)
+            ACCESS_LOG.request(self.client_address[0], self.command or "-", raw_path, self._status, elapsed, self._response_bytes)
+            if CAPTURE.enabled:
+                self._capture(raw_path, elapsed)
+
+    def _capture(self, raw_path: str, elapsed: float) -> None:
+        if not self._capture_source:
+            self._capture_source = CAPTURE.new_source()
+        # A /stream body is the server's view of other players; only its duration is kept
+        CAPTURE.exchange(
+            self._capture_source, self._capture_t, elapsed, self.command or "-", raw_path, self._status,
+            getattr(self, "headers", None) and self.headers.get("Content-Type", ""), self._request_body,
+            self._response_type, self._response_body
+        )
+
+    def log_error(self, fmt, *args) -> None:
+        if self._started is None and fmt.startswith("Request timed out"):
+            return # An idle keep-alive connection was closed, not an error
+        super().log_error(fmt, *args)
+
+    def parse_request(self) -> bool:
+        self.connection.settimeout(self.timeout)
+        self._started = time.perf_counter()
+        self._status = 0
+        self._response_bytes = 0
+        if CAPTURE.enabled:
+            self._capture_t = CAPTURE.clock()
+            self._request_body = self._response_body = b""
+            self._response_type = ""
+        return super().parse_request()
+
+    def send_response(self, code: int, message: str | None = None) -> None:
+        self._status = code
+        super().send_response(code, message)
 
     def do_GET(self):
-        if self.path == "/":
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def _handle(self, method) -> None:
+        try:
+            method()
+        except ShardError as e:
+            # A shard process died or timed out; the front end keeps serving the others
+            self.log_message("%s", e)
+            self._json(503, {"error": "shard_unavailable"})
+
+    def _get(self):
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        if path == "/":
             self._json(200, {"status": "ok"})
             return
             
-        if self.path == "/register":
-            pid = PLAYER_HANDLER.register()
-            self._json(200, {"message": "registration successful", "id": pid})
+        if path == "/register":
+            pid = SHARDS.register() if SHARDS is not None else PLAYER_HANDLER.register()
+            info = {"message": "registration successful", "id": pid, "formats": ["json", "binary"]}
+            if DATAGRAMS is not None:
+                # Positions and snapshots may also go over UDP (binary format only)
+                info["udp_port"] = UDP_PUBLIC_PORT or DATAGRAMS.address[1]
+                info["udp_token"] = DATAGRAMS.token(pid, self.client_address[0])
+            self._json(200, info)
             return
 
-        if self.path == "/players":
-            self._json(200, {"players": PLAYER_HANDLER.list_players()})
+        # Map ids for the binary format; ?name=<map> interns a new map
+        if path == "/maps":
+            if "name" in query:
+                try:
+                    map_id = MAP_TABLE.intern(query["name"][0])
+                except ValueError:
+                    self._json(400, {"error": "map_table_full"})
+                    return
+                self._json(200, {"id": map_id, "maps": MAP_TABLE.to_dict()})
+            else:
+                self._json(200, {"maps": MAP_TABLE.to_dict()})
+            return
+
+        if path == "/players":
+            # ?since=<version> returns only what changed after that version,
+            # ?id=<pid>&radius=<px> only the players around that player
+            try:
+                since, pid, radius = self._players_query(query)
+            except ValueError:
+                self._json(400, {"error": "bad_query"})
+                return
+            binary = BINARY_CONTENT_TYPE in self.headers.get("Accept", "")
+            if SHARDS is not None:
+                data = SHARDS.view(pid, since, radius, binary)
+            else:
+                # With an id, radius <= 0 means everyone (as for /sync)
+                everyone = pid is None or radius <= 0
+                players = BROADCASTER.view(None if everyone else pid, since, radius)
+                data = None if players is None else BROADCASTER.encode(players, everyone, binary)
+            if data is None:
+                self._json(404, {"error": "player_not_found"})
+                return
+            self._send(200, data, BINARY_CONTENT_TYPE if binary else "application/json")
+            return
+
+        # Server metrics: snapshot tick timing
+        if path == "/stats":
+            stats = {"snapshot": BROADCASTER.stats()}
+            if SHARDS is not None:
+                stats["shards"] = SHARDS.stats()
+            if DATAGRAMS is not None:
+                stats["udp"] = DATAGRAMS.stats()
+            if CAPTURE.enabled:
+                stats["capture"] = CAPTURE.stats()
+            if hasattr(self.server, "connection_stats"):
+                stats["http"] = self.server.connection_stats()
+            self._json(200, stats)
+            return
+
+        # Prometheus text format: request metrics, players per map, lock contention
+        if path == "/metrics":
+            self._send(200, self._metrics().encode("utf-8"), METRICS_CONTENT_TYPE)
             return
 
         # Added: Get Chat
-        if self.path == "/chat":
-            self._json(200, {"messages": PLAYER_HANDLER.get_messages()})
+        # ?after=<seq> returns only the messages newer than that sequence number
+        if path == "/chat":
+            try:
+                after = int(query["after"][0]) if "after" in query else 0
+                if after < 0:
+                    raise ValueError("negative chat cursor")
+            except ValueError:
+                self._json(400, {"error": "bad_query"})
+                return
+            self._json(200, {"messages": PLAYER_HANDLER.get_messages(after=after)})
+            return
+
+        # Push channel: server-sent events with player and chat changes
+        if path == "/stream":
+            try:
+                _, pid, radius = self._players_query(query)
+            except ValueError:
+                self._json(400, {"error": "bad_query"})
+                return
+            self._stream(pid, radius)
             return
 
         self._json(404, {"error": "not_found"})
 
-    def do_POST(self):
-        # Allow both players update and chat
-        if self.path not in ["/players", "/chat"]:
+    def _post(self):
+        # Allow players update, chat and the combined sync
+        if self.path not in ["/players", "/chat", "/sync"]:
             self._json(404, {"error": "not_found"})
             return
 
         length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length)
+        self._request_body = body
+
+        if self.path == "/sync":
+            self._sync(body)
+            return
+
+        if self.path == "/players" and self.headers.get("Content-Type") == BINARY_CONTENT_TYPE:
+            self._binary_update(body)
+            return
+
         try:
-            body = self.rfile.read(length)
             data = json.loads(body.decode("utf-8"))
         except Exception:
             self._json(400, {"error": "invalid_json"})
             return
+        if not isinstance(data, dict):
+            self._json(400, {"error": "invalid_json"})
+            return
 
         # Added: Handle Chat Post
         if self.path == "/chat":
@@ -74,26 +297,384 @@ class Handler(BaseHTTPRequestHandler):
                 map_name = str(data["map"])
                 moving = bool(data["moving"])
                 direction = str(data["direction"])
+                check_state(x, y)
             except (ValueError, TypeError):
                 self._json(400, {"error": "bad_fields"})
                 return
 
-            ok = PLAYER_HANDLER.update(pid, x, y, map_name, moving, direction)
+            try:
+                ok = self._update(pid, (x, y, map_name, moving, direction, 0.0, 0.0, None))
+            except ValueError:
+                self._json(400, {"error": "map_table_full"})
+                return
             if not ok:
                 self._json(404, {"error": "player_not_found"})
                 return
 
             self._json(200, {"success": True})
 
+    def _binary_update(self, body: bytes) -> None:
+        try:
+            pid, x, y, map_id, moving, direction = decode_update(body)
+        except (struct.error, ValueError):
+            self._json(400, {"error": "bad_fields"})
+            return
+        map_name = MAP_TABLE.name(map_id)
+        if map_name is None:
+            self._json(400, {"error": "unknown_map"})
+            return
+        if not self._update(pid, (x, y, map_name, moving, direction, 0.0, 0.0, None)):
+            self._json(404, {"error": "player_not_found"})
+            return
+        self._json(200, {"success": True})
+
+    def _sync(self, body: bytes) -> None:
+        """
+        One round trip per client cycle: applies the client's state and outgoing chat, then
+        answers with the players delta since `since` and the chat messages after `chat_after`.
+        """
+        binary = self.headers.get("Content-Type") == BINARY_CONTENT_TYPE
+        try:
+            data = decode_sync_request(body, MAP_TABLE) if binary else json.loads(body.decode("utf-8"))
+            pid, state, chat, since, chat_after, radius, receive = parse_sync(data)
+        except (ValueError, TypeError, KeyError, struct.error):
+            self._json(400, {"error": "bad_fields"})
+            return
+
+        try:
+            ok, encoded, ack = sync_player(pid, state, since, radius, binary, receive)
+        except ValueError:
+            self._json(400, {"error": "map_table_full"})
+            return
+        if not ok:
+            self._json(404, {"error": "player_not_found"})
+            return
+        for text in chat:
+            PLAYER_HANDLER.add_message(pid, text)
+
+        messages = PLAYER_HANDLER.get_messages(after=chat_after) if receive else []
+        self._sync_response(binary, encoded, messages, ack)
+
+    def _sync_response(self, binary: bool, players: bytes | None, messages: list[dict], ack: tuple | None) -> None:
+        # `players` is already encoded (None when not requested)
+        if binary:
+            self._send(200, encode_sync_response(players or b"", messages, ack), BINARY_CONTENT_TYPE)
+            return
+        data = b'{"players": ' + (b"null" if players is None else players) + b', "messages": ' + json.dumps(messages).encode("utf-8")
+        if ack:
+            data += b', "ack": ' + json.dumps(list(ack)).encode("utf-8")
+        self._send(200, data + b"}", "application/json")
+
+    @staticmethod
+    def _update(pid: int, state: tuple) -> bool:
+        # state: (x, y, map, moving, direction, vx, vy, seq or None), as parsed by _sync
+        if SHARDS is not None:
+            return SHARDS.update(pid, state)
+        return PLAYER_HANDLER.update(pid, *state)
+
+    @staticmethod
+    def _players_query(query: dict) -> tuple[int | None, int | None, float]:
+        since = int(query["since"][0]) if "since" in query else None
+        pid = int(query["id"][0]) if "id" in query else None
+        radius = view_radius(float(query["radius"][0])) if "radius" in query else DEFAULT_VIEW_RADIUS
+        return since, pid, radius
+
+    def _stream(self, pid: int | None, radius: float) -> None:
+        if SHARDS is not None and pid is None:
+            # Everyone on every shard has no shared cursor to stream deltas against
+            self._json(400, {"error": "id_required"})
+            return
+        known = pid is None or (SHARDS.has_player(pid) if SHARDS is not None else PLAYER_HANDLER.has_player(pid))
+        if not known:
+            # Once the stream has started, a client can't tell this from a dropped connection
+            self._json(404, {"error": "player_not_found"})
+            return
+        if not STREAM_SLOTS.acquire(blocking=False):
+            self._json(503, {"error": "too_many_streams"})
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            # Start with a full snapshot: the whole chat history, then players.
+            # After that only player deltas and new messages are pushed, at most once per tick.
+            chat_seq = BROADCASTER.current.chat_seq
+            messages = PLAYER_HANDLER.get_messages(until=chat_seq)
+            self._event("chat", {"messages": messages, "reset": True})
+            if SHARDS is not None:
+                self._sharded_stream(pid, radius, chat_seq)
+                return
+            players_version = None
+            # With an id, radius <= 0 means everyone (as for /sync)
+            view_pid = pid if radius > 0 else None
+            while True:
+                snapshot = BROADCASTER.wait_for_change(
+                    -1 if players_version is None else players_version, chat_seq, STREAM_KEEPALIVE
+                )
+                if snapshot.version == players_version and snapshot.chat_seq == chat_seq:
+                    self.wfile.write(b": keep-alive\n\n")
+                    self._response_bytes += 14
+                    self.wfile.flush()
+                    continue
+
+                if snapshot.version != players_version:
+                    delta = BROADCASTER.view(view_pid, players_version, radius)
+                    if delta is None:
+                        return # Subscriber's player was removed
+                    # Changes outside the subscriber's area produce empty deltas, skip those
+                    if delta["full"] or delta["players"] or delta["removed"]:
+                        self._event("players", delta)
+                    players_version = delta["version"]
+                if snapshot.chat_seq != chat_seq:
+                    # Only up to this snapshot's sequence, newer messages go out with the next tick
+                    messages = PLAYER_HANDLER.get_messages(after=chat_seq, until=snapshot.chat_seq)
+                    self._event("chat", {"messages": messages})
+                    chat_seq = snapshot.chat_seq
+        except (BrokenPipeError, ConnectionResetError, TimeoutError, ShardError):
+            pass # Subscriber went away
+        finally:
+            STREAM_SLOTS.release()
+
+    def _sharded_stream(self, pid: int, radius: float, chat_seq: int) -> None:
+        """Push loop in sharded mode: asks the player's shard for a delta once per tick."""
+        players_version = None
+        last_write = time.monotonic()
+        while True:
+            # Wakes up for new chat right away, for players at the tick rate
+            snapshot = BROADCASTER.wait_for_change(BROADCASTER.current.version, chat_seq, 1.0 / BROADCASTER.tick_rate)
+            delta = SHARDS.view_dict(pid, players_version, radius)
+            if delta is None:
+                return # Subscriber's player was removed
+            if delta["full"] or delta["players"] or delta["removed"]:
+                self._event("players", delta)
+                last_write = time.monotonic()
+            players_version = delta["version"]
+            if snapshot.chat_seq != chat_seq:
+                messages = PLAYER_HANDLER.get_messages(after=chat_seq, until=snapshot.chat_seq)
+                self._event("chat", {"messages": messages})
+                chat_seq = snapshot.chat_seq
+                last_write = time.monotonic()
+            if time.monotonic() - last_write >= STREAM_KEEPALIVE:
+                self.wfile.write(b": keep-alive\n\n")
+                self._response_bytes += 14
+                self.wfile.flush()
+                last_write = time.monotonic()
+
+    def _event(self, name: str, obj: object) -> None:
+        data = f"event: {name}\ndata: {json.dumps(obj)}\n\n".encode("utf-8")
+        self.wfile.write(data)
+        self.wfile.flush()
+        self._response_bytes += len(data)
+
+    def _metrics(self) -> str:
+        snapshot = BROADCASTER.current
+        snapshot_stats = BROADCASTER.stats()
+        lines = METRICS.render("monstergo_http")
+        lines.append("# TYPE monstergo_players gauge")
+        if SHARDS is not None:
+            players_per_map = SHARDS.player_counts()
+        else:
+            players_per_map = Counter(p["map"] for p in snapshot.players.values())
+        for map_name, n in sorted(players_per_map.items()):
+            lines.append(gauge("monstergo_players", n, {"map": map_name}))
+        lines += [
+            "# TYPE monstergo_chat_messages_total counter",
+            gauge("monstergo_chat_messages_total", snapshot.chat_seq),
+            "# TYPE monstergo_snapshots_built_total counter",
+            gauge("monstergo_snapshots_built_total", snapshot_stats["snapshots_built"]),
+            "# TYPE monstergo_snapshot_tick_overruns_total counter",
+            gauge("monstergo_snapshot_tick_overruns_total", snapshot_stats["tick_overruns"]),
+            "# TYPE monstergo_snapshot_age_seconds gauge",
+            gauge("monstergo_snapshot_age_seconds", round(snapshot_stats["snapshot_age_ms"] / 1000.0, 4)),
+        ]
+        if hasattr(self.server, "connection_stats"):
+            connections = self.server.connection_stats()
+            lines += [
+                "# TYPE monstergo_http_connections_total counter",
+                gauge("monstergo_http_connections_total", connections["connections_total"]),
+                "# TYPE monstergo_http_connections_open gauge",
+                gauge("monstergo_http_connections_open", connections["connections_open"]),
+            ]
+        lines += PLAYER_HANDLER.lock_metrics("monstergo_player_lock")
+        return "\n".join(lines) + "\n"
+
     # Utility for JSON responses
     def _json(self, code: int, obj: object) -> None:
-        data = json.dumps(obj).encode("utf-8")
+        self._send(code, json.dumps(obj).encode("utf-8"), "application/json")
+
+    def _send(self, code: int, data: bytes, content_type: str) -> None:
         self.send_response(code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(data)))
         self.end_headers()
         self.wfile.write(data)
+        self._response_bytes += len(data)
+        self._response_body = data
+        self._response_type = content_type
+
+def parse_sync(data: dict) -> tuple[int, tuple | None, list[str], int | None, int, float, bool]:
+    """
+    (id, state, chat, since, chat_after, radius, receive) of a decoded /sync body, with state as
+    (x, y, map, moving, direction, vx, vy, seq or None). Raises ValueError, TypeError or KeyError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("sync request is not an object")
+    state = data.get("state")
+    if state and not isinstance(state, dict):
+        raise ValueError("state is not an object")
+    if state:
+        state = (float(state["x"]), float(state["y"]), str(state["map"]),
+                 bool(state["moving"]), str(state["direction"]),
+                 float(state.get("vx") or 0.0), float(state.get("vy") or 0.0),
+                 None if state.get("seq") is None else int(state["seq"]))
+        check_state(state[0], state[1], state[5], state[6])
+    chat = data.get("chat") or []
+    if not isinstance(chat, list) or not all(isinstance(text, str) for text in chat):
+        raise ValueError("chat is not a list of strings")
+    chat_after = int(data.get("chat_after") or 0)
+    if chat_after < 0:
+        raise ValueError("negative chat cursor")
+    return (
+        int(data["id"]),
+        state,
+        chat,
+        None if data.get("since") is None else int(data["since"]),
+        chat_after,
+        view_radius(float(data.get("radius") or 0.0)),
+        bool(data.get("receive", True)),
+    )
+
+def sync_player(pid: int, state: tuple | None, since: int | None, radius: float, binary: bool, receive: bool) -> tuple[bool, bytes | None, tuple | None]:
+    """Applies `state` and returns (player known, encoded view or None, ack of a sequenced state or None)."""
+    if SHARDS is not None:
+        # The player's shard applies the state and encodes the view in one call
+        return SHARDS.sync(pid, state, since, radius, binary, receive)
+    ok = PLAYER_HANDLER.update(pid, *state) if state else PLAYER_HANDLER.has_player(pid)
+    # Sequenced states are answered with the position the server accepted
+    ack = PLAYER_HANDLER.ack(pid) if ok and state and state[7] is not None else None
+    encoded = None
+    if ok and receive:
+        players = BROADCASTER.view(pid if radius > 0 else None, since, radius)
+        ok = players is not None
+        encoded = BROADCASTER.encode(players, radius <= 0, binary) if ok else None
+    return ok, encoded, ack
+
+def sync_datagram(data: dict) -> tuple[bool, bytes | None]:
+    """DatagramServer callback: a binary /sync without chat."""
+    pid, state, _, since, _, radius, receive = parse_sync(data)
+    ok, encoded, ack = sync_player(pid, state, since, radius, True, receive)
+    if not ok or (encoded is None and ack is None):
+        return ok, None
+    return True, encode_sync_response(encoded or b"", None, ack)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Monster Go online server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--mode", choices=SERVER_MODES, default=DEFAULT_MODE,
+                        help="single: one request at a time, threaded: thread per connection, pool: bounded worker pool")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="number of worker threads in pool mode")
+    parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="connections that may wait for a pool worker before new ones get 503")
+    parser.add_argument("--max-streams", type=int, default=None,
+                        help="maximum concurrent /stream subscribers (default: a third of the pool workers)")
+    parser.add_argument("--tick-rate", type=float, default=DEFAULT_TICK_RATE,
+                        help="snapshots built per second")
+    parser.add_argument("--no-keep-alive", action="store_true",
+                        help="close the connection after every response (HTTP/1.0), for comparison")
+    parser.add_argument("--max-speed", type=float, default=0.0,
+                        help="clamp player moves faster than this many pixels per second (0: trust clients)")
+    parser.add_argument("--shards", default=None,
+                        help="run players in worker processes: a count (maps hashed over them) "
+                             "or ;-separated map groups, e.g. \"map.tmx,map2.tmx;gym.tmx\"")
+    parser.add_argument("--udp-port", type=int, default=None,
+                        help="also take position updates and answer with snapshots over UDP on this port")
+    parser.add_argument("--udp-loss", type=float, default=0.0,
+                        help="fraction of UDP datagrams dropped on purpose, for testing")
+    parser.add_argument("--udp-public-port", type=int, default=None,
+                        help="UDP port announced to clients (default: --udp-port), e.g. a tools/netsim.py proxy in front of it")
+    parser.add_argument("--capture", default=None,
+                        help="record every request and response to this file, for tools/replay.py")
+    parser.add_argument("--access-log", default="-",
+                        help="access log file, '-' for stderr")
+    parser.add_argument("--log-sample", type=float, default=1.0,
+                        help="fraction of successful requests written to the access log")
+    parser.add_argument("--no-access-log", action="store_true",
+                        help="disable the access log (e.g. for benchmarks)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    print(f"[Server] Running on localhost with port {PORT}")
-    HTTPServer(("0.0.0.0", PORT), Handler).serve_forever()
\ No newline at end of file
+    args = parse_args()
+    max_streams = args.max_streams if args.max_streams is not None else max(1, int(args.workers * STREAM_WORKER_SHARE))
+    if args.mode == "pool" and max_streams >= args.workers:
+        raise SystemExit("--max-streams must be below --workers, or streams could hold every worker")
+    if args.mode == "single":
+        max_streams = 0 # A stream would block the only thread forever
+    STREAM_SLOTS = threading.BoundedSemaphore(max_streams)
+    if args.tick_rate <= 0:
+        raise SystemExit("--tick-rate must be positive")
+    BROADCASTER.tick_rate = args.tick_rate
+    if args.max_speed < 0:
+        raise SystemExit("--max-speed must not be negative")
+    PLAYER_HANDLER.max_speed = args.max_speed
+    if not 0.0 <= args.log_sample <= 1.0:
+        raise SystemExit("--log-sample must be between 0 and 1")
+    if args.shards:
+        try:
+            groups = parse_shards(args.shards)
+        except ValueError as e:
+            raise SystemExit(f"--shards: {e}")
+        # Forked before any thread of ours has started (the shards get a copy of this process)
+        SHARDS = ShardRouter(groups, MAP_TABLE, args.tick_rate, args.max_speed, PLAYER_HANDLER.timeout)
+        SHARDS.start()
+    # Started only now, so a forked shard never inherits their locks in a held state
+    PLAYER_HANDLER.start()
+    BROADCASTER.start()
+    if not 0.0 <= args.udp_loss < 1.0:
+        raise SystemExit("--udp-loss must be at least 0 and below 1")
+    if args.capture:
+        CAPTURE = Capture(args.capture)
+        CAPTURE.start()
+    if args.udp_port is not None:
+        DATAGRAMS = DatagramServer(("0.0.0.0", args.udp_port), MAP_TABLE, sync_datagram, args.udp_loss, CAPTURE)
+        DATAGRAMS.start()
+        UDP_PUBLIC_PORT = args.udp_public_port
+    if args.no_access_log:
+        log_out = None
+    elif args.access_log == "-":
+        log_out = sys.stderr
+    else:
+        log_out = open(args.access_log, "a", encoding="utf-8")
+    ACCESS_LOG = AccessLog(log_out, args.log_sample)
+    ACCESS_LOG.start()
+    if args.no_keep_alive or args.mode == "single":
+        # A persistent client would hold the single thread forever
+        Handler.protocol_version = "HTTP/1.0"
+    httpd = make_server(args.mode, ("0.0.0.0", args.port), Handler, args.workers, args.queue)
+    workers = f", {args.workers} workers" if args.mode == "pool" else ""
+    print(f"[Server] Running on localhost with port {args.port} ({args.mode} mode{workers})")
+    if SHARDS is not None:
+        print(f"[Server] {len(SHARDS.shards)} shards: {SHARDS.describe()}")
+    if DATAGRAMS is not None:
+        print(f"[Server] UDP on port {args.udp_port} (loss {args.udp_loss:g})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if DATAGRAMS is not None:
+            DATAGRAMS.stop()
+        BROADCASTER.stop()
+        PLAYER_HANDLER.stop()
+        if SHARDS is not None:
+            SHARDS.stop()
+        ACCESS_LOG.stop()
+        if log_out is not None and log_out is not sys.stderr:
+            log_out.close()
+        CAPTURE.stop()
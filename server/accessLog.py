@@ -0,0 +1,102 @@
+import queue
+import random
+import sys
+import threading
+import time
+from typing import TextIO
+
+# Records waiting for the writer; when it can't keep up, new records are dropped instead of
+# blocking request handling
+QUEUE_SIZE = 10000
+# Seconds stop() waits for room to queue its stop marker, and then for the writer to finish
+STOP_TIMEOUT = 2.0
+
+
+class AccessLog:
+    """
+    Access log written by a background thread. Request threads only format a short line and
+    put it on a queue; the writer drains the queue in batches. Lines are key=value pairs:
+
+        ts=2025-01-01T12:00:00.123 client=127.0.0.1 method=GET path=/players code=200 ms=0.41 bytes=951
+
+    `sample_rate` is the fraction of requests logged (errors and server messages always are).
+    """
+    enabled: bool
+    sample_rate: float
+    dropped: int
+    _out: TextIO | None
+    _queue: queue.Queue
+    _thread: threading.Thread | None
+
+    def __init__(self, out: TextIO | None = sys.stderr, sample_rate: float = 1.0):
+        # out=None disables logging entirely
+        self.enabled = out is not None
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self._out = out
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = None
+
+    # Threading
+    def start(self) -> None:
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._writer, name="AccessLogWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Writes what is queued and stops the writer."""
+        if self._thread and self._thread.is_alive():
+            # Blocks until there is room: a full queue would otherwise drop the stop marker and
+            # the writer would never see it
+            try:
+                self._queue.put(None, timeout=STOP_TIMEOUT)
+            except queue.Full:
+                return
+            self._thread.join(timeout=STOP_TIMEOUT)
+
+    def _writer(self) -> None:
+        while True:
+            lines = [self._queue.get()]
+            # Whatever else piled up goes out in the same write
+            while len(lines) < 1000:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in lines
+            try:
+                self._out.write("".join(line for line in lines if line is not None))
+                self._out.flush()
+            except (OSError, ValueError):
+                pass # Log file gone; keep serving
+            if done:
+                return
+
+    # Records
+    def request(self, client: str, method: str, path: str, code: int, seconds: float, size: int) -> None:
+        if not self.enabled:
+            return
+        if code < 400 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        self._put(
+            f"ts={self._timestamp()} client={client} method={method} path={path} "
+            f"code={code} ms={seconds * 1000.0:.2f} bytes={size}\n"
+        )
+
+    def message(self, client: str, text: str) -> None:
+        """Server messages (timeouts, malformed requests), never sampled."""
+        if not self.enabled:
+            return
+        self._put(f'ts={self._timestamp()} client={client} msg="{text.replace(chr(34), chr(39))}"\n')
+
+    def _put(self, line: str | None) -> None:
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    @staticmethod
+    def _timestamp() -> str:
+        now = time.time()
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)) + f".{int(now % 1 * 1000):03d}"
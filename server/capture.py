@@ -0,0 +1,218 @@
+"""
+Traffic capture: every request and response with its timing, in a compact file that
+tools/replay.py plays back against a server or into a headless client.
+
+The file is gzip-compressed. After the magic line, each record is a fixed header followed by
+three variable-length fields:
+
+    header      <B I d f H B B H I I   kind, source, time (s since the capture started),
+                                       duration (s), status, request type, response type,
+                                       target length, request length, response length
+    target      utf-8                  "GET /players?since=3" / datagram: "" / event: its name
+    request     bytes                  request body (datagram sent to the server)
+    response    bytes                  response body (datagram sent back, event data)
+
+Kinds: 1 = HTTP exchange, 2 = UDP datagram, 3 = server-sent event (client captures only).
+The source numbers a connection (UDP: a client address), so a replay keeps the shape of the
+traffic. Types are indexes into CONTENT_TYPES; anything else is recorded as 0.
+"""
+import gzip
+import itertools
+import os
+import queue
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator, NamedTuple
+
+from server.protocol import BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE
+
+MAGIC = b"MONSTERGO-CAPTURE 1\n"
+# Records waiting for the writer; when it can't keep up, new records are dropped instead of
+# blocking request handling (as for the access log)
+QUEUE_SIZE = 10000
+
+KIND_HTTP = 1
+KIND_DATAGRAM = 2
+KIND_EVENT = 3
+
+CONTENT_TYPES = ("", JSON_CONTENT_TYPE, BINARY_CONTENT_TYPE, "text/event-stream")
+_TYPE_IDS = {name: i for i, name in enumerate(CONTENT_TYPES)}
+
+_RECORD = struct.Struct("<BIdfHBBHII")
+
+
+class Exchange(NamedTuple):
+    kind: int
+    source: int
+    # Seconds since the capture started, when the request was sent / the datagram or event arrived
+    t: float
+    duration: float
+    status: int
+    target: str
+    request_type: str
+    request: bytes
+    response_type: str
+    response: bytes
+
+    @property
+    def method(self) -> str:
+        return self.target.partition(" ")[0]
+
+    @property
+    def path(self) -> str:
+        """Path of an HTTP target, without the query."""
+        return self.target.partition(" ")[2].partition("?")[0]
+
+
+class Capture:
+    """
+    Capture file written by a background thread; callers only pack a record and queue it.
+    path=None disables capturing. Starting again after stop appends to the same file.
+    """
+    enabled: bool
+    path: str | None
+    records: int
+    dropped: int
+    # Monotonic time the capture's clock counts from
+    _origin: float
+    _sources: itertools.count
+    _queue: queue.Queue
+    _thread: threading.Thread | None
+    _file: BinaryIO | None
+    _opened: bool
+
+    def __init__(self, path: str | None = None):
+        self.enabled = bool(path)
+        self.path = path
+        self.records = 0
+        self.dropped = 0
+        self._origin = time.monotonic()
+        self._sources = itertools.count(1)
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = None
+        self._file = None
+        self._opened = False
+
+    # Threading
+    def start(self) -> None:
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        # The first start truncates a capture left from an earlier run
+        self._file = gzip.open(self.path, "ab" if self._opened else "wb")
+        if not self._opened:
+            self._file.write(MAGIC)
+        self._opened = True
+        self._thread = threading.Thread(target=self._writer, name="CaptureWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Writes what is queued, stops the writer and closes the file."""
+        if self._thread and self._thread.is_alive():
+            # A blocking put: on a full queue put_nowait would drop the stop marker
+            try:
+                self._queue.put(None, timeout=2.0)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=2.0)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _writer(self) -> None:
+        while True:
+            records = [self._queue.get()]
+            while len(records) < 1000:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in records
+            try:
+                self._file.write(b"".join(r for r in records if r is not None))
+                # A sync flush per batch keeps the file readable up to here if the process dies
+                self._file.flush()
+            except (OSError, ValueError):
+                pass # Disk full or similar; keep serving
+            if done:
+                return
+
+    # Records
+    def new_source(self) -> int:
+        return next(self._sources)
+
+    def clock(self) -> float:
+        """Seconds since the capture started; record times are on this clock."""
+        return time.monotonic() - self._origin
+
+    def exchange(self, source: int, t: float, duration: float, method: str, target: str, status: int,
+                 request_type: str, request: bytes, response_type: str, response: bytes) -> None:
+        """One HTTP request and its response; `t` is from clock() when the request started."""
+        self._record(KIND_HTTP, source, t, duration, status, f"{method} {target}",
+                     request_type, request, response_type, response)
+
+    def datagram(self, source: int, t: float, request: bytes, response: bytes = b"", duration: float = 0.0) -> None:
+        """A datagram to the server and its answer; either may be empty (lost or not awaited)."""
+        self._record(KIND_DATAGRAM, source, t, duration, 0, "", "", request, "", response)
+
+    def event(self, source: int, t: float, name: str, data: bytes) -> None:
+        self._record(KIND_EVENT, source, t, 0.0, 0, name, "", b"", JSON_CONTENT_TYPE, data)
+
+    def _record(self, kind: int, source: int, t: float, duration: float, status: int, target: str,
+                request_type: str, request: bytes, response_type: str, response: bytes) -> None:
+        if not self.enabled:
+            return
+        encoded = target.encode("utf-8")[:0xFFFF]
+        header = _RECORD.pack(
+            kind, source, t, duration, status, _TYPE_IDS.get(_base_type(request_type), 0),
+            _TYPE_IDS.get(_base_type(response_type), 0), len(encoded), len(request), len(response)
+        )
+        self._put(b"".join((header, encoded, request, response)))
+
+    def _put(self, record: bytes | None) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if record is not None:
+            self.records += 1
+
+    def stats(self) -> dict:
+        return {"path": self.path, "records": self.records, "dropped": self.dropped}
+
+
+def _base_type(content_type: str | None) -> str:
+    return (content_type or "").partition(";")[0].strip()
+
+
+def read_capture(path: str | os.PathLike) -> Iterator[Exchange]:
+    """
+    Yields the records of a capture file in the order they were written. A file cut short (the
+    process was killed) ends at its last complete record. Raises ValueError if it is not a capture.
+    """
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a capture file")
+        while True:
+            try:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return
+                (kind, source, t, duration, status, request_type, response_type,
+                 target_len, request_len, response_len) = _RECORD.unpack(header)
+                target = f.read(target_len)
+                request = f.read(request_len)
+                response = f.read(response_len)
+            except EOFError:
+                return
+            if len(response) < response_len:
+                return
+            yield Exchange(
+                kind, source, t, duration, status, target.decode("utf-8", errors="replace"),
+                _type_name(request_type), request, _type_name(response_type), response
+            )
+
+
+def _type_name(type_id: int) -> str:
+    return CONTENT_TYPES[type_id] if type_id < len(CONTENT_TYPES) else ""
@@ -0,0 +1,191 @@
+"""
+Optional UDP transport for position updates and player snapshots (datagram format in
+server/protocol.py). A lost or late datagram costs nothing: each carries the newest state, and
+answers are deltas against the client's cursor, so the next one covers what was missed.
+Registration and chat stay on HTTP.
+"""
+import hmac
+import random
+import secrets
+import socket
+import struct
+import threading
+from typing import Callable
+
+from server.capture import Capture
+from server.protocol import MapTable, DATAGRAM_STATE, DATAGRAM_REPLY, decode_datagram, encode_datagram, decode_sync_request
+
+# Answers larger than this are not sent (the client keeps its previous view). Fine on localhost;
+# across a real network the view radius should keep answers near 1400 bytes to avoid fragmentation
+MAX_DATAGRAM = 65000
+RECEIVE_TIMEOUT = 0.5 # seconds between checks for stop
+
+
+class DatagramServer:
+    """
+    Answers client state datagrams on one thread. `sync` applies a decoded sync request (as for
+    POST /sync) and returns (player known, encoded answer or None when there is nothing to send).
+    `loss` drops that fraction of datagrams in both directions, to test on localhost. Datagrams
+    that arrive are recorded to `capture` with their answer (if any was sent).
+
+    Only states carrying the player's token (see token()) are answered: UDP source addresses
+    can be forged, and an answer is far larger than the datagram asking for it.
+    """
+    address: tuple[str, int]
+    loss: float
+    _maps: MapTable
+    _sync: Callable[[dict], tuple[bool, bytes | None]]
+    _capture: Capture | None
+    # Key of the player tokens; a restart invalidates them along with the player ids
+    _secret: bytes
+    # Client address -> capture source number
+    _sources: dict[tuple[str, int], int]
+    _sock: socket.socket | None
+    _thread: threading.Thread | None
+    _stop_event: threading.Event
+    # Player id -> newest sequence number received from it / of the last answer sent to it
+    _received: dict[int, int]
+    _sent: dict[int, int]
+
+    # Counters for /stats
+    received: int
+    answered: int
+    stale: int
+    lost: int
+    bad: int
+    oversize: int
+    unverified: int
+    errors: int
+
+    def __init__(self, address: tuple[str, int], maps: MapTable, sync: Callable[[dict], tuple[bool, bytes | None]], loss: float = 0.0,
+                 capture: Capture | None = None):
+        self.address = address
+        self.loss = loss
+        self._maps = maps
+        self._sync = sync
+        self._capture = capture if capture is not None and capture.enabled else None
+        self._secret = secrets.token_bytes(32)
+        self._sources = {}
+        self._sock = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._received = {}
+        self._sent = {}
+
+        self.received = 0
+        self.answered = 0
+        self.stale = 0
+        self.lost = 0
+        self.bad = 0
+        self.oversize = 0
+        self.unverified = 0
+        self.errors = 0
+
+    def token(self, pid: int, host: str) -> int:
+        """
+        The token a player's datagrams must carry, given at registration. It is tied to the host
+        that registered over TCP (which can't be forged), so answers only ever go back there.
+        """
+        digest = hmac.digest(self._secret, f"{pid}@{host}".encode("utf-8"), "sha256")
+        return int.from_bytes(digest[:8], "little")
+
+    # Threading
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(self.address)
+        self._sock.settimeout(RECEIVE_TIMEOUT)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name="DatagramServer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+        if self._sock is not None:
+            self._sock.close()
+
+    def _serve(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                data, client = self._sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            started = self._capture.clock() if self._capture else 0.0
+            try:
+                answer = self._handle(data, client)
+            except Exception:
+                # A shard that died or similar; the client retries with its next datagram
+                self.errors += 1
+                answer = b""
+            if self._capture:
+                source = self._sources.get(client)
+                if source is None:
+                    source = self._sources[client] = self._capture.new_source()
+                self._capture.datagram(source, started, data, answer, self._capture.clock() - started)
+
+    def _handle(self, data: bytes, client: tuple[str, int]) -> bytes:
+        """The answer datagram sent, empty if none was."""
+        if self._dropped():
+            return b""
+        try:
+            kind, seq, token, payload = decode_datagram(data)
+            if kind != DATAGRAM_STATE:
+                raise ValueError(f"unexpected datagram kind {kind}")
+            body = decode_sync_request(payload, self._maps)
+        except (struct.error, ValueError, UnicodeDecodeError):
+            self.bad += 1
+            return b""
+        pid = body["id"]
+        if not hmac.compare_digest(token.to_bytes(8, "little"), self.token(pid, client[0]).to_bytes(8, "little")):
+            self.unverified += 1
+            return b""
+        self.received += 1
+
+        if seq <= self._received.get(pid, -1):
+            # Overtaken by a newer datagram
+            self.stale += 1
+            return b""
+        self._received[pid] = seq
+
+        known, answer = self._sync(body)
+        if not known:
+            self._received.pop(pid, None)
+            self._sent.pop(pid, None)
+            return b""
+        if answer is None:
+            return b""
+        self._sent[pid] = self._sent.get(pid, 0) + 1
+        datagram = encode_datagram(DATAGRAM_REPLY, self._sent[pid], answer)
+        if len(datagram) > MAX_DATAGRAM:
+            self.oversize += 1
+            return b""
+        if self._dropped():
+            return b""
+        self._sock.sendto(datagram, client)
+        self.answered += 1
+        return datagram
+
+    def _dropped(self) -> bool:
+        if self.loss and random.random() < self.loss:
+            self.lost += 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "port": self.address[1],
+            "loss": self.loss,
+            "received": self.received,
+            "answered": self.answered,
+            "stale": self.stale,
+            "lost": self.lost,
+            "bad": self.bad,
+            "oversize": self.oversize,
+            "unverified": self.unverified,
+            "errors": self.errors,
+        }
@@ -0,0 +1,147 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, ThreadingHTTPServer
+
+# Serving modes selectable from the command line
+SERVER_MODES = ("single", "threaded", "pool")
+DEFAULT_MODE = "pool"
+# Kept-alive connections hold a worker each, and a client keeps up to two (sync + push stream)
+DEFAULT_WORKERS = 256
+# Listen backlog: the stdlib default of 5 refuses connections as soon as a few clients poll at once
+LISTEN_BACKLOG = 128
+# Accepted connections that may wait for a free pool worker; past that they get 503 at once
+DEFAULT_QUEUE_SIZE = 128
+_BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+    b"Content-Length: 17\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+    b'{"error": "busy"}'
+)
+
+
+class ConnectionStatsMixin:
+    """Counts accepted and open connections and handled requests, for /stats."""
+    connections_total: int
+    connections_open: int
+    requests_total: int
+    _stats_lock: threading.Lock
+
+    def __init__(self, *args, **kwargs):
+        self.connections_total = 0
+        self.connections_open = 0
+        self.requests_total = 0
+        self._stats_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def verify_request(self, request: socket.socket, client_address) -> bool:
+        with self._stats_lock:
+            self.connections_total += 1
+            self.connections_open += 1
+        return True
+
+    def shutdown_request(self, request: socket.socket) -> None:
+        with self._stats_lock:
+            self.connections_open -= 1
+        super().shutdown_request(request)
+
+    def count_request(self) -> None:
+        with self._stats_lock:
+            self.requests_total += 1
+
+    def connection_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "connections_total": self.connections_total,
+                "connections_open": self.connections_open,
+                "requests_total": self.requests_total,
+                "requests_per_connection": round(self.requests_total / max(1, self.connections_total), 2),
+            }
+
+
+class SingleHTTPServer(ConnectionStatsMixin, HTTPServer):
+    """The original behaviour: one request at a time, kept for comparison."""
+    allow_reuse_address = True
+
+
+class ThreadedHTTPServer(ConnectionStatsMixin, ThreadingHTTPServer):
+    """One thread per connection, no upper bound on threads."""
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+class PooledHTTPServer(ConnectionStatsMixin, HTTPServer):
+    """
+    Hands every accepted connection to a fixed pool of worker threads.
+    At most `workers` connections are served at once and up to `queue_size` more wait for a
+    worker; any connection beyond that is answered 503 and closed by the accepting thread, so a
+    full pool never leaves clients hanging. A kept-alive connection holds its worker until it
+    closes or idles past the handler's keep-alive timeout.
+    """
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+    workers: int
+    queue_size: int
+    rejected: int
+    # Connections submitted to the pool and not finished yet (running + queued)
+    _pending: int
+    _pool: ThreadPoolExecutor
+
+    def __init__(self, server_address, handler_class, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected = 0
+        self._pending = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="HTTPWorker")
+
+    def process_request(self, request: socket.socket, client_address) -> None:
+        with self._stats_lock:
+            busy = self._pending >= self.workers + self.queue_size
+            if busy:
+                self.rejected += 1
+            else:
+                self._pending += 1
+        if busy:
+            self._reject(request)
+            return
+        self._pool.submit(self._process_request_worker, request, client_address)
+
+    def _reject(self, request: socket.socket) -> None:
+        try:
+            # Never block the accept loop on a client that doesn't read
+            request.settimeout(0)
+            request.sendall(_BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _process_request_worker(self, request: socket.socket, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._stats_lock:
+                self._pending -= 1
+
+    def connection_stats(self) -> dict:
+        stats = super().connection_stats()
+        with self._stats_lock:
+            stats.update(pending=self._pending, rejected=self.rejected)
+        return stats
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def make_server(mode: str, address: tuple[str, int], handler_class, workers: int = DEFAULT_WORKERS,
+                queue_size: int = DEFAULT_QUEUE_SIZE) -> HTTPServer:
+    if mode == "single":
+        return SingleHTTPServer(address, handler_class)
+    if mode == "threaded":
+        return ThreadedHTTPServer(address, handler_class)
+    if mode == "pool":
+        return PooledHTTPServer(address, handler_class, workers, queue_size)
+    raise ValueError(f"Unknown server mode: {mode}")
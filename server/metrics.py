@@ -0,0 +1,168 @@
+"""
+Server instrumentation, exposed by GET /metrics in the Prometheus text format (version 0.0.4),
+so any Prometheus-compatible scraper (or curl) can read it.
+"""
+import bisect
+import threading
+import time
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+LOCK_WAIT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+
+class Histogram:
+    """Cumulative-bucket histogram. Not thread-safe; the owner serializes observe/render."""
+    buckets: tuple[float, ...]
+    counts: list[int]
+    total: float
+    count: int
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.total:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class InstrumentedLock:
+    """
+    threading.Lock that records how long callers wait for it. An uncontended acquire only
+    costs a non-blocking try; contended acquires are timed. The counters are updated while
+    the lock is held, so they need no lock of their own.
+    """
+    _lock: threading.Lock
+    acquisitions: int
+    contended: int
+    wait_seconds: Histogram
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = Histogram(LOCK_WAIT_BUCKETS)
+
+    def acquire(self) -> bool:
+        if self._lock.acquire(blocking=False):
+            self.acquisitions += 1
+            return True
+        start = time.perf_counter()
+        self._lock.acquire()
+        waited = time.perf_counter() - start
+        self.acquisitions += 1
+        self.contended += 1
+        self.wait_seconds.observe(waited)
+        return True
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def __enter__(self) -> "InstrumentedLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def render(self, name: str) -> list[str]:
+        with self:
+            # Taken ourselves, so don't count this read
+            self.acquisitions -= 1
+            acquisitions = self.acquisitions
+            contended = self.contended
+            wait = self.wait_seconds.render(f"{name}_wait_seconds", "")
+        return [
+            f"# TYPE {name}_acquisitions_total counter",
+            f"{name}_acquisitions_total {acquisitions}",
+            f"# TYPE {name}_contended_total counter",
+            f"{name}_contended_total {contended}",
+            f"# TYPE {name}_wait_seconds histogram",
+            *wait,
+        ]
+
+
+class RequestMetrics:
+    """Request counts, latency and response size histograms per method and path."""
+    _lock: threading.Lock
+    # (method, path, status code) -> count
+    _requests: dict[tuple[str, str, int], int]
+    # (method, path) -> histogram
+    _latency: dict[tuple[str, str], Histogram]
+    _sizes: dict[tuple[str, str], Histogram]
+    stream_bytes: int
+    _known_paths: frozenset[str]
+
+    def __init__(self, known_paths: tuple[str, ...]):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._latency = {}
+        self._sizes = {}
+        self.stream_bytes = 0
+        self._known_paths = frozenset(known_paths)
+
+    def label(self, path: str) -> str:
+        # Unknown paths share one label so scanners can't blow up the label set
+        return path if path in self._known_paths else "other"
+
+    def observe(self, method: str, path: str, code: int, seconds: float | None, size: int) -> None:
+        """`seconds` is None for long-lived responses (push streams), which only count and add bytes."""
+        path = self.label(path)
+        method = method if method in ("GET", "POST") else "other"
+        key = (method, path)
+        with self._lock:
+            self._requests[(method, path, code)] = self._requests.get((method, path, code), 0) + 1
+            if seconds is None:
+                self.stream_bytes += size
+                return
+            if key not in self._latency:
+                self._latency[key] = Histogram(LATENCY_BUCKETS)
+                self._sizes[key] = Histogram(SIZE_BUCKETS)
+            self._latency[key].observe(seconds)
+            self._sizes[key].observe(size)
+
+    def render(self, prefix: str) -> list[str]:
+        with self._lock:
+            lines = [f"# TYPE {prefix}_requests_total counter"]
+            for (method, path, code), n in sorted(self._requests.items()):
+                lines.append(f'{prefix}_requests_total{{method="{method}",path="{path}",code="{code}"}} {n}')
+            lines.append(f"# TYPE {prefix}_request_duration_seconds histogram")
+            for (method, path), hist in sorted(self._latency.items()):
+                lines.extend(hist.render(f"{prefix}_request_duration_seconds", f'method="{method}",path="{path}"'))
+            lines.append(f"# TYPE {prefix}_response_bytes histogram")
+            for (method, path), hist in sorted(self._sizes.items()):
+                lines.extend(hist.render(f"{prefix}_response_bytes", f'method="{method}",path="{path}"'))
+            lines.append(f"# TYPE {prefix}_stream_bytes_total counter")
+            lines.append(f"{prefix}_stream_bytes_total {self.stream_bytes}")
+        return lines
+
+
+def gauge(name: str, value: float, labels: dict[str, str] | None = None) -> str:
+    if labels:
+        escaped = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+        return f"{name}{{{escaped}}} {value}"
+    return f"{name} {value}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
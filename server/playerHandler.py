@@ -1,56 +1,122 @@
 import threading
 import time
-import copy
+import heapq
+import math
 from dataclasses import dataclass
 from typing import Dict, Optional, List
 
+from server.metrics import InstrumentedLock
+from server.playerTable import PlayerTable
+from server.protocol import MapTable, pack_flags
+
 TIMEOUT_TIME = 60.0
 CHECK_INTERVAL_TIME = 10.0
+# Removed players remembered for delta responses; older cursors get a full snapshot
+MAX_TOMBSTONES = 1024
+# Area of interest: snapshots index players per map in square cells of this many pixels
+GRID_CELL_SIZE = 512.0
+DEFAULT_VIEW_RADIUS = 1024.0
+# Larger view radii are clamped (a few screen widths); an area query visits every grid cell
+# in its bounding box, so its cost grows with the radius squared
+MAX_VIEW_RADIUS = 4096.0
+# Chat messages kept on the server
+CHAT_CAPACITY = 50
+# Seconds a position is extrapolated from the last reported velocity; clients that only send
+# when they deviate from the extrapolation still send a heartbeat well within this
+MAX_EXTRAPOLATION = 2.0
+# With a speed limit, distance allowed on top of it, for reports that arrive bunched up
+MAX_SPEED_SLACK = 64.0
+
+def cell_of(x: float, y: float) -> tuple[int, int]:
+    return int(x // GRID_CELL_SIZE), int(y // GRID_CELL_SIZE)
+
+def view_radius(radius: float) -> float:
+    """A client's view radius clamped to MAX_VIEW_RADIUS (<= 0 still means everyone). Raises ValueError if not finite."""
+    if not math.isfinite(radius):
+        raise ValueError("radius is not finite")
+    return min(radius, MAX_VIEW_RADIUS)
 
 @dataclass
 class Player:
+    """Bookkeeping for one player; what others see (position, map, ...) is in the PlayerTable."""
     id: int
-    x: float
-    y: float
-    map: str
+    # Slot in PlayerHandler.table
+    slot: int
     last_update: float
-    moving: bool
-    direction: str
-
-    def update(self, x: float, y: float, map: str, moving:bool, direction:str) -> None:
-        if x != self.x or y != self.y or map != self.map:
-            self.last_update = time.monotonic()
-        self.x = x
-        self.y = y
-        self.map = map
-        self.moving = moving
-        self.direction = direction
-
-    def is_inactive(self) -> bool:
-        now = time.monotonic()
-        return (now - self.last_update) >= TIMEOUT_TIME
+    # Last reported position and velocity (pixels per second) and when it arrived, to extrapolate from
+    sent_x: float = 0.0
+    sent_y: float = 0.0
+    vx: float = 0.0
+    vy: float = 0.0
+    sent_at: float = 0.0
+    # Client input sequence number of the last applied report (0: none)
+    seq: int = 0
 
 
 class PlayerHandler:
-    _lock: threading.Lock
+    # Pixels per second a player can plausibly move; faster reports are clamped (0: no limit)
+    max_speed: float
+    # Records time spent waiting for it, for /metrics
+    _lock: InstrumentedLock
     _stop_event: threading.Event
     _thread: threading.Thread | None
+    _timeout: float
+    _check_interval: float
+    # (expiry time, player id), one entry per player; an entry may be stale if the player
+    # moved since it was pushed, in which case it is pushed again with the real expiry
+    _expiry: List[tuple[float, int]]
+    # Player ids with an entry in _expiry. A player removed and registered again (a shard
+    # handoff there and back) reuses its old entry instead of getting a second one
+    _expiring: set[int]
     
     players: Dict[int, Player]
+    # Visible state of every player, one slot each (see server/playerTable.py)
+    table: PlayerTable
+    # Map ids for the table's map column
+    maps: MapTable
     _next_id: int
-    
+    # Bumped on every change to the player list
+    _players_version: int
+    # Removed player id -> version of the removal, oldest first
+    _removed: Dict[int, int]
+    # Deltas can only be computed for cursors at or after this version
+    _delta_floor: int
+    # Players with a velocity whose position is still being extrapolated
+    _moving: set[int]
+
     # Added: Chat storage
-    chat_history: List[dict]
+    # Ring buffer: the message with sequence number n sits at n % CHAT_CAPACITY
+    _chat_ring: List[Optional[dict]]
+    # Sequence number of the newest chat message
+    _chat_seq: int
 
-    def __init__(self, *, timeout_seconds: float = 120.0, check_interval_seconds: float = 5.0):
-        self._lock = threading.Lock()
+    def __init__(self, *, timeout_seconds: float = TIMEOUT_TIME, check_interval_seconds: float = CHECK_INTERVAL_TIME,
+                 maps: MapTable | None = None, table: PlayerTable | None = None, max_speed: float = 0.0):
+        self.max_speed = max_speed
+        self._lock = InstrumentedLock()
         self._stop_event = threading.Event()
         self._thread = None
+        self._timeout = timeout_seconds
+        self._check_interval = check_interval_seconds
+        self._expiry = []
+        self._expiring = set()
         
         self.players = {}
+        self.table = table if table is not None else PlayerTable()
+        self.maps = maps if maps is not None else MapTable()
         self._next_id = 0
-        self.chat_history = [] # Initialize
+        self._players_version = 0
+        self._removed = {}
+        self._delta_floor = 0
+        self._moving = set()
+        self._chat_ring = [None] * CHAT_CAPACITY # Initialize
+        self._chat_seq = 0
         
+    @property
+    def timeout(self) -> float:
+        """Seconds without moving after which a player is evicted."""
+        return self._timeout
+
     # Threading
     def start(self) -> None:
         if self._thread and self._thread.is_alive():
@@ -65,60 +131,216 @@ class PlayerHandler:
             self._thread.join(timeout=2.0)
 
     def _cleaner(self) -> None:
-        while not self._stop_event.wait(CHECK_INTERVAL_TIME):
-            now = time.monotonic()
-            to_remove: list[int] = []
-            with self._lock:
-                for pid, p in list(self.players.items()):
-                    if now - p.last_update >= TIMEOUT_TIME:
-                        to_remove.append(pid)
+        while not self._stop_event.wait(self._check_interval):
+            self.evict_inactive(time.monotonic())
+
+    def evict_inactive(self, now: float) -> list[int]:
+        """
+        Removes players whose last move is `timeout_seconds` old. Only heap entries that look
+        expired are touched, so a pass costs O(k log n) for k due entries instead of a full scan.
+        """
+        to_remove: list[int] = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, pid = heapq.heappop(self._expiry)
+                p = self.players.get(pid)
+                if p is None:
+                    self._expiring.discard(pid)
+                    continue
+                expires = p.last_update + self._timeout
+                if expires > now:
+                    # Moved since this entry was pushed
+                    heapq.heappush(self._expiry, (expires, pid))
+                else:
+                    to_remove.append(pid)
+                    self._expiring.discard(pid)
+            if to_remove:
+                self._players_changed()
                 for pid in to_remove:
-                    _ = self.players.pop(pid, None)
+                    self._remove_player(pid)
+                self._prune_tombstones()
+        return to_remove
                     
     # API
-    def register(self) -> int:
+    def register(self, pid: int | None = None) -> int:
+        """Adds a player. `pid` is given by a sharded front end, which assigns the ids itself."""
         with self._lock:
-            pid = self._next_id
-            self._next_id += 1
-            self.players[pid] = Player(pid, 0.0, 0.0, "", time.monotonic(), False, "down")
+            if pid is None:
+                pid = self._next_id
+            elif pid in self.players:
+                return pid
+            self._next_id = max(self._next_id, pid + 1)
+            # Back on this shard after a handoff: it is in the player list again
+            self._removed.pop(pid, None)
+            self._players_changed()
+            slot = self.table.add(pid, 0.0, 0.0, self.maps.intern(""), pack_flags(False, "down"), self._players_version)
+            p = Player(pid, slot, time.monotonic())
+            self.players[pid] = p
+            if pid not in self._expiring:
+                heapq.heappush(self._expiry, (p.last_update + self._timeout, pid))
+                self._expiring.add(pid)
             return pid
 
-    def update(self, pid: int, x: float, y: float, map_name: str, moving:bool, direction:str) -> bool:
+    def update(self, pid: int, x: float, y: float, map_name: str, moving:bool, direction:str,
+               vx: float = 0.0, vy: float = 0.0, seq: int | None = None) -> bool:
+        """
+        `vx`/`vy` (pixels per second) let extrapolate move the player until its next update.
+        `seq` is the client's input sequence number: older reports are ignored, and ack returns
+        the position accepted for the newest one.
+        """
         with self._lock:
             p = self.players.get(pid)
             if not p:
                 return False
             else:
-                p.update(float(x), float(y), str(map_name), bool(moving), str(direction))
+                # Interned first: a full map table rejects the report before anything changes
+                map_id = self.maps.intern(str(map_name))
+                if seq is not None:
+                    if seq <= p.seq:
+                        return True # Superseded by a report we already have
+                    p.seq = seq
+                now = time.monotonic()
+                x, y = float(x), float(y)
+                flags = pack_flags(bool(moving), str(direction))
+                old = self.table.get(p.slot)
+                if self.max_speed > 0 and p.sent_at and map_id == old[2]:
+                    x, y = self._clamp(p, x, y, now)
+                if (x, y, map_id) != (p.sent_x, p.sent_y, old[2]):
+                    # Only moving keeps a player alive
+                    p.last_update = now
+                p.sent_x, p.sent_y, p.vx, p.vy, p.sent_at = x, y, float(vx), float(vy), now
+                if p.vx or p.vy:
+                    self._moving.add(pid)
+                else:
+                    self._moving.discard(pid)
+                if (x, y, map_id, flags) == old:
+                    return True # Nothing visible changed
+                self._players_changed()
+                self.table.set(p.slot, x, y, map_id, flags, self._players_version)
                 return True
 
-    def list_players(self) -> dict:
+    def ack(self, pid: int) -> tuple[int, float, float] | None:
+        """(seq, x, y) of the player's last sequenced report, with the position as accepted."""
         with self._lock:
-            player_list = {}
-            for p in self.players.values():
-                player_list[p.id] = {
-                    "id": p.id,
-                    "x": p.x,
-                    "y": p.y,
-                    "map": p.map,
-                    "moving": p.moving,
-                    "direction": p.direction
-                }
-            return player_list
+            p = self.players.get(pid)
+            if p is None or not p.seq:
+                return None
+            return p.seq, p.sent_x, p.sent_y
+
+    def _clamp(self, p: Player, x: float, y: float, now: float) -> tuple[float, float]:
+        # Caller must hold _lock. Cuts a move short at the distance max_speed allows since the last report
+        limit = self.max_speed * (now - p.sent_at) + MAX_SPEED_SLACK
+        dx, dy = x - p.sent_x, y - p.sent_y
+        distance = math.hypot(dx, dy)
+        if distance <= limit:
+            return x, y
+        k = limit / distance
+        return p.sent_x + dx * k, p.sent_y + dy * k
+
+    def extrapolate(self, now: float) -> int:
+        """
+        Moves players along their last reported velocity (called once per snapshot tick), so
+        others see them walk between updates. Returns the number of players moved.
+        """
+        moved = 0
+        with self._lock:
+            for pid in list(self._moving):
+                p = self.players.get(pid)
+                if p is None:
+                    self._moving.discard(pid)
+                    continue
+                elapsed = now - p.sent_at
+                if elapsed >= MAX_EXTRAPOLATION:
+                    # No word from the client for too long: leave it where it got to
+                    elapsed = MAX_EXTRAPOLATION
+                    self._moving.discard(pid)
+                x, y, map_id, flags = self.table.get(p.slot)
+                new_x, new_y = p.sent_x + p.vx * elapsed, p.sent_y + p.vy * elapsed
+                if (new_x, new_y) == (x, y):
+                    continue
+                if not moved:
+                    self._players_changed()
+                moved += 1
+                self.table.set(p.slot, new_x, new_y, map_id, flags, self._players_version)
+        return moved
+
+    def remove(self, pid: int) -> bool:
+        with self._lock:
+            if pid not in self.players:
+                return False
+            self._players_changed()
+            self._remove_player(pid)
+            self._prune_tombstones()
+            return True
+
+    def has_player(self, pid: int) -> bool:
+        with self._lock:
+            return pid in self.players
+
+    def snapshot_state(self) -> dict:
+        """
+        Copies everything a read-only snapshot needs (see server/snapshot.py) in one short
+        critical section, so readers never have to take the lock themselves. The players are
+        copied as raw table columns; snapshot.expand_columns turns them into dicts outside the lock.
+        """
+        with self._lock:
+            return {
+                "version": self._players_version,
+                "chat_seq": self._chat_seq,
+                "delta_floor": self._delta_floor,
+                "columns": self.table.read(),
+                "removed": tuple(self._removed.items()),
+            }
+
+    def lock_metrics(self, name: str) -> list[str]:
+        """Acquisitions of and wait time on _lock, as /metrics lines."""
+        return self._lock.render(name)
+
+    def versions(self) -> tuple[int, int]:
+        """Current (players version, chat sequence number)."""
+        with self._lock:
+            return self._players_version, self._chat_seq
+
+    def _remove_player(self, pid: int) -> None:
+        # Caller must hold _lock and have bumped the version for this removal
+        p = self.players.pop(pid, None)
+        if p is None:
+            return
+        self._moving.discard(pid)
+        self.table.remove(p.slot)
+        self._removed[pid] = self._players_version
+
+    def _prune_tombstones(self) -> None:
+        # Caller must hold _lock
+        while len(self._removed) > MAX_TOMBSTONES:
+            pid = next(iter(self._removed))
+            self._delta_floor = self._removed.pop(pid)
 
     # Added: Chat Logic
     def add_message(self, pid: int, text: str) -> None:
         with self._lock:
-            # Simple structure, keeping last 50 messages
+            # Simple structure, keeping last CHAT_CAPACITY messages (the oldest is overwritten)
+            self._chat_seq += 1
             msg = {
+                "seq": self._chat_seq,
                 "from": f"Player {pid}",
                 "text": text,
                 "timestamp": time.time()
             }
-            self.chat_history.append(msg)
-            if len(self.chat_history) > 50:
-                self.chat_history.pop(0)
+            self._chat_ring[self._chat_seq % CHAT_CAPACITY] = msg
 
-    def get_messages(self) -> list[dict]:
+    def get_messages(self, after: int = 0, until: int | None = None) -> list[dict]:
+        """
+        Kept messages with a sequence number greater than `after` and at most `until`, oldest first.
+        A cursor from another server run (newer than the newest message) gets all kept messages.
+        """
         with self._lock:
-            return list(self.chat_history)
\ No newline at end of file
+            last = self._chat_seq if until is None else min(until, self._chat_seq)
+            if after > self._chat_seq or after < 0:
+                after = 0
+            first = max(after, self._chat_seq - CHAT_CAPACITY) + 1
+            return [self._chat_ring[seq % CHAT_CAPACITY] for seq in range(first, last + 1)]
+
+    def _players_changed(self) -> None:
+        # Caller must hold _lock
+        self._players_version += 1
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Struct-of-arrays player store. Every visible player field is a column in a contiguous typed
+array and a player is one slot (index) across the columns; freed slots are reused.
+
+The table is either private to the process (plain `array` columns that grow as needed) or lives
+in a fixed-size `multiprocessing.shared_memory` block, so other processes can read it without
+pickling. Writers serialize among themselves (PlayerHandler._lock); readers in other processes
+use the sequence counter in the header (a seqlock) to get a consistent copy.
+
+Shared layout: header <Q Q (sequence, high-water slot count), then the columns
+x, y (float64), version (int64), id (int32, -1 = free slot), map id (uint16), flags (uint8).
+"""
+import array
+import time
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+DEFAULT_CAPACITY = 1024
+# (name, typecode), widest first so every column stays aligned
+_COLUMNS = (("xs", "d"), ("ys", "d"), ("versions", "q"), ("ids", "i"), ("map_ids", "H"), ("flags", "B"))
+_HEADER = 2 # uint64 words: sequence, high
+_READ_ATTEMPTS = 1000
+
+
+class Columns(NamedTuple):
+    """Consistent copy of the used slots; free slots have id -1."""
+    ids: array.array
+    xs: array.array
+    ys: array.array
+    map_ids: array.array
+    flags: array.array
+    versions: array.array
+
+
+class PlayerTable:
+    capacity: int
+    shm: shared_memory.SharedMemory | None
+    # Columns: arrays when private, memoryviews into `shm` when shared
+    ids: array.array | memoryview
+    xs: array.array | memoryview
+    ys: array.array | memoryview
+    map_ids: array.array | memoryview
+    flags: array.array | memoryview
+    versions: array.array | memoryview
+    _header: array.array | memoryview
+    # Writer side only
+    _free: list[int]
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, shared: bool = False):
+        self.capacity = capacity
+        self._free = []
+        if not shared:
+            self.shm = None
+            self._header = array.array("Q", [0] * _HEADER)
+            for name, code in _COLUMNS:
+                setattr(self, name, array.array(code, [-1 if name == "ids" else 0]) * capacity)
+            return
+
+        size = 8 * _HEADER + sum(array.array(code).itemsize * capacity for _, code in _COLUMNS)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        buf = self.shm.buf
+        self._header = buf[:8 * _HEADER].cast("Q")
+        offset = 8 * _HEADER
+        for name, code in _COLUMNS:
+            end = offset + array.array(code).itemsize * capacity
+            setattr(self, name, buf[offset:end].cast(code))
+            offset = end
+        for slot in range(capacity):
+            self.ids[slot] = -1
+
+    @property
+    def high(self) -> int:
+        """Slots below this index have been used; everything above is free."""
+        return self._header[1]
+
+    # Writes (caller serializes)
+    def add(self, pid: int, x: float, y: float, map_id: int, flags: int, version: int) -> int:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = self.high
+            if slot == self.capacity:
+                self._grow()
+        # A write that raises (a value out of its column's range) must still close the seqlock,
+        # or readers in other processes would wait for it forever
+        self._begin()
+        try:
+            self.xs[slot] = x
+            self.ys[slot] = y
+            self.map_ids[slot] = map_id
+            self.flags[slot] = flags
+            self.versions[slot] = version
+            self.ids[slot] = pid
+            if slot == self.high:
+                self._header[1] = slot + 1
+        except BaseException:
+            # The id is written last, so the slot is still free
+            if slot < self.high:
+                self._free.append(slot)
+            raise
+        finally:
+            self._end()
+        return slot
+
+    def set(self, slot: int, x: float, y: float, map_id: int, flags: int, version: int) -> None:
+        self._begin()
+        try:
+            self.xs[slot] = x
+            self.ys[slot] = y
+            self.map_ids[slot] = map_id
+            self.flags[slot] = flags
+            self.versions[slot] = version
+        finally:
+            self._end()
+
+    def remove(self, slot: int) -> None:
+        self._begin()
+        try:
+            self.ids[slot] = -1
+        finally:
+            self._end()
+        self._free.append(slot)
+
+    def get(self, slot: int) -> tuple[float, float, int, int]:
+        """(x, y, map id, flags) of a slot."""
+        return self.xs[slot], self.ys[slot], self.map_ids[slot], self.flags[slot]
+
+    def _begin(self) -> None:
+        self._header[0] += 1 # Odd: write in progress
+
+    def _end(self) -> None:
+        self._header[0] += 1
+
+    def _grow(self) -> None:
+        if self.shm is not None:
+            raise RuntimeError(f"shared player table is full ({self.capacity} slots)")
+        for name, code in _COLUMNS:
+            getattr(self, name).extend(array.array(code, [-1 if name == "ids" else 0]) * self.capacity)
+        self.capacity *= 2
+
+    # Reads
+    def read(self) -> Columns:
+        """Copies the used slots; retries while a writer in another process is mid-update."""
+        for _ in range(_READ_ATTEMPTS):
+            seq = self._header[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            high = self._header[1]
+            copy = Columns(**{name: self._copy(getattr(self, name), code, high) for name, code in _COLUMNS})
+            if self._header[0] == seq:
+                return copy
+        raise RuntimeError("player table kept changing while being read")
+
+    @staticmethod
+    def _copy(column: array.array | memoryview, code: str, high: int) -> array.array:
+        if isinstance(column, array.array):
+            return column[:high]
+        return array.array(code, column[:high].tobytes())
+
+    # Shared memory
+    def close(self) -> None:
+        if self.shm is None:
+            return
+        # Views into the buffer must go before the mapping can be closed
+        for name, _ in _COLUMNS:
+            getattr(self, name).release()
+        self._header.release()
+        self.shm.close()
+
+    def unlink(self) -> None:
+        if self.shm is not None:
+            self.shm.unlink()
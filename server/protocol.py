@@ -0,0 +1,277 @@
+"""
+Compact binary encoding for position updates and player snapshots.
+
+JSON stays the default and is what you see when debugging with a browser or curl.
+A client opts into the binary format by sending `Content-Type: application/x-monstergo`
+on POST /players and `Accept: application/x-monstergo` on GET /players.
+
+Map names are interned to small integer ids (see MapTable, GET /maps) and directions
+are sent as an enum, so every player record is a fixed 15 bytes:
+
+    update / player record  <I f f H B   id, x, y, map id, flags
+    snapshot header         <B I H H     flags, version, player count, removed count
+    removed id              <I
+
+Record flags: bit 0 = moving, bits 1-2 = direction. Snapshot flags: bit 0 = full snapshot.
+
+POST /sync uploads the client's state and receives the world in one round trip:
+
+    request                 <B I i I f   flags, id, since (-1: none), chat after, radius
+                            [<f f H B]   x, y, map id, record flags (if flags bit 0)
+                            [<f f]       vx, vy in pixels per second (if flags bit 2)
+                            [<I]         input sequence number of the state (if flags bit 3)
+                            [json]       list of outgoing chat texts (rest of the body, may be empty)
+    response                <I           length of the players snapshot (0 if not requested)
+                            [snapshot]   as for GET /players
+                            [json]       {"messages": [...], "ack": [seq, x, y]} (rest of the body, may be empty)
+
+Sync request flags: bit 0 = has state, bit 1 = wants players and chat back, bit 2 = has velocity,
+bit 3 = has sequence number. A state with a sequence number is acknowledged with the position
+the server accepted for it.
+
+The optional UDP transport (server/datagram.py) carries the same sync request and response,
+without chat, one per datagram behind a small header:
+
+    datagram                <B I Q       kind (1: client state, 2: server answer), sequence number,
+                                         token (client states: the udp_token from /register; answers: 0)
+
+Each side numbers its datagrams and drops ones older than the newest it has seen. The server
+answers a state only if its token matches the player and the address it came from, so a
+spoofed source address can't turn a small datagram into a large answer sent to someone else.
+"""
+import json
+import math
+import struct
+import threading
+
+BINARY_CONTENT_TYPE = "application/x-monstergo"
+JSON_CONTENT_TYPE = "application/json"
+
+DIRECTIONS = ("down", "left", "right", "up")
+_DIRECTION_IDS = {name: i for i, name in enumerate(DIRECTIONS)}
+
+_RECORD = struct.Struct("<IffHB")
+_HEADER = struct.Struct("<BIHH")
+_REMOVED = struct.Struct("<I")
+_SYNC_REQUEST = struct.Struct("<BIiIf")
+_SYNC_STATE = struct.Struct("<ffHB")
+_SYNC_VELOCITY = struct.Struct("<ff")
+_SYNC_SEQ = struct.Struct("<I")
+_SYNC_RESPONSE = struct.Struct("<I")
+_DATAGRAM = struct.Struct("<BIQ")
+
+# Positions and velocities a client may report; beyond these (or NaN/inf) the snapshot grid and
+# the extrapolation would overflow, so such states are rejected
+MAX_COORDINATE = 1e7
+MAX_VELOCITY = 1e5
+# Maps a table interns; ids go over the wire as uint16, and any client can name a new map
+MAX_MAPS = 1024
+
+DATAGRAM_STATE = 1
+DATAGRAM_REPLY = 2
+
+_FLAG_MOVING = 0x01
+_FLAG_FULL = 0x01
+_FLAG_HAS_STATE = 0x01
+_FLAG_RECEIVE = 0x02
+_FLAG_HAS_VELOCITY = 0x04
+_FLAG_HAS_SEQ = 0x08
+
+
+class MapTable:
+    """Thread-safe interning of map names to small integer ids."""
+    capacity: int
+    _lock: threading.Lock
+    _ids: dict[str, int]
+    _names: dict[int, str]
+
+    def __init__(self, capacity: int = MAX_MAPS) -> None:
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._names = {}
+
+    def intern(self, name: str) -> int:
+        """The map's id, assigning the next one to a new name. Raises ValueError when the table is full."""
+        map_id = self._ids.get(name)
+        if map_id is not None:
+            return map_id
+        with self._lock:
+            map_id = self._ids.get(name)
+            if map_id is None:
+                if len(self._names) >= self.capacity:
+                    raise ValueError("map table is full")
+                map_id = len(self._names)
+                self._names[map_id] = name
+                self._ids[name] = map_id
+            return map_id
+
+    def assign(self, name: str, map_id: int) -> None:
+        """Mirrors an id interned by another table (sharded mode: the front end owns the ids)."""
+        with self._lock:
+            self._names[map_id] = name
+            self._ids[name] = map_id
+
+    def name(self, map_id: int) -> str | None:
+        return self._names.get(map_id)
+
+    def to_dict(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._ids)
+
+
+def check_state(x: float, y: float, vx: float = 0.0, vy: float = 0.0) -> None:
+    """Raises ValueError for a position or velocity that is not finite or out of range."""
+    if not (math.isfinite(x) and math.isfinite(y) and math.isfinite(vx) and math.isfinite(vy)):
+        raise ValueError("position or velocity is not finite")
+    if abs(x) > MAX_COORDINATE or abs(y) > MAX_COORDINATE or abs(vx) > MAX_VELOCITY or abs(vy) > MAX_VELOCITY:
+        raise ValueError("position or velocity out of range")
+
+
+def pack_flags(moving: bool, direction: str) -> int:
+    return (_FLAG_MOVING if moving else 0) | (_DIRECTION_IDS.get(direction, 0) << 1)
+
+
+def unpack_flags(flags: int) -> tuple[bool, str]:
+    """(moving, direction) of record flags."""
+    return bool(flags & _FLAG_MOVING), DIRECTIONS[(flags >> 1) & 0x03]
+
+
+def encode_update(pid: int, x: float, y: float, map_id: int, moving: bool, direction: str) -> bytes:
+    return _RECORD.pack(pid, x, y, map_id, pack_flags(moving, direction))
+
+
+def decode_update(data: bytes) -> tuple[int, float, float, int, bool, str]:
+    """
+    Returns (id, x, y, map id, moving, direction). Raises struct.error on a malformed body and
+    ValueError on a position check_state rejects.
+    """
+    pid, x, y, map_id, flags = _RECORD.unpack(data)
+    check_state(x, y)
+    return pid, x, y, map_id, bool(flags & _FLAG_MOVING), DIRECTIONS[(flags >> 1) & 0x03]
+
+
+def encode_players(payload: dict, maps: MapTable) -> bytes:
+    """Encodes a players_since / players_near result."""
+    players = payload["players"]
+    removed = payload["removed"]
+    parts = [_HEADER.pack(_FLAG_FULL if payload["full"] else 0, payload["version"], len(players), len(removed))]
+    for p in players.values():
+        parts.append(_RECORD.pack(p["id"], p["x"], p["y"], maps.intern(p["map"]), pack_flags(p["moving"], p["direction"])))
+    for pid in removed:
+        parts.append(_REMOVED.pack(pid))
+    return b"".join(parts)
+
+
+def decode_players(data: bytes, map_names: dict[int, str]) -> dict:
+    """
+    Decodes a binary snapshot into the same shape as the JSON response.
+    Players on maps missing from `map_names` get "map": None.
+    """
+    flags, version, count, removed_count = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+    end = offset + count * _RECORD.size
+    players = {}
+    for pid, x, y, map_id, pflags in _RECORD.iter_unpack(data[offset:end]):
+        players[pid] = {
+            "id": pid,
+            "x": x,
+            "y": y,
+            "map": map_names.get(map_id),
+            "moving": bool(pflags & _FLAG_MOVING),
+            "direction": DIRECTIONS[(pflags >> 1) & 0x03],
+        }
+    removed = [pid for (pid,) in _REMOVED.iter_unpack(data[end:end + removed_count * _REMOVED.size])]
+    return {"version": version, "full": bool(flags & _FLAG_FULL), "players": players, "removed": removed}
+
+
+def encode_sync_request(body: dict, map_id: int) -> bytes:
+    """Encodes a JSON-shaped /sync body; `map_id` is the interned id of body["state"]["map"]."""
+    state = body.get("state")
+    since = body.get("since")
+    velocity = state is not None and "vx" in state
+    seq = state is not None and state.get("seq") is not None
+    flags = ((_FLAG_HAS_STATE if state else 0) | (_FLAG_RECEIVE if body.get("receive", True) else 0)
+             | (_FLAG_HAS_VELOCITY if velocity else 0) | (_FLAG_HAS_SEQ if seq else 0))
+    parts = [_SYNC_REQUEST.pack(
+        flags, body["id"], -1 if since is None else since, body.get("chat_after") or 0, body.get("radius", 0.0)
+    )]
+    if state:
+        parts.append(_SYNC_STATE.pack(state["x"], state["y"], map_id, pack_flags(state["moving"], state["direction"])))
+        if velocity:
+            parts.append(_SYNC_VELOCITY.pack(state["vx"], state["vy"]))
+        if seq:
+            parts.append(_SYNC_SEQ.pack(state["seq"]))
+    if body.get("chat"):
+        parts.append(json.dumps(body["chat"]).encode("utf-8"))
+    return b"".join(parts)
+
+
+def decode_sync_request(data: bytes, maps: MapTable) -> dict:
+    """
+    Decodes a binary /sync body into the JSON body shape. Raises struct.error / ValueError on
+    a malformed body, an unknown map id or a state check_state rejects.
+    """
+    flags, pid, since, chat_after, radius = _SYNC_REQUEST.unpack_from(data, 0)
+    offset = _SYNC_REQUEST.size
+    body = {
+        "id": pid,
+        "since": None if since < 0 else since,
+        "chat_after": chat_after,
+        "radius": radius,
+        "receive": bool(flags & _FLAG_RECEIVE),
+        "state": None,
+        "chat": [],
+    }
+    if flags & _FLAG_HAS_STATE:
+        x, y, map_id, sflags = _SYNC_STATE.unpack_from(data, offset)
+        offset += _SYNC_STATE.size
+        map_name = maps.name(map_id)
+        if map_name is None:
+            raise ValueError(f"unknown map id {map_id}")
+        body["state"] = {
+            "x": x, "y": y, "map": map_name,
+            "moving": bool(sflags & _FLAG_MOVING), "direction": DIRECTIONS[(sflags >> 1) & 0x03],
+        }
+        if flags & _FLAG_HAS_VELOCITY:
+            body["state"]["vx"], body["state"]["vy"] = _SYNC_VELOCITY.unpack_from(data, offset)
+            offset += _SYNC_VELOCITY.size
+        if flags & _FLAG_HAS_SEQ:
+            (body["state"]["seq"],) = _SYNC_SEQ.unpack_from(data, offset)
+            offset += _SYNC_SEQ.size
+        state = body["state"]
+        check_state(x, y, state.get("vx", 0.0), state.get("vy", 0.0))
+    if offset < len(data):
+        body["chat"] = json.loads(data[offset:].decode("utf-8"))
+    return body
+
+
+def encode_sync_response(players: bytes, messages: list[dict] | None, ack: tuple[int, float, float] | None = None) -> bytes:
+    """`players` is an already encoded snapshot (b"" when not requested), `ack` is (seq, x, y)."""
+    parts = [_SYNC_RESPONSE.pack(len(players)), players]
+    if messages or ack:
+        tail: dict = {"messages": messages or []}
+        if ack:
+            tail["ack"] = list(ack)
+        parts.append(json.dumps(tail).encode("utf-8"))
+    return b"".join(parts)
+
+
+def decode_sync_response(data: bytes, map_names: dict[int, str]) -> dict:
+    """Decodes into the JSON /sync response shape ("players" is None when not requested)."""
+    (players_len,) = _SYNC_RESPONSE.unpack_from(data, 0)
+    offset = _SYNC_RESPONSE.size
+    players = decode_players(data[offset:offset + players_len], map_names) if players_len else None
+    rest = data[offset + players_len:]
+    tail = json.loads(rest.decode("utf-8")) if rest else {}
+    return {"players": players, "messages": tail.get("messages", []), "ack": tail.get("ack")}
+
+
+def encode_datagram(kind: int, seq: int, payload: bytes, token: int = 0) -> bytes:
+    return _DATAGRAM.pack(kind, seq, token) + payload
+
+
+def decode_datagram(data: bytes) -> tuple[int, int, int, bytes]:
+    """Returns (kind, sequence number, token, payload). Raises struct.error on a short datagram."""
+    kind, seq, token = _DATAGRAM.unpack_from(data, 0)
+    return kind, seq, token, data[_DATAGRAM.size:]
@@ -0,0 +1,448 @@
+"""
+Sharded mode: maps are split over worker processes, each with its own PlayerHandler and
+SnapshotBroadcaster, so game-state work (updates, spatial index, snapshot building and
+encoding) runs on several cores.
+
+The HTTP front end (server.py) keeps player ids, map ids and chat. It routes each player
+request to the shard owning the player's map over a multiprocessing pipe and hands the player
+over when it moves to a map owned by another shard. Everything runs on one machine; there is
+no broker.
+
+Each shard keeps its players in a PlayerTable in shared memory, so the front end reads every
+player's position (GET /players for everyone, /metrics) straight from the tables instead of
+asking the shards and unpickling their answers.
+"""
+import itertools
+import json
+import multiprocessing
+import signal
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import Future
+from multiprocessing.connection import Connection
+
+from server.playerHandler import PlayerHandler, TIMEOUT_TIME
+from server.playerTable import PlayerTable
+from server.protocol import MapTable, encode_players
+from server.snapshot import SnapshotBroadcaster, expand_columns
+
+SHARD_CALL_TIMEOUT = 5.0
+# Players one shard can hold; shared tables can't grow once the shard is running
+SHARD_TABLE_CAPACITY = 4096
+# Seconds between sweeps of the directory for players that are gone (done on registration,
+# the only thing that makes it grow)
+SWEEP_INTERVAL = 10.0
+
+
+class ShardError(Exception):
+    pass
+
+
+def wait(future: Future):
+    """Result of a shard call; a shard that does not answer in time counts as gone."""
+    try:
+        return future.result(timeout=SHARD_CALL_TIMEOUT)
+    except TimeoutError as e:
+        raise ShardError("shard did not answer in time") from e
+
+
+def parse_shards(spec: str) -> list[tuple[str, ...]]:
+    """
+    "3" -> three shards, maps spread over them by name hash.
+    "map.tmx,map2.tmx;gym.tmx" -> one shard per ;-separated group; unlisted maps are hashed.
+    """
+    spec = spec.strip()
+    if spec.isdigit():
+        if int(spec) < 1:
+            raise ValueError("need at least one shard")
+        return [()] * int(spec)
+    groups = [tuple(name.strip() for name in group.split(",") if name.strip()) for group in spec.split(";")]
+    if not groups or any(not group for group in groups):
+        raise ValueError(f"bad shard spec: {spec!r}")
+    return groups
+
+
+class ShardWorker:
+    """Runs in a shard process and answers the front end's calls, one at a time."""
+    handler: PlayerHandler
+    maps: MapTable
+    broadcaster: SnapshotBroadcaster
+    # Players handed over to this shard: their cursors belong to the previous shard
+    _fresh: set[int]
+
+    def __init__(self, tick_rate: float, table: PlayerTable, max_speed: float, timeout: float):
+        self.maps = MapTable()
+        self.handler = PlayerHandler(timeout_seconds=timeout, maps=self.maps, table=table, max_speed=max_speed)
+        self.broadcaster = SnapshotBroadcaster(self.handler, self.maps, tick_rate)
+        self._fresh = set()
+
+    def serve(self, conn: Connection) -> None:
+        self.handler.start()
+        self.broadcaster.start()
+        try:
+            while True:
+                try:
+                    call_id, method, args = conn.recv()
+                except (EOFError, OSError):
+                    return # Front end is gone
+                if method == "stop":
+                    return
+                try:
+                    conn.send((call_id, True, getattr(self, f"call_{method}")(*args)))
+                except Exception as e:
+                    conn.send((call_id, False, f"{method}: {e!r}"))
+        finally:
+            self.broadcaster.stop()
+            self.handler.stop()
+
+    # Calls
+    def call_map(self, name: str, map_id: int) -> None:
+        self.maps.assign(name, map_id)
+
+    def call_adopt(self, pid: int) -> None:
+        self.handler.register(pid)
+        self._fresh.add(pid)
+
+    def call_leave(self, pid: int) -> None:
+        self.handler.remove(pid)
+        self._fresh.discard(pid)
+
+    def call_sync(self, pid: int, state: tuple | None, since: int | None, radius: float, binary: bool, receive: bool) -> tuple[bool, bytes | None, tuple | None]:
+        ok = self.handler.update(pid, *state) if state else self.handler.has_player(pid)
+        ack = self.handler.ack(pid) if ok and state and state[7] is not None else None
+        if not ok or not receive:
+            return ok, None, ack
+        encoded = self.call_view(pid, since, radius, binary)
+        return encoded is not None, encoded, ack
+
+    def call_view(self, pid: int, since: int | None, radius: float, binary: bool) -> bytes | None:
+        players = self.call_view_dict(pid, since, radius)
+        if players is None:
+            return None
+        return self.broadcaster.encode(players, radius <= 0, binary)
+
+    def call_view_dict(self, pid: int, since: int | None, radius: float) -> dict | None:
+        """The area around `pid`, or everyone on this shard when `radius` <= 0."""
+        if not self.handler.has_player(pid):
+            return None
+        if pid in self._fresh:
+            since = None
+            self._fresh.discard(pid)
+        return self.broadcaster.view(pid if radius > 0 else None, since, radius)
+
+    def call_stats(self) -> dict:
+        return self.broadcaster.stats()
+
+
+def _run_shard(conn: Connection, tick_rate: float, max_speed: float, timeout: float, table: PlayerTable,
+               inherited: list[Connection]) -> None:
+    # Ctrl+C goes to the whole process group; shards stop when the front end closes the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Forked copies of the front end's pipe ends would keep the pipes open after it closes them
+    for other in inherited:
+        other.close()
+    ShardWorker(tick_rate, table, max_speed, timeout).serve(conn)
+
+
+class ShardClient:
+    """Front end side of one shard: multiplexes calls from many request threads over its pipe."""
+    index: int
+    conn: Connection
+    _process: multiprocessing.Process
+    _send_lock: threading.Lock
+    _pending: dict[int, Future]
+    _call_ids: itertools.count
+    _reader: threading.Thread
+
+    def __init__(self, index: int, process: multiprocessing.Process, conn: Connection):
+        self.index = index
+        self._process = process
+        self.conn = conn
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._call_ids = itertools.count()
+        self._reader = threading.Thread(target=self._read, name=f"ShardReader-{index}", daemon=True)
+        self._reader.start()
+
+    def call_async(self, method: str, *args) -> Future:
+        future: Future = Future()
+        with self._send_lock:
+            call_id = next(self._call_ids)
+            self._pending[call_id] = future
+            try:
+                self.conn.send((call_id, method, args))
+            except OSError as e:
+                self._pending.pop(call_id, None)
+                raise ShardError(f"shard {self.index} is gone") from e
+        return future
+
+    def call(self, method: str, *args):
+        return wait(self.call_async(method, *args))
+
+    def _read(self) -> None:
+        while True:
+            try:
+                call_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(call_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(ShardError(result))
+        for future in list(self._pending.values()):
+            future.set_exception(ShardError(f"shard {self.index} is gone"))
+        self._pending.clear()
+
+    def close(self) -> None:
+        # Closing our end would not wake the reader thread blocked on it, so ask the shard to exit
+        try:
+            self.call_async("stop")
+        except ShardError:
+            pass
+        self._process.join(timeout=2.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self.conn.close()
+
+
+class ShardRouter:
+    """Owns player ids and the player -> shard directory, and hands players over between shards."""
+    shards: list[ShardClient]
+    # Shard i's players, written by shard i and read here
+    tables: list[PlayerTable]
+    _groups: list[tuple[str, ...]]
+    _owner: dict[str, int]
+    _maps: MapTable
+    _tick_rate: float
+    _max_speed: float
+    # Seconds without moving before a player is evicted, on the shards and from the directory
+    _timeout: float
+    _lock: threading.Lock
+    _next_id: int
+    # Player id -> shard it lives on (None until its first update)
+    _directory: dict[int, int | None]
+    # Players being handed over to another shard -> set once the new shard has adopted them
+    _handoffs: dict[int, threading.Event]
+    # Registered players not on any shard yet -> when they registered
+    _unplaced: dict[int, float]
+    _swept_at: float
+    # Map names every shard has the id of
+    _announced: set[str]
+    _announce_lock: threading.Lock
+
+    def __init__(self, groups: list[tuple[str, ...]], maps: MapTable, tick_rate: float, max_speed: float = 0.0,
+                 timeout: float = TIMEOUT_TIME):
+        self.shards = []
+        self.tables = []
+        self._groups = groups
+        self._owner = {name: i for i, group in enumerate(groups) for name in group}
+        self._maps = maps
+        self._tick_rate = tick_rate
+        self._max_speed = max_speed
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._directory = {}
+        self._handoffs = {}
+        self._unplaced = {}
+        self._swept_at = time.monotonic()
+        self._announced = set()
+        self._announce_lock = threading.Lock()
+
+    def start(self) -> None:
+        # fork: the shard only needs the already imported modules, not a fresh interpreter
+        ctx = multiprocessing.get_context("fork")
+        for i in range(len(self._groups)):
+            table = PlayerTable(SHARD_TABLE_CAPACITY, shared=True)
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_run_shard, args=(child_conn, self._tick_rate, self._max_speed, self._timeout, table, [parent_conn, *(shard.conn for shard in self.shards)]), name=f"Shard-{i}", daemon=True)
+            process.start()
+            child_conn.close()
+            self.tables.append(table)
+            self.shards.append(ShardClient(i, process, parent_conn))
+        # Players start on the "" map until their first update; give it the same id everywhere
+        self._announce("")
+
+    def stop(self) -> None:
+        for shard in self.shards:
+            shard.close()
+        for table in self.tables:
+            table.close()
+            table.unlink()
+
+    def shard_for(self, map_name: str) -> int:
+        owner = self._owner.get(map_name)
+        if owner is None:
+            owner = zlib.crc32(map_name.encode("utf-8")) % len(self._groups)
+        return owner
+
+    def describe(self) -> list[list[str]]:
+        return [list(group) for group in self._groups]
+
+    # Players
+    def register(self) -> int:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._swept_at >= SWEEP_INTERVAL:
+                self._sweep(now)
+            pid = self._next_id
+            self._next_id += 1
+            self._directory[pid] = None
+            self._unplaced[pid] = now
+            return pid
+
+    def _sweep(self, now: float) -> None:
+        """
+        Caller must hold _lock. Drops players their shard has evicted (they are no longer in its
+        table) and players that never left the "" map within the player timeout. A player stops
+        sending without telling anyone, so nothing else would ever drop them.
+        """
+        self._swept_at = now
+        # Read under the lock: a player not being handed over has been adopted by now
+        present = [set(table.read().ids) for table in self.tables]
+        for pid, shard in list(self._directory.items()):
+            if pid in self._handoffs:
+                continue
+            if shard is None:
+                if now - self._unplaced.get(pid, now) >= self._timeout:
+                    del self._directory[pid]
+                    self._unplaced.pop(pid, None)
+            elif pid not in present[shard]:
+                del self._directory[pid]
+
+    def has_player(self, pid: int) -> bool:
+        with self._lock:
+            return pid in self._directory
+
+    def update(self, pid: int, state: tuple) -> bool:
+        ok, _, _ = self.sync(pid, state, None, 0.0, False, False)
+        return ok
+
+    def sync(self, pid: int, state: tuple | None, since: int | None, radius: float, binary: bool, receive: bool,
+             retry: bool = True) -> tuple[bool, bytes | None, tuple | None]:
+        """
+        Applies `state` on the player's shard and returns (player known, encoded view or None,
+        ack of a sequenced state or None).
+        """
+        known, shard = self._route(pid, state)
+        if not known:
+            return False, None, None
+        if shard is None:
+            # Registered but not on any map yet
+            return True, self._encode_empty(binary) if receive else None, None
+        ok, encoded, ack = self.shards[shard].call("sync", pid, state, since, radius, binary, receive)
+        if not ok and self._forget(pid, shard) and retry:
+            # Handed over while the call was on its way; the shard didn't apply anything
+            return self.sync(pid, state, since, radius, binary, receive, False)
+        return ok, encoded, ack
+
+    def view(self, pid: int | None, since: int | None, radius: float, binary: bool) -> bytes | None:
+        """As sync without state; `pid` None gets a full snapshot of everyone on every shard."""
+        if pid is None:
+            return self.everyone(binary)
+        ok, encoded, _ = self.sync(pid, None, since, radius, binary, True)
+        return encoded if ok else None
+
+    def view_dict(self, pid: int, since: int | None, radius: float, retry: bool = True) -> dict | None:
+        known, shard = self._route(pid, None)
+        if not known:
+            return None
+        if shard is None:
+            return self._empty_view()
+        players = self.shards[shard].call("view_dict", pid, since, radius)
+        if players is None and self._forget(pid, shard) and retry:
+            return self.view_dict(pid, since, radius, False)
+        return players
+
+    def everyone(self, binary: bool) -> bytes:
+        players: dict[int, dict] = {}
+        for table in self.tables:
+            players.update(expand_columns(table.read(), self._maps)[0])
+        # Cursors mean nothing across shards, so this is always a full answer
+        payload = {"version": 0, "full": True, "players": players, "removed": []}
+        return encode_players(payload, self._maps) if binary else json.dumps(payload).encode("utf-8")
+
+    def stats(self) -> list[dict]:
+        futures = [shard.call_async("stats") for shard in self.shards]
+        return [dict(wait(future), maps=list(group)) for future, group in zip(futures, self._groups)]
+
+    def player_counts(self) -> dict[str, int]:
+        counts: Counter = Counter()
+        for table in self.tables:
+            columns = table.read()
+            counts.update(self._maps.name(map_id) for pid, map_id in zip(columns.ids, columns.map_ids) if pid >= 0)
+        return dict(counts)
+
+    # Routing
+    def _route(self, pid: int, state: tuple | None) -> tuple[bool, int | None]:
+        if state is not None:
+            self._announce(state[2])
+        while True:
+            with self._lock:
+                if pid not in self._directory:
+                    return False, None
+                handoff = self._handoffs.get(pid)
+                if handoff is None:
+                    current = self._directory[pid]
+                    if state is None:
+                        return True, current
+                    target = self.shard_for(state[2])
+                    if target == current:
+                        return True, current
+                    self._directory[pid] = target
+                    self._unplaced.pop(pid, None)
+                    handoff = self._handoffs[pid] = threading.Event()
+                    break
+            # Another request is handing the player over; until the new shard has adopted it,
+            # that shard would answer "unknown player"
+            if not handoff.wait(SHARD_CALL_TIMEOUT):
+                raise ShardError(f"handoff of player {pid} did not finish in time")
+
+        # Changed maps to one owned by another shard (or first update): hand the player over
+        try:
+            if current is not None:
+                self.shards[current].call("leave", pid)
+            self.shards[target].call("adopt", pid)
+        finally:
+            with self._lock:
+                del self._handoffs[pid]
+            handoff.set()
+        return True, target
+
+    def _announce(self, map_name: str) -> None:
+        """Makes sure every shard knows the map's id before it sees a player on it."""
+        if map_name in self._announced:
+            return
+        with self._announce_lock:
+            if map_name in self._announced:
+                return
+            map_id = self._maps.intern(map_name)
+            for future in [shard.call_async("map", map_name, map_id) for shard in self.shards]:
+                wait(future)
+            self._announced.add(map_name)
+
+    def _forget(self, pid: int, shard: int) -> bool:
+        """
+        `shard` doesn't know the player: drops it if the shard evicted it for inactivity. Returns
+        True if the player has moved to another shard meanwhile (asking again will reach it).
+        """
+        with self._lock:
+            if pid not in self._directory:
+                return False
+            if self._directory[pid] != shard or pid in self._handoffs:
+                return True
+            del self._directory[pid]
+            return False
+
+    @staticmethod
+    def _empty_view() -> dict:
+        return {"version": 0, "full": True, "players": {}, "removed": []}
+
+    def _encode_empty(self, binary: bool) -> bytes:
+        payload = self._empty_view()
+        return encode_players(payload, self._maps) if binary else json.dumps(payload).encode("utf-8")
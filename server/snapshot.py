@@ -0,0 +1,306 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from server.playerHandler import PlayerHandler, cell_of
+from server.playerTable import Columns
+from server.protocol import MapTable, encode_players, unpack_flags
+
+DEFAULT_TICK_RATE = 20.0
+# A tick that keeps failing is reported at most this often (seconds), with the failures since
+TICK_ERROR_LOG_INTERVAL = 10.0
+
+
+def expand_columns(columns: Columns, maps: MapTable) -> tuple[Dict[int, dict], Dict[int, int], Dict[str, Dict[tuple[int, int], tuple[int, ...]]]]:
+    """Player dicts, versions and the per-map grid index from a copy of the player table."""
+    players: Dict[int, dict] = {}
+    versions: Dict[int, int] = {}
+    rooms: Dict[str, Dict[tuple[int, int], list[int]]] = {}
+    for pid, x, y, map_id, flags, version in zip(columns.ids, columns.xs, columns.ys, columns.map_ids, columns.flags, columns.versions):
+        if pid < 0:
+            continue # Free slot
+        moving, direction = unpack_flags(flags)
+        map_name = maps.name(map_id)
+        players[pid] = {"id": pid, "x": x, "y": y, "map": map_name, "moving": moving, "direction": direction}
+        versions[pid] = version
+        rooms.setdefault(map_name, {}).setdefault(cell_of(x, y), []).append(pid)
+    return players, versions, {m: {cell: tuple(ids) for cell, ids in room.items()} for m, room in rooms.items()}
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Immutable view of the world at one tick. Every read request is answered from the
+    current snapshot, so readers never take PlayerHandler._lock.
+    """
+    tick: int
+    built_at: float
+    version: int
+    chat_seq: int
+    delta_floor: int
+    players: Dict[int, dict]
+    versions: Dict[int, int]
+    removed: tuple[tuple[int, int], ...]
+    rooms: Dict[str, Dict[tuple[int, int], tuple[int, ...]]]
+    # The full GET /players response, encoded once per tick
+    json_full: bytes
+    binary_full: bytes
+
+    def since(self, since: int | None) -> dict:
+        """
+        Players added or changed and ids removed after version `since`.
+        Falls back to a full snapshot ("full": True) when `since` is missing, too old or from
+        another server run; the returned "version" is the cursor for the next call.
+        """
+        if since is None or since < self.delta_floor or since > self.version:
+            return {"version": self.version, "full": True, "players": self.players, "removed": []}
+
+        players = {pid: p for pid, p in self.players.items() if self.versions[pid] > since}
+        removed: list[int] = []
+        for pid, removed_at in reversed(self.removed):
+            if removed_at <= since:
+                break
+            removed.append(pid)
+        return {"version": self.version, "full": False, "players": players, "removed": removed}
+
+    def near(self, pid: int, since: int | None, radius: float, last: tuple[int, frozenset[int]] | None) -> tuple[dict, frozenset[int]] | None:
+        """
+        Like since, but only for players on the requester's map within `radius` pixels of it
+        (the requester itself excluded). `last` is the (version, ids) of the requester's previous
+        answer: players entering the area are sent even if they did not change, and players leaving
+        it are listed as removed. Returns the answer and the new visible ids, or None for an
+        unknown requester.
+        """
+        me = self.players.get(pid)
+        if me is None:
+            return None
+
+        visible = self._query_area(me, radius)
+        # The area memory only matches the client if it acknowledges the previous answer
+        if since is None or last is None or last[0] != since:
+            players = {other: self.players[other] for other in visible}
+            return {"version": self.version, "full": True, "players": players, "removed": []}, visible
+
+        seen = last[1]
+        players = {other: self.players[other] for other in visible if self.versions[other] > since or other not in seen}
+        removed = [other for other in seen if other not in visible]
+        return {"version": self.version, "full": False, "players": players, "removed": removed}, visible
+
+    def _query_area(self, me: dict, radius: float) -> frozenset[int]:
+        room = self.rooms.get(me["map"], {})
+        x, y = me["x"], me["y"]
+        min_cx, min_cy = cell_of(x - radius, y - radius)
+        max_cx, max_cy = cell_of(x + radius, y + radius)
+        r2 = radius * radius
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(room):
+            # More cells in the box than occupied ones: walk the occupied cells instead
+            cells = [ids for (cx, cy), ids in room.items() if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+        else:
+            cells = [room.get((cx, cy), ()) for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1)]
+        found: list[int] = []
+        for ids in cells:
+            for other_id in ids:
+                if other_id == me["id"]:
+                    continue
+                other = self.players[other_id]
+                if (other["x"] - x) ** 2 + (other["y"] - y) ** 2 <= r2:
+                    found.append(other_id)
+        return frozenset(found)
+
+
+class SnapshotBroadcaster:
+    """
+    Builds one Snapshot per tick (only when something changed) on its own thread and
+    publishes it by swapping a single reference. Push streams wait on it for new snapshots.
+    Failed ticks are counted in stats() and reported through `log`, if given.
+    """
+    tick_rate: float
+    log: Callable[[str], None] | None
+    _handler: PlayerHandler
+    _maps: MapTable
+    _current: Snapshot
+    _published: threading.Condition
+    _stop_event: threading.Event
+    _thread: threading.Thread | None
+    # Requester id -> (version, ids) of its last area-of-interest answer; written by request
+    # threads, pruned by the ticker, so only touched under _interest_lock
+    _interest: Dict[int, tuple[int, frozenset[int]]]
+    _interest_lock: threading.Lock
+
+    # Tick metrics
+    _ticks: int
+    _builds: int
+    _last_tick_ms: float
+    _avg_tick_ms: float
+    _max_tick_ms: float
+    _overruns: int
+    _errors: int
+    _last_error: str | None
+    # Failures not reported yet, and when the last report went out
+    _unreported_errors: int
+    _reported_at: float
+
+    def __init__(self, handler: PlayerHandler, maps: MapTable, tick_rate: float = DEFAULT_TICK_RATE,
+                 log: Callable[[str], None] | None = None):
+        self.tick_rate = tick_rate
+        self.log = log
+        self._handler = handler
+        self._maps = maps
+        self._published = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._interest = {}
+        self._interest_lock = threading.Lock()
+
+        self._ticks = 0
+        self._builds = 0
+        self._last_tick_ms = 0.0
+        self._avg_tick_ms = 0.0
+        self._max_tick_ms = 0.0
+        self._overruns = 0
+        self._errors = 0
+        self._last_error = None
+        self._unreported_errors = 0
+        self._reported_at = float("-inf")
+        self._current = self._build()
+
+    @property
+    def current(self) -> Snapshot:
+        return self._current
+
+    # Threading
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="SnapshotTicker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+
+    def _loop(self) -> None:
+        next_tick = time.monotonic()
+        while True:
+            period = 1.0 / self.tick_rate
+            next_tick += period
+            if self._stop_event.wait(max(0.0, next_tick - time.monotonic())):
+                return
+            try:
+                self.tick()
+            except Exception as e:
+                # Keep ticking: readers would be served a frozen world from now on otherwise
+                self._tick_failed(e)
+            now = time.monotonic()
+            if now > next_tick + period:
+                # Fell a whole tick behind: skip ahead instead of bursting to catch up
+                self._overruns += 1
+                next_tick = now
+
+    def _tick_failed(self, error: Exception) -> None:
+        self._errors += 1
+        self._unreported_errors += 1
+        self._last_error = repr(error)
+        now = time.monotonic()
+        if self.log is None or now - self._reported_at < TICK_ERROR_LOG_INTERVAL:
+            return
+        self.log(f"snapshot tick failed ({self._unreported_errors}x since last report): {error!r}")
+        self._unreported_errors = 0
+        self._reported_at = now
+
+    def tick(self) -> None:
+        start = time.perf_counter()
+        # Players between updates walk on along their last velocity
+        self._handler.extrapolate(time.monotonic())
+        if self._handler.versions() != (self._current.version, self._current.chat_seq):
+            snapshot = self._build()
+            # Forget area memories of players that are gone
+            with self._interest_lock:
+                for pid in [pid for pid in self._interest if pid not in snapshot.players]:
+                    del self._interest[pid]
+            with self._published:
+                self._current = snapshot
+                self._published.notify_all()
+            self._builds += 1
+
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self._ticks += 1
+        self._last_tick_ms = elapsed_ms
+        self._avg_tick_ms += (elapsed_ms - self._avg_tick_ms) * 0.05
+        self._max_tick_ms = max(self._max_tick_ms, elapsed_ms)
+
+    def _build(self) -> Snapshot:
+        state = self._handler.snapshot_state()
+        # The handler's lock is already released; the expensive part happens here
+        players, versions, rooms = expand_columns(state.pop("columns"), self._maps)
+        full = {"version": state["version"], "full": True, "players": players, "removed": []}
+        return Snapshot(
+            tick=self._ticks,
+            built_at=time.time(),
+            players=players,
+            versions=versions,
+            rooms=rooms,
+            json_full=json.dumps(full).encode("utf-8"),
+            binary_full=encode_players(full, self._maps),
+            **state,
+        )
+
+    # Reads
+    def near(self, pid: int, since: int | None, radius: float) -> dict | None:
+        snapshot = self._current
+        with self._interest_lock:
+            last = self._interest.get(pid)
+        result = snapshot.near(pid, since, radius, last)
+        if result is None:
+            # Registered after this snapshot was built: nothing around it yet
+            if self._handler.has_player(pid):
+                return {"version": snapshot.version, "full": True, "players": {}, "removed": []}
+            return None
+        answer, visible = result
+        with self._interest_lock:
+            self._interest[pid] = (answer["version"], visible)
+        return answer
+
+    def view(self, pid: int | None, since: int | None, radius: float) -> dict | None:
+        """Changes to everyone since `since` when `pid` is None, else the area around `pid` (None if unknown)."""
+        if pid is None:
+            return self._current.since(since)
+        return self.near(pid, since, radius)
+
+    def encode(self, players: dict, everyone: bool, binary: bool) -> bytes:
+        """Encodes a view; a full view of everyone reuses the bytes encoded once for this tick."""
+        if everyone and players["full"]:
+            # Possibly a newer snapshot than the view's, which is still a valid full answer
+            snapshot = self._current
+            return snapshot.binary_full if binary else snapshot.json_full
+        return encode_players(players, self._maps) if binary else json.dumps(players).encode("utf-8")
+
+    def wait_for_change(self, version: int, chat_seq: int, timeout: float) -> Snapshot:
+        """Blocks until a snapshot with a different version or chat sequence is published, or `timeout` expires."""
+        with self._published:
+            self._published.wait_for(
+                lambda: self._current.version != version or self._current.chat_seq != chat_seq,
+                timeout
+            )
+            return self._current
+
+    def stats(self) -> dict:
+        snapshot = self._current
+        return {
+            "tick_rate": self.tick_rate,
+            "ticks": self._ticks,
+            "snapshots_built": self._builds,
+            "tick_overruns": self._overruns,
+            "tick_errors": self._errors,
+            "last_tick_error": self._last_error,
+            "last_tick_ms": round(self._last_tick_ms, 3),
+            "avg_tick_ms": round(self._avg_tick_ms, 3),
+            "max_tick_ms": round(self._max_tick_ms, 3),
+            "snapshot_version": snapshot.version,
+            "snapshot_players": len(snapshot.players),
+            "snapshot_age_ms": round((time.time() - snapshot.built_at) * 1000.0, 1),
+        }
@@ -1,42 +1,200 @@
-import requests
+import asyncio
 import threading
-import queue
-from src.utils import Logger, GameSettings
+import json
+import math
+import random
+import time
+from collections import deque
+from urllib.parse import urlsplit
+from src.utils import Logger, GameSettings, InputHistory, AsyncHttpClient, HttpResponse, NetStats
+from server.protocol import (
+    BINARY_CONTENT_TYPE, DATAGRAM_STATE, DATAGRAM_REPLY,
+    encode_sync_request, decode_sync_response, encode_datagram, decode_datagram
+)
+from server.capture import Capture, Exchange, KIND_HTTP, KIND_DATAGRAM, KIND_EVENT
 
+# Adaptive polling: /sync every POLL_INTERVAL seconds while players near us are changing; each
+# sync that brings nothing new stretches the wait by POLL_SLOWDOWN up to IDLE_POLL_INTERVAL, which
+# is also used when we are alone on our map or the push stream delivers. Something to upload
+# (a state, chat) is sent right away, but never sooner than POLL_INTERVAL after the last sync
 POLL_INTERVAL = 0.03
+IDLE_POLL_INTERVAL = 0.25
+POLL_SLOWDOWN = 1.5
+# Failed syncs back off exponentially from BACKOFF_BASE up to BACKOFF_MAX seconds, with jitter
+# so clients that lost the same server don't come back in lockstep
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+# Seconds of syncs the effective poll rate is measured over
+RATE_WINDOW = 2.0
+CHAT_HISTORY_LIMIT = 50
+REQUEST_TIMEOUT = 5.0
+# Push channel
+STREAM_READ_TIMEOUT = 15.0    # server sends a keep-alive every few seconds, so silence this long means it is gone
+STREAM_RETRY_INTERVAL = 5.0   # seconds to stay on polling before trying to reconnect the stream (doubling while it fails)
+STREAM_RETRY_MAX = 60.0
+# Keep-alive connections kept open to the server (sync loop + chat and map lookups), besides the stream
+CONNECTION_POOL_SIZE = 2
+LATENCY_SAMPLES = 256
+# Dead reckoning: the server moves us along the last velocity we sent, so an update is only
+# sent when we stray this many pixels from that path, change map/direction/moving, or when
+# the heartbeat interval has passed since the last one
+DEAD_RECKONING_THRESHOLD = 8.0
+HEARTBEAT_INTERVAL = 1.0
+# UDP transport: chat goes over HTTP this often, and this long without an answer means UDP
+# doesn't get through (firewall, server gone), so we fall back to HTTP
+CHAT_POLL_INTERVAL = 0.5
+UDP_TIMEOUT = 3.0
+# Capture sources (ONLINE_CAPTURE): HTTP requests, push stream events, datagrams
+CAPTURE_HTTP = 1
+CAPTURE_STREAM = 2
+CAPTURE_UDP = 3
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, inbox: asyncio.Queue):
+        self._inbox = inbox
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._inbox.put_nowait(data)
+
+    def error_received(self, exc: Exception) -> None:
+        pass # The server's port is closed (it may come back); UDP_TIMEOUT decides when to give up
 
 class OnlineManager:
     list_players: list[dict]
-    chat_messages: list[dict] # Added chat storage
+    # Local copy of the server's player table, kept up to date with deltas
+    _players: dict[int, dict]
+    _players_version: int | None
+    chat_messages: deque[dict] # Added chat storage, newest CHAT_HISTORY_LIMIT messages
+    # Sequence number of the newest chat message we have
+    _chat_seq: int
+    # Chat typed since the last sync
+    _outgoing_chat: list[str]
     player_id: int
-    
-    _stop_event: threading.Event
-    _fetch_thread: threading.Thread | None
-    _send_thread: threading.Thread | None
+
+    # All networking runs as tasks on one event loop in one thread; the game thread hands
+    # work over with run_coroutine_threadsafe and only touches shared state under _lock
+    _loop: asyncio.AbstractEventLoop | None
+    _thread: threading.Thread | None
+    # Sync loop, push stream and UDP receiver; cancelled by stop()
+    _tasks: list[asyncio.Task]
+    _chat_task: asyncio.Task | None
+    # Set when there is something to upload, to sync before the poll interval is up (loop thread only)
+    _wakeup: asyncio.Event | None
+    # Adaptive polling: wait before the next sync, consecutive failed syncs, times of recent
+    # syncs (for the effective rate), and the (players version, chat seq) seen at the last one
+    _poll_interval: float
+    _failures: int
+    _sync_times: deque[float]
+    _seen: tuple[int | None, int]
+    # Keep-alive connections for all plain requests (loop thread only)
+    _http: AsyncHttpClient | None
+    # True while the push stream is connected; syncs then only upload
+    _streaming: bool
     _lock: threading.Lock
-    _update_queue: queue.Queue
-    
+    # Latest state not yet sent; a newer one replaces it, so the sender never sends stale frames
+    _pending_state: dict | None
+    _updates_sent: int
+    _updates_coalesced: int
+    _updates_failed: int
+    _request_count: int
+    _latencies: deque[float]
+    # Binary wire format (negotiated at registration)
+    _binary: bool
+    _map_ids: dict[str, int]
+    _map_names: dict[int, str]
+    # Dead reckoning: our previous frame (x, y, map, time) for the velocity, and the last
+    # state handed to the sender with the time it was sent
+    _last_frame: tuple[float, float, str, float] | None
+    _last_sent: tuple[dict, float] | None
+    _updates_suppressed: int
+    # Prediction: every frame's position by input sequence number, and the newest
+    # acknowledgement (seq, x, y) from the server, reconciled on the game thread
+    _inputs: InputHistory
+    _pending_ack: tuple[int, float, float] | None
+    # UDP transport (when the server offers it and ONLINE_UDP is on)
+    _udp_port: int | None
+    # Sent with every datagram; the server ignores datagrams without it
+    _udp_token: int
+    _udp: asyncio.DatagramTransport | None
+    # Received datagrams, applied in order by the UDP task
+    _udp_inbox: asyncio.Queue | None
+    # Sequence number of our last datagram / of the newest answer applied
+    _udp_seq: int
+    _udp_answer_seq: int
+    # When the oldest datagram still waiting for an answer was sent (None: all answered)
+    _udp_waiting_since: float | None
+    # Last state sent over UDP, sent again each cycle until the server acknowledges it
+    _udp_unacked: dict | None
+    _chat_polled_at: float
+    # Chat round trips over HTTP that failed in a row, and when the next may be tried (UDP mode)
+    _chat_failures: int
+    _chat_retry_at: float
+    # Traffic capture for tools/replay.py (ONLINE_CAPTURE), written by a thread of its own
+    _capture: Capture
+    # Rolling statistics for the network overlay; HTTP bytes are taken from the client's totals
+    _net_stats: NetStats
+    _http_bytes: tuple[int, int]
+
     def __init__(self):
         self.base: str = GameSettings.ONLINE_SERVER_URL
         self.player_id = -1
         self.list_players = []
-        self.chat_messages = [] # Initialize chat list
+        self._players = {}
+        self._players_version = None
+        self.chat_messages = deque(maxlen=CHAT_HISTORY_LIMIT) # Initialize chat list
+        self._chat_seq = 0
+        self._outgoing_chat = []
 
-        self._fetch_thread = None
-        self._send_thread = None
-        self._stop_event = threading.Event()
+        self._loop = None
+        self._thread = None
+        self._tasks = []
+        self._chat_task = None
+        self._wakeup = None
+        self._poll_interval = POLL_INTERVAL
+        self._failures = 0
+        self._sync_times = deque(maxlen=int(RATE_WINDOW / POLL_INTERVAL) + 1)
+        self._seen = (None, 0)
+        self._http = None
+        self._streaming = False
         self._lock = threading.Lock()
-        self._update_queue = queue.Queue(maxsize=10)
-        
+        self._pending_state = None
+        self._updates_sent = 0
+        self._updates_coalesced = 0
+        self._updates_failed = 0
+        self._request_count = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._binary = False
+        self._map_ids = {}
+        self._map_names = {}
+        self._last_frame = None
+        self._last_sent = None
+        self._updates_suppressed = 0
+        self._inputs = InputHistory()
+        self._pending_ack = None
+        self._udp_port = None
+        self._udp_token = 0
+        self._udp = None
+        self._udp_inbox = None
+        self._udp_seq = 0
+        self._udp_answer_seq = 0
+        self._udp_waiting_since = None
+        self._udp_unacked = None
+        self._chat_polled_at = 0.0
+        self._chat_failures = 0
+        self._chat_retry_at = 0.0
+        self._capture = Capture(GameSettings.ONLINE_CAPTURE or None)
+        self._net_stats = NetStats()
+        self._http_bytes = (0, 0)
+
         Logger.info("OnlineManager initialized")
-        
+
     def enter(self):
         self.register()
         self.start()
-            
+
     def exit(self):
         self.stop()
-        
+
     def get_list_players(self) -> list[dict]:
         with self._lock:
             return list(self.list_players)
@@ -51,134 +209,643 @@ class OnlineManager:
     def send_chat(self, text: str) -> bool:
         if self.player_id == -1:
             return False
-        
-        # We run this in a separate short-lived thread to not block the UI (Frame rate)
-        # The ChatOverlay expects a bool return, we return True assuming the thread starts
-        def _target():
-            try:
-                url = f"{self.base}/chat"
-                body = {"id": self.player_id, "text": text}
-                requests.post(url, json=body, timeout=3)
-            except Exception as e:
-                Logger.warning(f"Failed to send chat: {e}")
 
-        t = threading.Thread(target=_target, name="ChatSender", daemon=True)
-        t.start()
+        # Queued and sent with the next sync, so the UI (Frame rate) never waits on the network
+        with self._lock:
+            self._outgoing_chat.append(text)
+        self._wake()
         return True
 
     # ------------------------------------------------------------------
-    # Threading and API Calling Below
+    # Event loop and API Calling Below
     # ------------------------------------------------------------------
     def register(self):
+        """Blocks the caller until the server answers (or REQUEST_TIMEOUT passes)."""
         try:
-            url = f"{self.base}/register"
-            resp = requests.get(url, timeout=5)
-            resp.raise_for_status()
-            data = resp.json()
-            if resp.status_code == 200:
-                self.player_id = data["id"]
-                Logger.info(f"OnlineManager registered with id={self.player_id}")
-            else:
-                Logger.error("Registration failed:", data)
+            self._run(self._register(), REQUEST_TIMEOUT + 1.0)
         except Exception as e:
             Logger.warning(f"OnlineManager registration error: {e}")
-        return
+
+    async def _register(self) -> None:
+        resp = await self._request("GET", "/register")
+        data = resp.json()
+        if resp.status == 200:
+            self.player_id = data["id"]
+            self._binary = GameSettings.ONLINE_BINARY and "binary" in data.get("formats", [])
+            self._map_ids, self._map_names = {}, {}
+            self._players_version = None
+            self._last_sent = None
+            self._inputs = InputHistory()
+            self._pending_ack = None
+            # UDP datagrams use the binary format
+            self._udp_port = data.get("udp_port") if GameSettings.ONLINE_UDP and self._binary else None
+            self._udp_token = int(data.get("udp_token") or 0)
+            self._udp_answer_seq = 0
+            self._udp_unacked = None
+            Logger.info(f"OnlineManager registered with id={self.player_id} (binary={self._binary}, udp={self._udp_port is not None})")
+        else:
+            Logger.error("Registration failed:", data)
 
     def update(self, x: float, y: float, map_name: str, moving: bool, direction: str) -> bool:
+        """Called every frame; only states the server could not extrapolate are sent."""
         if self.player_id == -1:
             return False
-        
-        try:
-            self._update_queue.put_nowait({"x": x, "y": y, "map": map_name, "moving": moving, "direction": direction})
+
+        now = time.monotonic()
+        vx = vy = 0.0
+        last = self._last_frame
+        if moving and last is not None and last[2] == map_name and now > last[3]:
+            vx = (x - last[0]) / (now - last[3])
+            vy = (y - last[1]) / (now - last[3])
+        self._last_frame = (x, y, map_name, now)
+        seq = self._inputs.record(x, y, map_name)
+
+        state = {"x": x, "y": y, "map": map_name, "moving": moving, "direction": direction, "vx": vx, "vy": vy, "seq": seq}
+        if not self._needs_update(state, now):
+            self._updates_suppressed += 1
             return True
-        except queue.Full:
-            return False
+        with self._lock:
+            if self._pending_state is not None:
+                self._updates_coalesced += 1
+                self._net_stats.drop("coalesced")
+            self._pending_state = state
+        self._last_sent = (state, now)
+        self._wake()
+        return True
+
+    def reconcile(self) -> tuple[float, float] | None:
+        """
+        Call on the game thread before update(). Returns the (dx, dy) to move the local player
+        by when the server put it somewhere other than predicted, else None.
+        """
+        with self._lock:
+            ack, self._pending_ack = self._pending_ack, None
+        if ack is None:
+            return None
+        correction = self._inputs.acknowledge(int(ack[0]), float(ack[1]), float(ack[2]))
+        if correction is not None and self._last_frame is not None:
+            # Keep the velocity estimate from seeing the correction as movement
+            x, y, map_name, t = self._last_frame
+            self._last_frame = (x + correction[0], y + correction[1], map_name, t)
+        return correction
+
+    def _needs_update(self, state: dict, now: float) -> bool:
+        if self._last_sent is None:
+            return True
+        sent, sent_at = self._last_sent
+        if (state["map"], state["moving"], state["direction"]) != (sent["map"], sent["moving"], sent["direction"]):
+            return True
+        elapsed = now - sent_at
+        if elapsed >= HEARTBEAT_INTERVAL:
+            return True
+        # Where the server thinks we are
+        x = sent["x"] + sent["vx"] * elapsed
+        y = sent["y"] + sent["vy"] * elapsed
+        return math.hypot(state["x"] - x, state["y"] - y) > DEAD_RECKONING_THRESHOLD
 
     def start(self) -> None:
-        if (self._fetch_thread and self._fetch_thread.is_alive()) or \
-           (self._send_thread and self._send_thread.is_alive()):
-            return
-        
-        self._stop_event.clear()
-        
-        self._fetch_thread = threading.Thread(
-            target=self._fetch_loop,
-            name="OnlineManagerFetcher",
-            daemon=True
-        )
-        self._fetch_thread.start()
-        
-        self._send_thread = threading.Thread(
-            target=self._send_loop,
-            name="OnlineManagerSender",
-            daemon=True
-        )
-        self._send_thread.start()
+        self._run(self._start_tasks())
+
+    def get_connection_stats(self) -> dict:
+        """Requests made and their latency in ms (connection counts are in the server's /stats)."""
+        samples = sorted(self._latencies)
+        def pct(q: float) -> float:
+            return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000.0, 2) if samples else 0.0
+        return {
+            "requests": self._request_count,
+            "updates_suppressed": self._updates_suppressed,
+            "updates_sent": self._updates_sent,
+            "updates_coalesced": self._updates_coalesced,
+            "updates_failed": self._updates_failed,
+            "corrections": self._inputs.corrections,
+            "streaming": self._streaming,
+            "poll_rate_hz": self.get_poll_rate(),
+            "poll_interval_ms": round(self._poll_interval * 1000.0, 1),
+            "failed_syncs": self._failures,
+            "latency_p50_ms": pct(0.50),
+            "latency_p95_ms": pct(0.95),
+        }
+
+    def get_net_stats(self) -> dict:
+        """RTT per endpoint, traffic and drops per second, snapshot age and their history (see NetStats.report)."""
+        return self._net_stats.report()
+
+    def get_poll_rate(self) -> float:
+        """Round trips (syncs or datagrams) per second over the last RATE_WINDOW seconds."""
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(1 for t in self._sync_times if now - t <= RATE_WINDOW)
+        return round(recent / RATE_WINDOW, 1)
 
     def stop(self) -> None:
-        self._stop_event.set()
-        if self._fetch_thread and self._fetch_thread.is_alive():
-            self._fetch_thread.join(timeout=2)
-        if self._send_thread and self._send_thread.is_alive():
-            self._send_thread.join(timeout=2)
-
-    def _fetch_loop(self) -> None:
-        while not self._stop_event.wait(POLL_INTERVAL):
-            self._fetch_players()
-            self._fetch_chat() # Added: fetch chat messages in the loop logic
-    
-    def _send_loop(self) -> None:
-        while not self._stop_event.is_set():
-            try:
-                update_data = self._update_queue.get(timeout=0.1)
-                self._send_update(update_data)
-            except queue.Empty:
-                continue
-            
-    def _send_update(self, update_data: dict) -> None:
-        if self.player_id == -1:
+        """Cancels all network tasks and ends the loop thread; returns as soon as they are done."""
+        loop, thread = self._loop, self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(REQUEST_TIMEOUT)
+        except Exception as e:
+            Logger.warning(f"OnlineManager shutdown error: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        self._loop = self._thread = None
+        self._capture.stop()
+
+    def _run(self, coro, timeout: float | None = None):
+        """Runs `coro` on the network loop (started on first use) and waits for its result."""
+        if self._thread is None or not self._thread.is_alive():
+            self._loop = asyncio.new_event_loop()
+            self._http = AsyncHttpClient(self.base, CONNECTION_POOL_SIZE, REQUEST_TIMEOUT)
+            self._http_bytes = (0, 0)
+            if self._capture.enabled:
+                self._capture.start()
+                self._http.observer = self._capture_exchange
+            self._thread = threading.Thread(target=self._run_loop, args=(self._loop,), name="OnlineManagerNet", daemon=True)
+            self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _start_tasks(self) -> None:
+        if any(not task.done() for task in self._tasks):
+            return
+        if self._udp_port is not None:
+            await self._open_udp()
+        self._wakeup = asyncio.Event()
+        self._poll_interval = POLL_INTERVAL
+        self._failures = 0
+        self._tasks = [asyncio.create_task(self._sync_loop(), name="OnlineManagerSync")]
+        if self._udp is not None:
+            self._tasks.append(asyncio.create_task(self._udp_loop(), name="OnlineManagerUdp"))
+        if GameSettings.ONLINE_PUSH:
+            self._tasks.append(asyncio.create_task(self._stream_loop(), name="OnlineManagerStream"))
+
+    async def _shutdown(self) -> None:
+        tasks = self._tasks + ([self._chat_task] if self._chat_task else [])
+        self._tasks, self._chat_task = [], None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._close_udp()
+        self._streaming = False
+        await self._http.close()
+
+    async def _request(self, method: str, path: str, **kwargs) -> HttpResponse:
+        start = time.perf_counter()
+        try:
+            resp = await self._http.request(method, path, **kwargs)
+        except BaseException:
+            self._net_stats.request(path, failed=True)
+            raise
+        finally:
+            self._request_count += 1
+            self._latencies.append(time.perf_counter() - start)
+            self._count_http_bytes()
+        self._net_stats.request(path, self._latencies[-1])
+        return resp
+
+    def _count_http_bytes(self) -> None:
+        sent, received = self._http.bytes_sent, self._http.bytes_received
+        self._net_stats.transfer(sent - self._http_bytes[0], received - self._http_bytes[1])
+        self._http_bytes = (sent, received)
+
+    def _capture_exchange(self, method: str, target: str, request_type: str, body: bytes,
+                          resp: HttpResponse, seconds: float) -> None:
+        self._capture.exchange(CAPTURE_HTTP, self._capture.clock() - seconds, seconds, method, target, resp.status,
+                               request_type, body, resp.headers.get("content-type", ""), resp.body)
+
+    def _wake(self) -> None:
+        # Game thread: there is something to upload
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None or wakeup is None:
             return
-        
-        url = f"{self.base}/players"
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass # Loop already closed by stop()
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await self._wait_for_sync()
+            ok = await self._sync()
+            seen = (self._players_version, self._chat_seq)
+            self._poll_interval = self._next_poll_interval(ok, seen != self._seen)
+            self._seen = seen
+
+    async def _wait_for_sync(self) -> None:
+        await asyncio.sleep(POLL_INTERVAL)
+        rest = self._poll_interval - POLL_INTERVAL
+        if rest > 0:
+            if self._failures:
+                await asyncio.sleep(rest) # Backing off: uploads wait too
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), rest)
+                except asyncio.TimeoutError:
+                    pass
+        self._wakeup.clear()
+
+    def _next_poll_interval(self, ok: bool, changed: bool) -> float:
+        if not ok:
+            self._failures += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._failures - 1))
+            return random.uniform(delay / 2, delay)
+        if self._failures:
+            Logger.info(f"OnlineManager reconnected after {self._failures} failed syncs")
+            self._failures = 0
+        # Push delivers players and chat, so syncs only upload (and those don't wait)
+        if self._streaming or not self._players_nearby():
+            return IDLE_POLL_INTERVAL
+        if changed:
+            return POLL_INTERVAL
+        return min(IDLE_POLL_INTERVAL, self._poll_interval * POLL_SLOWDOWN)
+
+    def _players_nearby(self) -> bool:
+        # The server only sends players within our view radius, so anyone on our map is near
+        frame = self._last_frame
+        if frame is None:
+            return False
+        with self._lock:
+            return any(p.get("map") == frame[2] for p in self.list_players)
+
+    def _sync_started(self) -> None:
+        with self._lock:
+            self._sync_times.append(time.monotonic())
+
+    def _sync_error(self, message: str) -> None:
+        # Only the first failure in a row is worth a warning; the backoff handles the rest
+        if self._failures:
+            Logger.debug(message)
+        else:
+            Logger.warning(message)
+
+    async def _sync(self) -> bool:
+        """
+        One round trip: upload our state and chat, receive players and new chat. Returns False
+        when the server could not be reached.
+        """
+        if self.player_id == -1:
+            return True
+
+        with self._lock:
+            state, self._pending_state = self._pending_state, None
+
+        # While the push stream is up it delivers players and chat; only upload then
+        streaming = self._streaming
+        if self._udp is not None:
+            # Whether datagrams get through is up to UDP_TIMEOUT
+            await self._sync_udp(state, streaming)
+            return True
+        with self._lock:
+            chat, self._outgoing_chat = self._outgoing_chat, []
+        if streaming and state is None and not chat:
+            return True
+
         body = {
             "id": self.player_id,
-            "x": update_data["x"],
-            "y": update_data["y"],
-            "map": update_data["map"],
-            "moving": update_data["moving"],
-            "direction": update_data["direction"]
+            "state": state,
+            "chat": chat,
+            "since": self._players_version,
+            "chat_after": self._chat_seq,
+            "radius": GameSettings.ONLINE_VIEW_RADIUS,
+            "receive": not streaming
         }
-        
+        delivered = False
+        self._sync_started()
         try:
-            resp = requests.post(url, json=body, timeout=5)
-            if resp.status_code != 200:
-                Logger.warning(f"Update failed: {resp.status_code} {resp.text}")
+            if self._binary:
+                data = encode_sync_request(body, await self._map_id(state["map"]) if state else 0)
+                resp = await self._request("POST", "/sync", data=data, headers={"Content-Type": BINARY_CONTENT_TYPE})
+            else:
+                resp = await self._request("POST", "/sync", json_body=body)
+            if resp.status != 200:
+                self._sync_error(f"Sync failed: {resp.status} {resp.text}")
+                self._update_failed(state)
+                with self._lock:
+                    # Sent again with the next sync
+                    self._outgoing_chat[:0] = chat
+                return False
+            delivered = True
+            if state is not None:
+                self._updates_sent += 1
+
+            if resp.headers.get("content-type") == BINARY_CONTENT_TYPE:
+                payload = await self._decode_sync_response(resp.body)
+            else:
+                payload = resp.json()
+            self._apply_sync(payload)
+            return True
         except Exception as e:
-            Logger.warning(f"Online update error: {e}")
-    
-    def _fetch_players(self) -> None:
+            self._sync_error(f"OnlineManager sync error: {e}")
+            if delivered:
+                return True
+            self._update_failed(state)
+            with self._lock:
+                self._outgoing_chat[:0] = chat
+            return False
+
+    async def _decode_sync_response(self, data: bytes) -> dict:
+        payload = decode_sync_response(data, self._map_names)
+        players = payload["players"]
+        if players and any(p["map"] is None for p in players["players"].values()):
+            # Someone is on a map we have no id for yet
+            await self._refresh_maps()
+            payload = decode_sync_response(data, self._map_names)
+        return payload
+
+    def _apply_sync(self, payload: dict) -> None:
+        if payload["players"] is not None:
+            self._apply_players(payload["players"])
+        self._add_chat(payload["messages"])
+        ack = payload.get("ack")
+        if ack:
+            with self._lock:
+                self._pending_ack = tuple(ack)
+                if self._udp_unacked is not None and ack[0] >= self._udp_unacked["seq"]:
+                    self._udp_unacked = None
+
+    # UDP transport: positions and players over datagrams, chat over HTTP
+    async def _open_udp(self) -> None:
+        parts = urlsplit(self.base)
+        inbox = asyncio.Queue()
         try:
-            url = f"{self.base}/players"
-            resp = requests.get(url, timeout=5)
-            resp.raise_for_status()
-            all_players = resp.json().get("players", [])
+            self._udp, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _DatagramProtocol(inbox), remote_addr=(parts.hostname, self._udp_port))
+        except OSError as e:
+            Logger.warning(f"OnlineManager UDP unavailable, using HTTP: {e}")
+            self._udp_port = None
+            return
+        self._udp_inbox = inbox
+        self._udp_waiting_since = None
 
-            pid = self.player_id
-            filtered = [p for key, p in all_players.items() if int(key) != pid]
+    def _close_udp(self) -> None:
+        transport, self._udp = self._udp, None
+        if transport is not None:
+            transport.close()
+            self._udp_inbox.put_nowait(None) # Ends the UDP task
+
+    async def _sync_udp(self, state: dict | None, streaming: bool) -> None:
+        now = time.monotonic()
+        # Chat runs beside the datagrams, so a slow HTTP round trip never holds up positions
+        if (self._chat_task is None or self._chat_task.done()) and now >= self._chat_retry_at:
             with self._lock:
-                self.list_players = filtered
-            
+                chat, self._outgoing_chat = self._outgoing_chat, []
+            if chat or (not streaming and now - self._chat_polled_at >= CHAT_POLL_INTERVAL):
+                self._chat_task = asyncio.create_task(self._sync_chat(chat, streaming))
+                self._chat_polled_at = now
+
+        with self._lock:
+            new_state = state is not None
+            if new_state:
+                self._udp_unacked = state
+            else:
+                # A lost datagram would leave the server extrapolating from an old state
+                state = self._udp_unacked
+        if streaming and state is None:
+            return
+        body = {
+            "id": self.player_id,
+            "state": state,
+            "since": self._players_version,
+            "radius": GameSettings.ONLINE_VIEW_RADIUS,
+            "receive": not streaming
+        }
+        try:
+            data = encode_sync_request(body, await self._map_id(state["map"]) if state else 0)
+            if self._udp is None:
+                return # Closed while the map id was looked up
+            self._udp_seq += 1
+            self._sync_started()
+            if random.random() >= GameSettings.ONLINE_UDP_LOSS:
+                datagram = encode_datagram(DATAGRAM_STATE, self._udp_seq, data, self._udp_token)
+                self._udp.sendto(datagram)
+                self._capture.datagram(CAPTURE_UDP, self._capture.clock(), datagram)
+                self._net_stats.transfer(up=len(datagram))
+            self._request_count += 1
+            self._net_stats.request("udp")
+            # Every datagram we send is answered (players, or at least the ack of our state)
+            if self._udp_waiting_since is None:
+                self._udp_waiting_since = now
+            if new_state:
+                self._updates_sent += 1
         except Exception as e:
-            Logger.warning(f"OnlineManager fetch error: {e}")
+            Logger.warning(f"OnlineManager UDP send error: {e}")
+
+        waiting_since = self._udp_waiting_since
+        if waiting_since is not None and now - waiting_since > UDP_TIMEOUT:
+            Logger.warning("OnlineManager got no UDP answers, falling back to HTTP")
+            self._udp_port = None
+            self._close_udp()
+            with self._lock:
+                # The server may never have seen it
+                if self._pending_state is None:
+                    self._pending_state = self._udp_unacked
+                self._udp_unacked = None
 
-    # Added: Fetch chat implementation
-    def _fetch_chat(self) -> None:
+    async def _sync_chat(self, chat: list[str], streaming: bool) -> None:
+        sent = 0
         try:
-            url = f"{self.base}/chat"
-            resp = requests.get(url, timeout=5)
-            if resp.status_code == 200:
-                msgs = resp.json().get("messages", [])
-                with self._lock:
-                    self.chat_messages = msgs
-        except Exception:
-            pass # Fail silently for chat to avoid log spam
\ No newline at end of file
+            for text in chat:
+                await self._request("POST", "/chat", json_body={"id": self.player_id, "text": text})
+                sent += 1
+            if not streaming:
+                resp = await self._request("GET", "/chat", params={"after": self._chat_seq})
+                if resp.status == 200:
+                    self._add_chat(resp.json()["messages"])
+            self._chat_failures = 0
+        except Exception as e:
+            # Backs off like the sync does, and warns only once
+            message = f"OnlineManager chat error: {e}"
+            if self._chat_failures:
+                Logger.debug(message)
+            else:
+                Logger.warning(message)
+            self._chat_failures += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._chat_failures - 1))
+            self._chat_retry_at = time.monotonic() + random.uniform(delay / 2, delay)
+            with self._lock:
+                self._outgoing_chat[:0] = chat[sent:]
+
+    async def _udp_loop(self) -> None:
+        inbox = self._udp_inbox
+        while (data := await inbox.get()) is not None:
+            if random.random() < GameSettings.ONLINE_UDP_LOSS:
+                continue
+            self._capture.datagram(CAPTURE_UDP, self._capture.clock(), b"", data)
+            self._net_stats.transfer(down=len(data))
+            try:
+                kind, seq, _, payload = decode_datagram(data)
+                if kind != DATAGRAM_REPLY:
+                    continue
+                if seq <= self._udp_answer_seq:
+                    self._net_stats.drop("stale")
+                    continue # Overtaken by a newer answer
+                self._udp_answer_seq = seq
+                if self._udp_waiting_since is not None:
+                    # From the oldest datagram this answer covers
+                    self._net_stats.round_trip("udp", time.monotonic() - self._udp_waiting_since)
+                self._udp_waiting_since = None
+                self._apply_sync(await self._decode_sync_response(payload))
+            except Exception as e:
+                Logger.warning(f"OnlineManager UDP receive error: {e}")
+
+    def _update_failed(self, state: dict | None) -> None:
+        if state is None:
+            return
+        self._updates_failed += 1
+        with self._lock:
+            # Retry with the next sync unless a newer state replaced it meanwhile
+            if self._pending_state is None:
+                self._pending_state = state
+
+    async def _stream_loop(self) -> None:
+        # Connection attempts in a row that never got the stream up
+        failures = 0
+        while True:
+            try:
+                await self._read_stream()
+            except Exception as e:
+                message = f"OnlineManager stream error, falling back to polling: {e}"
+                if failures:
+                    Logger.debug(message)
+                else:
+                    Logger.warning(message)
+            failures = 0 if self._streaming else failures + 1
+            self._streaming = False
+            delay = min(STREAM_RETRY_MAX, STREAM_RETRY_INTERVAL * 2 ** max(0, failures - 1))
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    async def _read_stream(self) -> None:
+        params = self._players_params()
+        started = self._capture.clock()
+        status, reader, writer = await self._http.stream("/stream", params=params)
+        try:
+            if status != 200:
+                raise ConnectionError(f"stream refused: {status}")
+            self._streaming = True
+            Logger.info("OnlineManager connected to push stream")
+
+            # Server-sent events: "event:" and "data:" lines, terminated by a blank line
+            event, data = "", ""
+            while True:
+                try:
+                    raw = await asyncio.wait_for(reader.readline(), STREAM_READ_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise ConnectionError("stream went silent") from None
+                self._net_stats.transfer(down=len(raw))
+                if not raw:
+                    raise ConnectionError("stream closed by server")
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data += line[5:].strip()
+                elif line == "" and data:
+                    self._capture.event(CAPTURE_STREAM, self._capture.clock(), event, data.encode("utf-8"))
+                    self._handle_event(event, json.loads(data))
+                    event, data = "", ""
+        finally:
+            writer.close()
+            # Recorded when it ends, with how long it was held, as the server does
+            duration = self._capture.clock() - started
+            self._capture.exchange(CAPTURE_STREAM, started, duration, "GET", self._http.target("/stream", params),
+                                   status, "", b"", "text/event-stream", b"")
+
+    def _handle_event(self, event: str, payload: dict) -> None:
+        if event == "players":
+            self._apply_players(payload)
+        elif event == "chat":
+            self._add_chat(payload.get("messages", []), reset=payload.get("reset", False))
+
+    def _add_chat(self, msgs: list[dict], reset: bool = False) -> None:
+        with self._lock:
+            if reset:
+                self.chat_messages.clear()
+            # Only messages after our cursor arrive, so appending keeps the history in order
+            self.chat_messages.extend(msgs)
+            if msgs:
+                self._chat_seq = msgs[-1]["seq"]
+
+    def _players_params(self) -> dict:
+        # Ask only for the players around us once we are registered (radius 0: everyone).
+        # The id is sent either way, a sharded server routes by it
+        if self.player_id == -1:
+            return {}
+        return {"id": self.player_id, "radius": max(0.0, GameSettings.ONLINE_VIEW_RADIUS)}
+
+    def _apply_players(self, payload: dict) -> None:
+        """Applies a full or delta /players payload to the local player table."""
+        changed = {int(key): p for key, p in payload.get("players", {}).items()}
+        pid = self.player_id
+        with self._lock:
+            if payload.get("full", True):
+                self._players = changed
+            else:
+                self._players.update(changed)
+                for removed in payload.get("removed", []):
+                    self._players.pop(removed, None)
+            self._players_version = payload.get("version")
+            self._net_stats.snapshot()
+            self.list_players = [p for key, p in self._players.items() if key != pid]
+
+    async def _map_id(self, map_name: str) -> int:
+        map_id = self._map_ids.get(map_name)
+        if map_id is None:
+            resp = await self._request("GET", "/maps", params={"name": map_name})
+            if resp.status != 200:
+                raise ConnectionError(f"map lookup failed: {resp.status}")
+            data = resp.json()
+            self._set_maps(data["maps"])
+            map_id = data["id"]
+        return map_id
+
+    async def _refresh_maps(self) -> None:
+        resp = await self._request("GET", "/maps")
+        if resp.status != 200:
+            raise ConnectionError(f"map lookup failed: {resp.status}")
+        self._set_maps(resp.json()["maps"])
+
+    def _set_maps(self, maps: dict[str, int]) -> None:
+        self._map_ids = dict(maps)
+        self._map_names = {map_id: name for name, map_id in maps.items()}
+
+    # ------------------------------------------------------------------
+    # Replay (tools/replay.py)
+    # ------------------------------------------------------------------
+    def replay(self, record: Exchange) -> None:
+        """
+        Applies one record of a client capture as if its response had just arrived, without any
+        networking. Records of requests that failed or carry nothing for us are ignored.
+        """
+        if record.kind == KIND_EVENT:
+            self._handle_event(record.target, json.loads(record.response))
+        elif record.kind == KIND_DATAGRAM:
+            if not record.response:
+                return # One we sent
+            kind, seq, _, payload = decode_datagram(record.response)
+            if kind == DATAGRAM_REPLY and seq > self._udp_answer_seq:
+                self._udp_answer_seq = seq
+                self._apply_sync(decode_sync_response(payload, self._map_names))
+        elif record.kind == KIND_HTTP and record.status == 200 and record.response:
+            path = record.path
+            binary = record.response_type == BINARY_CONTENT_TYPE
+            if path == "/register":
+                data = json.loads(record.response)
+                self.player_id = data["id"]
+                self._binary = "binary" in data.get("formats", [])
+                self._map_ids, self._map_names = {}, {}
+                self._players_version = None
+                self._udp_answer_seq = 0
+            elif path == "/maps":
+                self._set_maps(json.loads(record.response)["maps"])
+            elif path == "/sync":
+                payload = decode_sync_response(record.response, self._map_names) if binary else json.loads(record.response)
+                self._apply_sync(payload)
+            elif path == "/chat" and record.method == "GET":
+                self._add_chat(json.loads(record.response)["messages"])
@@ -193,26 +193,9 @@ class Player(Entity):
         dis.normalize(self.speed * dt)
 
         # Collision Handling (Existing logic)
-        temp_rect = self.animation.rect.copy()
-        if dis.x != 0:
-            maybe_x_rect = temp_rect.move(dis.x, 0)
-            if not self.game_manager.current_map.check_collision(maybe_x_rect) and not any(maybe_x_rect.colliderect(e.animation.rect) for e in self.game_manager.current_enemy_trainers):
-                self.position.x += dis.x
-                temp_rect = maybe_x_rect
-            else:
-                self.position.x = Entity._snap_to_grid(self.position.x)
-                # If we hit a wall while auto-piloting, clear path
-                if self.path: self.path = []
-
-        if dis.y != 0:
-            maybe_y_rect = temp_rect.move(0, dis.y)
-            if not self.game_manager.current_map.check_collision(maybe_y_rect) and not any(maybe_y_rect.colliderect(e.animation.rect) for e in self.game_manager.current_enemy_trainers):
-                self.position.y += dis.y
-                temp_rect = maybe_y_rect
-            else:
-                self.position.y = Entity._snap_to_grid(self.position.y)
-                # If we hit a wall while auto-piloting, clear path
-                if self.path: self.path = []
+        if self.move_by(dis.x, dis.y):
+            # If we hit a wall while auto-piloting, clear path
+            if self.path: self.path = []
 
         # check bush
         if self.game_manager.current_map.check_touch_bush(self.animation.rect):
@@ -238,6 +221,31 @@ class Player(Entity):
         # Assuming Entity.update only handles basic state/animation.
         super().update(dt)
 
+    def move_by(self, dx: float, dy: float) -> bool:
+        """
+        Moves one axis at a time, stopping at walls and enemy trainers (snapped to the grid on
+        that axis). Returns True if either axis was blocked.
+        """
+        blocked = False
+        temp_rect = self.animation.rect.copy()
+        if dx != 0:
+            maybe_x_rect = temp_rect.move(dx, 0)
+            if not self.game_manager.current_map.check_collision(maybe_x_rect) and not any(maybe_x_rect.colliderect(e.animation.rect) for e in self.game_manager.current_enemy_trainers):
+                self.position.x += dx
+                temp_rect = maybe_x_rect
+            else:
+                self.position.x = Entity._snap_to_grid(self.position.x)
+                blocked = True
+
+        if dy != 0:
+            maybe_y_rect = temp_rect.move(0, dy)
+            if not self.game_manager.current_map.check_collision(maybe_y_rect) and not any(maybe_y_rect.colliderect(e.animation.rect) for e in self.game_manager.current_enemy_trainers):
+                self.position.y += dy
+            else:
+                self.position.y = Entity._snap_to_grid(self.position.y)
+                blocked = True
+        return blocked
+
     @override
     def draw(self, screen: pg.Surface, camera: PositionCamera) -> None:
         super().draw(screen, camera)
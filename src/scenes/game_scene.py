@@ -1,14 +1,25 @@
 import pygame as pg
+import time
 
 from src.scenes.scene import Scene
 from src.core import GameManager, OnlineManager
 from src.core.services import sound_manager, resource_manager, input_manager
-from src.utils import Logger, PositionCamera, GameSettings, Position
+from src.utils import Logger, PositionCamera, GameSettings, Position, SnapshotBuffer
+from src.utils.net_stats import HISTORY_SECONDS
 from src.interface.components import Button, OnOffButton, Slider, ChatOverlay
 from src.sprites import Sprite, Animation 
 from typing import override
 
 
+# Network statistics overlay (F3): graph colors
+NET_GRAPH_COLORS = {
+    "rtt_ms": (255, 200, 80),
+    "requests": (120, 200, 255),
+    "bytes_up": (120, 255, 140),
+    "bytes_down": (255, 120, 200),
+    "drops": (255, 90, 90),
+}
+
 NAV_DESTINATIONS = {
     "Gym": (24, 24),
     "Forest Entrance": (54, 5)
@@ -21,6 +32,8 @@ class GameScene(Scene):
     
     # Key: Player ID, Value: Animation object
     remote_players: dict[int, Animation] 
+    # Key: Player ID, Value: received positions, drawn ONLINE_INTERP_DELAY in the past
+    remote_buffers: dict[int, SnapshotBuffer]
     
     in_setting = False
     in_bag = False
@@ -30,6 +43,7 @@ class GameScene(Scene):
     is_mute = False
     shop_npc = None
     shop_tab = "buy"
+    show_net_stats = False
     bag = {"monsters": [], "items": []}
 
     # Variables for minimap caching
@@ -54,8 +68,11 @@ class GameScene(Scene):
         else:
             self.online_manager = None
         
+        self.show_net_stats = GameSettings.ONLINE_STATS_OVERLAY
+
         # Initialize dictionary for remote player animations
         self.remote_players = {}
+        self.remote_buffers = {}
 
         self.map_button = Button(
             "UI/button_play.png", "UI/button_play_hover.png", # Reusing backpack sprite as placeholder
@@ -293,6 +310,9 @@ class GameScene(Scene):
         # Check if there is assigned next scene
         self.game_manager.try_switch_map()
 
+        if self.online_manager and input_manager.key_pressed(pg.K_F3):
+            self.show_net_stats = not self.show_net_stats
+
         if not self.chat_overlay.is_open and not self.in_setting and not self.in_bag and not self.in_shop and not self.in_map:
             if input_manager.key_pressed(pg.K_t):
                 self.chat_overlay.open()
@@ -315,6 +335,14 @@ class GameScene(Scene):
 
         # Update Online Players with orientation logic
         if self.game_manager.player is not None and self.online_manager is not None:
+            # The player already moved locally; apply the server's correction, if any
+            correction = self.online_manager.reconcile()
+            if correction is not None:
+                player = self.game_manager.player
+                # Through the same collision checks as walking, so a correction never puts us in a wall
+                player.move_by(correction[0], correction[1])
+                player.animation.update_pos(player.position)
+
             # Send our data
             _ = self.online_manager.update(
                 self.game_manager.player.position.x,
@@ -327,6 +355,8 @@ class GameScene(Scene):
             # Process received data
             online_data = self.online_manager.get_list_players()
             active_ids = set()
+            now = time.monotonic()
+            render_time = now - GameSettings.ONLINE_INTERP_DELAY
 
             for p_data in online_data:
                 pid = p_data.get("id")
@@ -345,18 +375,22 @@ class GameScene(Scene):
                     )
                     # Force initial position
                     self.remote_players[pid].update_pos(Position(p_data["x"], p_data["y"]))
+                    self.remote_buffers[pid] = SnapshotBuffer()
                 
                 anim = self.remote_players[pid]
-                target_x = p_data["x"]
-                target_y = p_data["y"]
+                buffer = self.remote_buffers[pid]
+                buffer.push(now, p_data["x"], p_data["y"], p_data["moving"], p_data["direction"])
+                shown = buffer.sample(render_time)
+                target_x = shown.x
+                target_y = shown.y
                 
                 # Calculate direction based on movement (Delta)
                 dx = target_x - anim.rect.x
                 dy = target_y - anim.rect.y
                 
                 # Determine orientation
-                if p_data["moving"]:
-                    anim.switch(p_data["direction"])
+                if shown.moving:
+                    anim.switch(shown.direction)
                     anim.update(dt) # Cycle animation frames if moving
                 else:
                     anim.accumulator = 0 # Stop animation cycle if standing still
@@ -368,6 +402,7 @@ class GameScene(Scene):
             for old_id in list(self.remote_players.keys()):
                 if old_id not in active_ids:
                     del self.remote_players[old_id]
+                    del self.remote_buffers[old_id]
 
         if self.in_setting:
             # widgets were repositioned when opening panel, just update them now
@@ -460,6 +495,11 @@ class GameScene(Scene):
         
         self.chat_overlay.draw(screen)
 
+        if self.online_manager and self.show_net_stats:
+            self._draw_net_stats(screen)
+        elif GameSettings.DEBUG and self.online_manager:
+            self._draw_net_debug(screen)
+
         # dim background and draw modern rounded panel when a UI is open
         if self.in_setting or self.in_bag or self.in_shop or self.in_map:
             screen_w, screen_h = screen.get_size()
@@ -542,6 +582,91 @@ class GameScene(Scene):
                 ty = btn.hitbox.centery - txt.get_height() // 2
                 screen.blit(txt, (tx, ty))
 
+    # Network Overlay Drawing
+    def _draw_net_debug(self, screen: pg.Surface):
+        # Effective sync rate of the adaptive polling, bottom right
+        stats = self.online_manager.get_connection_stats()
+        text = f"net {stats['poll_rate_hz']:.1f} Hz, poll {stats['poll_interval_ms']:.0f} ms"
+        if stats["streaming"]:
+            text += ", push"
+        if stats["failed_syncs"]:
+            text += f", backing off ({stats['failed_syncs']} failed)"
+        surf = resource_manager.get_font("Minecraft.ttf", 14).render(text, True, (240, 240, 240))
+        x = screen.get_width() - surf.get_width() - 16
+        y = screen.get_height() - surf.get_height() - 16
+        bg = pg.Surface((surf.get_width() + 12, surf.get_height() + 8), pg.SRCALPHA)
+        bg.fill((0, 0, 0, 120))
+        screen.blit(bg, (x - 6, y - 4))
+        screen.blit(surf, (x, y))
+
+    def _draw_net_stats(self, screen: pg.Surface):
+        # Network statistics with one-minute graphs, top left (F3)
+        net = self.online_manager.get_net_stats()
+        stats = self.online_manager.get_connection_stats()
+        font = resource_manager.get_font("Minecraft.ttf", 14)
+        age = net["snapshot_age_ms"]
+        drops = f"drops {net['drops_per_s']:.0f}/s"
+        if net["drops"]:
+            drops += " (" + ", ".join(f"{reason} {count}" for reason, count in sorted(net["drops"].items())) + ")"
+        lines = [
+            f"poll {stats['poll_rate_hz']:.1f} Hz / {stats['poll_interval_ms']:.0f} ms"
+            + (", push" if stats["streaming"] else "")
+            + (f", backing off ({stats['failed_syncs']} failed)" if stats["failed_syncs"] else ""),
+            f"{net['requests_per_s']:.0f} req/s, up {net['bytes_up_per_s'] / 1024:.1f} KB/s, down {net['bytes_down_per_s'] / 1024:.1f} KB/s",
+            drops,
+            "snapshot age " + (f"{age} ms" if age is not None else "-"),
+        ]
+        for endpoint, rtt in sorted(net["rtt"].items()):
+            line = f"{endpoint}: " + (f"{rtt['last_ms']:.0f} ms (p50 {rtt['p50_ms']:.0f}, max {rtt['max_ms']:.0f})" if rtt["last_ms"] is not None else "-")
+            if rtt["errors"]:
+                line += f", {rtt['errors']} failed"
+            lines.append(line)
+
+        width, graph_h, pad = 360, 44, 8
+        history = net["history"]
+        graphs = [
+            ("RTT ms", ["rtt_ms"]),
+            ("req/s", ["requests"]),
+            ("bytes/s up, down", ["bytes_up", "bytes_down"]),
+            ("drops/s", ["drops"]),
+        ]
+        height = pad + len(lines) * (font.get_height() + 2) + len(graphs) * (graph_h + pad) + pad
+        panel = pg.Surface((width, height), pg.SRCALPHA)
+        panel.fill((0, 0, 0, 150))
+        screen.blit(panel, (16, 16))
+
+        x, y = 16 + pad, 16 + pad
+        for line in lines:
+            screen.blit(font.render(line, True, (240, 240, 240)), (x, y))
+            y += font.get_height() + 2
+        for label, names in graphs:
+            self._draw_net_graph(screen, pg.Rect(x, y + pad // 2, width - 2 * pad, graph_h), label, [history[n] for n in names],
+                                 [NET_GRAPH_COLORS[n] for n in names], font)
+            y += graph_h + pad
+
+    @staticmethod
+    def _draw_net_graph(screen: pg.Surface, rect: pg.Rect, label: str, series: list[list], colors: list[tuple], font: pg.font.Font):
+        # One line per series over the last minute (newest on the right), scaled to the largest
+        # value; None leaves a gap
+        pg.draw.rect(screen, (90, 90, 90), rect, 1)
+        peak = max((v for values in series for v in values if v is not None), default=0.0)
+        step = rect.width / (HISTORY_SECONDS - 1)
+        if peak > 0:
+            for values, color in zip(series, colors):
+                start = rect.right - (len(values) - 1) * step
+                points = []
+                for i, v in enumerate(values):
+                    if v is None:
+                        if len(points) > 1:
+                            pg.draw.lines(screen, color, False, points)
+                        points = []
+                        continue
+                    points.append((start + i * step, rect.bottom - 1 - v / peak * (rect.height - 2)))
+                if len(points) > 1:
+                    pg.draw.lines(screen, color, False, points)
+        text = font.render(f"{label} (max {peak:.0f})", True, (200, 200, 200))
+        screen.blit(text, (rect.x + 4, rect.y + 2))
+
     # Minimap Drawing Logic
     def _draw_minimap(self, screen: pg.Surface, camera: PositionCamera):
         cur_map = self.game_manager.current_map
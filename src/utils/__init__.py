@@ -4,6 +4,10 @@ from .logger import Logger
 from .settings import GameSettings
 from .loader import load_tmx, load_img, load_font, load_sound
 from .definition import Position, PositionCamera, Direction, MouseBtn, Key, Teleport
+from .interpolation import SnapshotBuffer
+from .prediction import InputHistory
+from .async_http import AsyncHttpClient, HttpResponse
+from .net_stats import NetStats
 
 __all__ = [
     "Logger",
@@ -18,4 +22,9 @@ __all__ = [
     "MouseBtn",
     "Key",
     "Teleport",
+    "SnapshotBuffer",
+    "InputHistory",
+    "AsyncHttpClient",
+    "HttpResponse",
+    "NetStats",
 ]
\ No newline at end of file
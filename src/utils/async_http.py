@@ -0,0 +1,198 @@
+"""
+Small HTTP/1.1 client on asyncio streams for OnlineManager's network loop. Connections are kept
+alive and reused between requests, so polls, position updates and chat share a few sockets
+instead of each blocking a thread of its own.
+"""
+import asyncio
+import json
+import time
+from typing import Callable, NamedTuple
+from urllib.parse import urlsplit, urlencode
+
+DEFAULT_TIMEOUT = 5.0
+# Server-sent event lines can carry a whole player list
+STREAM_LINE_LIMIT = 16 * 1024 * 1024
+
+Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+# Called with (method, target, request content type, request body, response, seconds) after
+# every completed request
+Observer = Callable[[str, str, str, bytes, "HttpResponse", float], None]
+
+
+class HttpResponse(NamedTuple):
+    status: int
+    # Header names in lower case
+    headers: dict[str, str]
+    body: bytes
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class AsyncHttpClient:
+    """
+    Keep-alive client for one server, used from a single event loop. Up to `pool_size` idle
+    connections are kept; requests made while all of them are busy open another one.
+    """
+    host: str
+    port: int
+    pool_size: int
+    timeout: float
+    # Path prefix of the base URL
+    _prefix: str
+    _idle: list[Connection]
+    # Sees every completed request, e.g. to capture the traffic (None: no one)
+    observer: Observer | None
+    # Bytes written and read so far, headers included (stream bodies are read by the caller)
+    bytes_sent: int
+    bytes_received: int
+
+    def __init__(self, base_url: str, pool_size: int = 2, timeout: float = DEFAULT_TIMEOUT):
+        parts = urlsplit(base_url)
+        if parts.scheme != "http":
+            raise ValueError(f"unsupported URL scheme: {base_url}")
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 80
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._prefix = parts.path.rstrip("/")
+        self._idle = []
+        self.observer = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    async def request(self, method: str, path: str, *, params: dict | None = None, json_body=None,
+                      data: bytes | None = None, headers: dict[str, str] | None = None,
+                      timeout: float | None = None) -> HttpResponse:
+        """Sends one request and reads the whole response; raises TimeoutError after `timeout` seconds."""
+        if data is None:
+            data = json.dumps(json_body).encode("utf-8") if json_body is not None else b""
+        head = {"Host": f"{self.host}:{self.port}", "Content-Length": str(len(data))}
+        if json_body is not None:
+            head["Content-Type"] = "application/json"
+        head.update(headers or {})
+        target = self.target(path, params)
+        message = self._head(method, target, head) + data
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._exchange(message), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{method} {path} timed out after {timeout}s") from None
+        if self.observer is not None:
+            self.observer(method, target, head.get("Content-Type", ""), data, response, time.perf_counter() - start)
+        return response
+
+    async def stream(self, path: str, *, params: dict | None = None,
+                     timeout: float | None = None) -> tuple[int, asyncio.StreamReader, asyncio.StreamWriter]:
+        """
+        Opens a connection of its own for a response that never ends (server-sent events).
+        Returns the status and the connection, positioned at the start of the body; the caller
+        closes the writer.
+        """
+        head = {"Host": f"{self.host}:{self.port}", "Accept": "text/event-stream", "Connection": "close"}
+        message = self._head("GET", self.target(path, params), head)
+
+        async def start() -> tuple[int, asyncio.StreamReader, asyncio.StreamWriter]:
+            reader, writer = await asyncio.open_connection(self.host, self.port, limit=STREAM_LINE_LIMIT)
+            try:
+                writer.write(message)
+                self.bytes_sent += len(message)
+                await writer.drain()
+                _, status, _, size = await _read_head(reader)
+                self.bytes_received += size
+            except BaseException:
+                writer.close()
+                raise
+            return status, reader, writer
+
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(start(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"GET {path} timed out after {timeout}s") from None
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    async def _exchange(self, message: bytes) -> HttpResponse:
+        while True:
+            reused = bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await asyncio.open_connection(self.host, self.port)
+            keep = answered = False
+            try:
+                writer.write(message)
+                self.bytes_sent += len(message)
+                await writer.drain()
+                version, status, headers, size = await _read_head(reader)
+                answered = True
+                body, keep = await _read_body(reader, version, status, headers)
+                self.bytes_received += size + len(body)
+                return HttpResponse(status, headers, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if reused and not answered:
+                    continue # The server closed the idle connection meanwhile; retry on a new one
+                raise
+            finally:
+                if keep and len(self._idle) < self.pool_size:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+
+    def target(self, path: str, params: dict | None = None) -> str:
+        """The request target sent for `path` and query `params`."""
+        target = self._prefix + path
+        if params:
+            target += "?" + urlencode(params)
+        return target
+
+    @staticmethod
+    def _head(method: str, target: str, headers: dict[str, str]) -> bytes:
+        lines = [f"{method} {target} HTTP/1.1"] + [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _read_head(reader: asyncio.StreamReader) -> tuple[str, int, dict[str, str], int]:
+    """Version, status, headers and the size of the head in bytes."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed by server")
+    size = len(line)
+    version, status, *_ = line.decode("latin-1").split(None, 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        size += len(line)
+        if line in (b"\r\n", b"\n", b""):
+            return version, int(status), headers, size
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _read_body(reader: asyncio.StreamReader, version: str, status: int, headers: dict[str, str]) -> tuple[bytes, bool]:
+    """The response body, and whether the connection can be used again."""
+    connection = headers.get("connection", "").lower()
+    keep = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    if status in (204, 304) or 100 <= status < 200:
+        return b"", keep
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"])), keep
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Trailers, up to the blank line
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks), keep
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+    # Delimited by the server closing the connection
+    return await reader.read(), False
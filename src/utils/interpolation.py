@@ -0,0 +1,57 @@
+from collections import deque
+from typing import NamedTuple
+
+from .settings import GameSettings
+
+# A player silent for longer than this is held at its old position until just before its new
+# one, instead of sliding there over the whole silence
+MAX_SAMPLE_GAP = 0.1
+# Jumps longer than this (teleports) are not interpolated
+SNAP_DISTANCE = 4 * GameSettings.TILE_SIZE
+MAX_SAMPLES = 32
+
+
+class Sample(NamedTuple):
+    t: float
+    x: float
+    y: float
+    moving: bool
+    direction: str
+
+
+class SnapshotBuffer:
+    """
+    Timestamped positions of one remote player. Rendering a fixed delay in the past always
+    has a sample on both sides, so the player moves smoothly between network updates.
+    """
+    samples: deque[Sample]
+
+    def __init__(self):
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def push(self, t: float, x: float, y: float, moving: bool, direction: str) -> None:
+        """Records the player's state received at time `t`; repeats of the last state are ignored."""
+        if self.samples:
+            last = self.samples[-1]
+            if (x, y, moving, direction) == (last.x, last.y, last.moving, last.direction):
+                return
+            if ((x - last.x) ** 2 + (y - last.y) ** 2) ** 0.5 > SNAP_DISTANCE:
+                self.samples.clear()
+            elif t - last.t > MAX_SAMPLE_GAP:
+                self.samples.append(last._replace(t=t - MAX_SAMPLE_GAP))
+        self.samples.append(Sample(t, x, y, moving, direction))
+
+    def sample(self, t: float) -> Sample | None:
+        """The interpolated state at time `t`, clamped to the oldest and newest samples."""
+        samples = self.samples
+        if not samples:
+            return None
+        # Samples both before `t` are no longer needed
+        while len(samples) >= 2 and samples[1].t <= t:
+            samples.popleft()
+        a = samples[0]
+        if len(samples) == 1 or t <= a.t:
+            return a
+        b = samples[1]
+        k = (t - a.t) / (b.t - a.t)
+        return Sample(t, a.x + (b.x - a.x) * k, a.y + (b.y - a.y) * k, a.moving or b.moving, b.direction)
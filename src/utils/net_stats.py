@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import Counter, deque
+
+# Seconds of history kept for the overlay graphs
+HISTORY_SECONDS = 60
+# Round trips kept per endpoint for its median
+RTT_SAMPLES = 64
+
+SERIES = ("rtt_ms", "requests", "bytes_up", "bytes_down", "drops")
+
+
+class NetStats:
+    """
+    Rolling network statistics of the online client: round trip times per endpoint, bytes
+    and requests per second, dropped updates and the age of the newest player snapshot.
+    The network thread records, the game thread reads; counts are summed per second and the
+    last HISTORY_SECONDS seconds are kept for graphs.
+    """
+    _lock: threading.Lock
+    # Start of the second being counted, and its sums
+    _second: int
+    _current: dict[str, float]
+    _rtt_count: int
+    history: dict[str, deque]
+    _rtts: dict[str, deque[float]]
+    _errors: Counter
+    _drops: Counter
+    _snapshot_at: float | None
+
+    def __init__(self, history: int = HISTORY_SECONDS):
+        self._lock = threading.Lock()
+        self._second = int(time.monotonic())
+        self._current = dict.fromkeys(SERIES, 0.0)
+        self._rtt_count = 0
+        # The RTT of a second without round trips is None (a gap in the graph)
+        self.history = {name: deque(maxlen=history) for name in SERIES}
+        self._rtts = {}
+        self._errors = Counter()
+        self._drops = Counter()
+        self._snapshot_at = None
+
+    # Recording (network thread)
+    def request(self, endpoint: str, rtt: float | None = None, failed: bool = False) -> None:
+        """A request or datagram sent, with its round trip time if it is already known."""
+        with self._lock:
+            self._roll()
+            self._current["requests"] += 1
+            if failed:
+                self._errors[endpoint] += 1
+            elif rtt is not None:
+                self._round_trip(endpoint, rtt)
+
+    def round_trip(self, endpoint: str, rtt: float) -> None:
+        """An answer that arrived separately from its request (UDP)."""
+        with self._lock:
+            self._roll()
+            self._round_trip(endpoint, rtt)
+
+    def _round_trip(self, endpoint: str, rtt: float) -> None:
+        self._current["rtt_ms"] += rtt * 1000.0
+        self._rtt_count += 1
+        self._rtts.setdefault(endpoint, deque(maxlen=RTT_SAMPLES)).append(rtt * 1000.0)
+
+    def transfer(self, up: int = 0, down: int = 0) -> None:
+        """Bytes sent and received, headers included."""
+        with self._lock:
+            self._roll()
+            self._current["bytes_up"] += up
+            self._current["bytes_down"] += down
+
+    def drop(self, reason: str) -> None:
+        """Something queued that was never used: a state replaced before it was sent, a stale answer."""
+        with self._lock:
+            self._roll()
+            self._current["drops"] += 1
+            self._drops[reason] += 1
+
+    def snapshot(self) -> None:
+        """A player snapshot (full or delta) was applied."""
+        self._snapshot_at = time.monotonic()
+
+    # Reading (game thread)
+    def report(self) -> dict:
+        """
+        Rates over the last complete second, RTT per endpoint in ms (last, median, max of the
+        recent samples) and the graph series, oldest first.
+        """
+        with self._lock:
+            self._roll()
+            last = {name: (series[-1] if series else 0.0) for name, series in self.history.items()}
+            rtt = {}
+            for endpoint, samples in self._rtts.items():
+                ordered = sorted(samples)
+                rtt[endpoint] = {
+                    "last_ms": round(samples[-1], 1),
+                    "p50_ms": round(ordered[len(ordered) // 2], 1),
+                    "max_ms": round(ordered[-1], 1),
+                    "errors": self._errors[endpoint],
+                }
+            for endpoint in self._errors.keys() - rtt.keys():
+                rtt[endpoint] = {"last_ms": None, "p50_ms": None, "max_ms": None, "errors": self._errors[endpoint]}
+            history = {name: list(series) for name, series in self.history.items()}
+            drops = dict(self._drops)
+        snapshot_at = self._snapshot_at
+        return {
+            "rtt": rtt,
+            "requests_per_s": last["requests"],
+            "bytes_up_per_s": last["bytes_up"],
+            "bytes_down_per_s": last["bytes_down"],
+            "drops_per_s": last["drops"],
+            "drops": drops,
+            "snapshot_age_ms": None if snapshot_at is None else round((time.monotonic() - snapshot_at) * 1000.0),
+            "history": history,
+        }
+
+    def _roll(self) -> None:
+        # Closes the seconds that have passed; a long gap is recorded as idle seconds
+        now = int(time.monotonic())
+        if now == self._second:
+            return
+        idle = min(now - self._second - 1, self.history["requests"].maxlen)
+        current = self._current
+        current["rtt_ms"] = current["rtt_ms"] / self._rtt_count if self._rtt_count else None
+        for name in SERIES:
+            self.history[name].append(current[name])
+            for _ in range(idle):
+                self.history[name].append(None if name == "rtt_ms" else 0.0)
+        self._second = now
+        self._current = dict.fromkeys(SERIES, 0.0)
+        self._rtt_count = 0
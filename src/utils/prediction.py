@@ -0,0 +1,59 @@
+from collections import deque
+from typing import NamedTuple
+
+# Inputs kept while waiting for the server (10 s at 60 FPS); older ones can't be reconciled
+MAX_UNACKED_INPUTS = 600
+# Differences below this are float32 rounding on the wire, not corrections
+CORRECTION_EPSILON = 0.5
+
+
+class PredictedInput(NamedTuple):
+    seq: int
+    # Local player's position after the input was applied
+    x: float
+    y: float
+    map: str
+
+
+class InputHistory:
+    """
+    Inputs (one per frame) the local player already applied but the server has not acknowledged
+    yet. The player moves immediately; when an acknowledgement puts it somewhere else, the
+    inputs after the acknowledged one are replayed on top of the server's position.
+    """
+    _inputs: deque[PredictedInput]
+    _next_seq: int
+    corrections: int
+
+    def __init__(self):
+        self._inputs = deque(maxlen=MAX_UNACKED_INPUTS)
+        self._next_seq = 1
+        self.corrections = 0
+
+    def record(self, x: float, y: float, map_name: str) -> int:
+        """Stores the position after this frame's input and returns the input's sequence number."""
+        seq = self._next_seq
+        self._next_seq += 1
+        self._inputs.append(PredictedInput(seq, x, y, map_name))
+        return seq
+
+    def acknowledge(self, seq: int, x: float, y: float) -> tuple[float, float] | None:
+        """
+        Drops inputs up to `seq`, which the server applied at (`x`, `y`). Returns how far the
+        current position must move when that differs from the prediction, else None.
+        """
+        inputs = self._inputs
+        while inputs and inputs[0].seq < seq:
+            inputs.popleft()
+        if not inputs or inputs[0].seq != seq:
+            return None # Already acknowledged, or too old to reconcile
+        acked = inputs.popleft()
+        dx, dy = x - acked.x, y - acked.y
+        if abs(dx) <= CORRECTION_EPSILON and abs(dy) <= CORRECTION_EPSILON:
+            return None
+        if any(later.map != acked.map for later in inputs):
+            return None # Changed map since; positions on the new map are unrelated
+        # Replay: each later input moved the player by the same amount from the corrected start
+        self._inputs = deque((later._replace(x=later.x + dx, y=later.y + dy) for later in inputs), maxlen=MAX_UNACKED_INPUTS)
+        self.corrections += 1
+        return dx, dy
@@ -16,5 +16,13 @@ class Settings:
     # Online
     IS_ONLINE: bool = False
     ONLINE_SERVER_URL: str = "http://127.0.0.1:8989"
+    ONLINE_VIEW_RADIUS: float = 1024.0  # Only receive players this many pixels around us (0: everyone)
+    ONLINE_BINARY: bool = True  # Use the compact binary format for position updates and snapshots when the server supports it
+    ONLINE_PUSH: bool = True    # Receive players/chat over the /stream push channel (falls back to polling)
+    ONLINE_UDP: bool = False    # Send positions and receive players over UDP when the server offers it (chat stays on HTTP)
+    ONLINE_UDP_LOSS: float = 0.0  # Drop this fraction of our UDP datagrams on purpose, for testing
+    ONLINE_INTERP_DELAY: float = 0.1  # Draw other players this many seconds in the past, interpolating between updates (0: latest)
+    ONLINE_CAPTURE: str = ""    # Record all network traffic to this file for tools/replay.py (empty: off)
+    ONLINE_STATS_OVERLAY: bool = False  # Show the network statistics overlay from the start (F3 toggles it)
     
 GameSettings = Settings()
\ No newline at end of file
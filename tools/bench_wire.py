@@ -0,0 +1,86 @@
+"""
+Compares the JSON and binary wire formats: payload size and encode/decode throughput
+for one position update and for a player snapshot.
+
+    python -m tools.bench_wire --players 100
+"""
+import argparse
+import json
+import random
+import timeit
+
+from server.protocol import MapTable, encode_update, decode_update, encode_players, decode_players
+
+MAPS = ("map.tmx", "map2.tmx", "gym.tmx")
+DIRECTIONS = ("down", "left", "right", "up")
+
+
+def make_snapshot(n_players: int) -> dict:
+    rng = random.Random(0)
+    players = {}
+    for pid in range(n_players):
+        players[pid] = {
+            "id": pid,
+            "x": float(rng.randrange(0, 100 * 64)),
+            "y": float(rng.randrange(0, 100 * 64)),
+            "map": rng.choice(MAPS),
+            "moving": rng.random() < 0.5,
+            "direction": rng.choice(DIRECTIONS),
+        }
+    return {"version": 12345, "full": True, "players": players, "removed": []}
+
+
+def rate(fn, number: int) -> float:
+    """Operations per second."""
+    return number / timeit.timeit(fn, number=number)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=100, help="players in the snapshot")
+    parser.add_argument("--number", type=int, default=20000, help="iterations for the update benchmark")
+    args = parser.parse_args()
+
+    maps = MapTable()
+    map_names = {}
+    for name in MAPS:
+        map_names[maps.intern(name)] = name
+
+    update = {"id": 42, "x": 1234.0, "y": 567.0, "map": "map.tmx", "moving": True, "direction": "left"}
+    update_json = json.dumps(update).encode("utf-8")
+    update_bin = encode_update(42, 1234.0, 567.0, maps.intern("map.tmx"), True, "left")
+
+    snapshot = make_snapshot(args.players)
+    snapshot_json = json.dumps(snapshot).encode("utf-8")
+    snapshot_bin = encode_players(snapshot, maps)
+    snap_number = max(1, args.number // max(1, args.players))
+
+    results = {
+        "update": {
+            "json_bytes": len(update_json),
+            "binary_bytes": len(update_bin),
+            "json_encode_per_s": rate(lambda: json.dumps(update).encode("utf-8"), args.number),
+            "binary_encode_per_s": rate(lambda: encode_update(42, 1234.0, 567.0, maps.intern("map.tmx"), True, "left"), args.number),
+            "json_decode_per_s": rate(lambda: json.loads(update_json.decode("utf-8")), args.number),
+            "binary_decode_per_s": rate(lambda: decode_update(update_bin), args.number),
+        },
+        f"snapshot_{args.players}": {
+            "json_bytes": len(snapshot_json),
+            "binary_bytes": len(snapshot_bin),
+            "json_encode_per_s": rate(lambda: json.dumps(snapshot).encode("utf-8"), snap_number),
+            "binary_encode_per_s": rate(lambda: encode_players(snapshot, maps), snap_number),
+            "json_decode_per_s": rate(lambda: json.loads(snapshot_json.decode("utf-8")), snap_number),
+            "binary_decode_per_s": rate(lambda: decode_players(snapshot_bin, map_names), snap_number),
+        },
+    }
+
+    for name, r in results.items():
+        print(f"{name}: {r['json_bytes']} B json, {r['binary_bytes']} B binary "
+              f"({r['json_bytes'] / r['binary_bytes']:.1f}x smaller)")
+        for step in ("encode", "decode"):
+            j, b = r[f"json_{step}_per_s"], r[f"binary_{step}_per_s"]
+            print(f"  {step}: {j:,.0f}/s json, {b:,.0f}/s binary ({b / j:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
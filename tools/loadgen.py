@@ -0,0 +1,418 @@
+"""
+Load generator for server.py: runs many headless clients that behave like OnlineManager
+(register, upload their position, poll players and chat, send chat now and then) and
+reports throughput, latency percentiles and error rates per endpoint as JSON.
+
+    python -m tools.loadgen --clients 200 --duration 20
+    python -m tools.loadgen --spawn --server-args="--mode pool --workers 512" --clients 300 --processes 4
+
+Requests made while clients are still starting up (--ramp) are not counted.
+One Python process tops out at a few thousand requests per second; use --processes
+so the generator is not the bottleneck.
+"""
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import random
+import shlex
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, asdict
+from threading import Thread
+from urllib.parse import urlsplit, urlencode
+
+from server.protocol import BINARY_CONTENT_TYPE, encode_sync_request, decode_sync_response
+
+DEFAULT_URL = "http://127.0.0.1:8989"
+PLAYER_SPEED = 4.0 * 64     # pixels per second, as Player.speed
+MAP_SIZE = 100 * 64         # players wander inside a square of this many pixels
+REQUEST_TIMEOUT = 15.0
+
+
+@dataclass
+class Config:
+    url: str
+    clients: int
+    duration: float
+    ramp: float
+    rate: float
+    protocol: str
+    binary: bool
+    radius: float
+    chat_interval: float
+    maps: tuple[str, ...]
+    keep_alive: bool
+    seed: int
+
+
+class Recorder:
+    """Per-endpoint latencies, errors and received bytes of the clients in one process."""
+    latencies: dict[str, list[float]]
+    errors: dict[str, int]
+    bytes_in: dict[str, int]
+    _measure_from: float
+
+    def __init__(self, measure_from: float):
+        self.latencies = {}
+        self.errors = {}
+        self.bytes_in = {}
+        self._measure_from = measure_from
+
+    def record(self, endpoint: str, started: float, seconds: float, ok: bool, size: int) -> None:
+        # `started` is wall-clock time, comparable across processes
+        if started < self._measure_from:
+            return
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.bytes_in[endpoint] = self.bytes_in.get(endpoint, 0) + size
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {"latencies": self.latencies, "errors": self.errors, "bytes_in": self.bytes_in}
+
+
+class SimClient:
+    """One simulated player on its own thread and (kept-alive) connection."""
+    index: int
+    player_id: int
+    _config: Config
+    _recorder: Recorder
+    _rng: random.Random
+    _conn: http.client.HTTPConnection | None
+    # Simulated state
+    _x: float
+    _y: float
+    _map: str
+    _direction: str
+    _moving: bool
+    _next_chat: float
+    # Cursors, as kept by OnlineManager
+    _players_version: int | None
+    _chat_seq: int
+    _map_ids: dict[str, int]
+
+    def __init__(self, index: int, config: Config, recorder: Recorder):
+        self.index = index
+        self.player_id = -1
+        self._config = config
+        self._recorder = recorder
+        self._rng = random.Random(config.seed * 100003 + index)
+        self._conn = None
+        self._x = self._rng.uniform(0, MAP_SIZE)
+        self._y = self._rng.uniform(0, MAP_SIZE)
+        self._map = self._rng.choice(config.maps)
+        self._direction = "down"
+        self._moving = False
+        self._next_chat = 0.0
+        self._players_version = None
+        self._chat_seq = 0
+        self._map_ids = {}
+
+    def run(self, deadline: float) -> None:
+        try:
+            if not self._register():
+                return
+            if self._config.chat_interval > 0:
+                self._next_chat = time.time() + self._rng.expovariate(1.0 / self._config.chat_interval)
+            period = 1.0 / self._config.rate
+            last = next_cycle = time.monotonic()
+            while time.time() < deadline:
+                now = time.monotonic()
+                self._move(now - last)
+                last = now
+                if self._config.protocol == "sync":
+                    self._cycle_sync()
+                else:
+                    self._cycle_poll()
+                # Fixed rate; a client that falls behind goes again right away
+                next_cycle = max(next_cycle + period, time.monotonic())
+                time.sleep(max(0.0, next_cycle - time.monotonic()))
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+
+    # Simulation
+    def _move(self, dt: float) -> None:
+        # Mostly keep walking in one direction, sometimes stop or turn
+        if self._rng.random() < 0.05:
+            self._moving = self._rng.random() < 0.8
+            self._direction = self._rng.choice(("down", "left", "right", "up"))
+        if not self._moving:
+            return
+        dx, dy = {"down": (0, 1), "left": (-1, 0), "right": (1, 0), "up": (0, -1)}[self._direction]
+        self._x = min(max(self._x + dx * PLAYER_SPEED * dt, 0.0), MAP_SIZE)
+        self._y = min(max(self._y + dy * PLAYER_SPEED * dt, 0.0), MAP_SIZE)
+
+    def _state(self) -> dict:
+        return {"x": self._x, "y": self._y, "map": self._map, "moving": self._moving, "direction": self._direction}
+
+    def _take_chat(self) -> list[str]:
+        if self._config.chat_interval <= 0 or time.time() < self._next_chat:
+            return []
+        self._next_chat = time.time() + self._rng.expovariate(1.0 / self._config.chat_interval)
+        return [f"hello from load client {self.index}"]
+
+    # Cycles
+    def _register(self) -> bool:
+        data = self._request("GET /register", "GET", "/register")
+        if data is None:
+            return False
+        self.player_id = json.loads(data)["id"]
+        return True
+
+    def _cycle_sync(self) -> None:
+        """One POST /sync, as OnlineManager._sync while polling."""
+        body = {
+            "id": self.player_id,
+            "state": self._state(),
+            "chat": self._take_chat(),
+            "since": self._players_version,
+            "chat_after": self._chat_seq,
+            "radius": self._config.radius,
+            "receive": True,
+        }
+        if self._config.binary:
+            map_id = self._map_id(self._map)
+            if map_id is None:
+                return
+            data = self._request("POST /sync", "POST", "/sync", encode_sync_request(body, map_id), BINARY_CONTENT_TYPE)
+            if data is None:
+                return
+            # Map names are not needed for the cursors
+            payload = decode_sync_response(data, {})
+        else:
+            data = self._request("POST /sync", "POST", "/sync", json.dumps(body).encode("utf-8"), "application/json")
+            if data is None:
+                return
+            payload = json.loads(data)
+        self._players_version = payload["players"]["version"]
+        self._advance_chat(payload["messages"])
+
+    def _cycle_poll(self) -> None:
+        """The separate endpoints: POST /players, GET /players, GET /chat and POST /chat."""
+        update = dict(self._state(), id=self.player_id)
+        self._request("POST /players", "POST", "/players", json.dumps(update).encode("utf-8"), "application/json")
+
+        query = {"id": self.player_id, "radius": self._config.radius} if self._config.radius > 0 else {}
+        if self._players_version is not None:
+            query["since"] = self._players_version
+        data = self._request("GET /players", "GET", f"/players?{urlencode(query)}")
+        if data is not None:
+            self._players_version = json.loads(data)["version"]
+
+        data = self._request("GET /chat", "GET", f"/chat?after={self._chat_seq}")
+        if data is not None:
+            self._advance_chat(json.loads(data)["messages"])
+
+        for text in self._take_chat():
+            body = json.dumps({"id": self.player_id, "text": text}).encode("utf-8")
+            self._request("POST /chat", "POST", "/chat", body, "application/json")
+
+    def _advance_chat(self, messages: list[dict]) -> None:
+        if messages:
+            self._chat_seq = messages[-1]["seq"]
+
+    def _map_id(self, map_name: str) -> int | None:
+        map_id = self._map_ids.get(map_name)
+        if map_id is None:
+            data = self._request("GET /maps", "GET", f"/maps?{urlencode({'name': map_name})}")
+            if data is None:
+                return None
+            map_id = self._map_ids[map_name] = json.loads(data)["id"]
+        return map_id
+
+    # HTTP
+    def _request(self, endpoint: str, method: str, path: str, body: bytes | None = None, content_type: str | None = None) -> bytes | None:
+        """Returns the response body, or None (counted as an error) on a failure or non-200 answer."""
+        headers = {"Content-Type": content_type} if content_type else {}
+        if not self._config.keep_alive:
+            headers["Connection"] = "close"
+        started = time.time()
+        start = time.perf_counter()
+        data: bytes | None = None
+        size = 0
+        try:
+            if self._conn is None:
+                parts = urlsplit(self._config.url)
+                self._conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=REQUEST_TIMEOUT)
+            self._conn.request(method, path, body=body, headers=headers)
+            resp = self._conn.getresponse()
+            raw = resp.read()
+            size = len(raw)
+            if resp.status == 200:
+                data = raw
+            # The server closes without echoing "Connection: close", so don't rely on will_close
+            if resp.will_close or not self._config.keep_alive:
+                self._conn.close()
+                self._conn = None
+        except (OSError, http.client.HTTPException):
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+        self._recorder.record(endpoint, started, time.perf_counter() - start, data is not None, size)
+        return data
+
+
+def run_clients(config: Config, first: int, count: int, start: float) -> dict:
+    """Runs clients first..first+count-1 on threads in this process and returns the recorded samples."""
+    measure_from = start + config.ramp
+    deadline = measure_from + config.duration
+    recorder = Recorder(measure_from)
+    threads: list[Thread] = []
+    for i in range(count):
+        # Spread client start-up evenly over the ramp
+        delay = start + config.ramp * (first + i) / max(1, config.clients) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        client = SimClient(first + i, config, recorder)
+        thread = Thread(target=client.run, args=(deadline,), name=f"LoadClient-{first + i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(timeout=max(0.0, deadline - time.time()) + REQUEST_TIMEOUT + 1.0)
+    return recorder.to_dict()
+
+
+def _run_clients_star(args: tuple) -> dict:
+    return run_clients(*args)
+
+
+def percentile(samples: list[float], q: float) -> float:
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000.0, 2) if samples else 0.0
+
+
+def summarize(config: Config, results: list[dict]) -> dict:
+    endpoints: dict[str, dict] = {}
+    names = sorted({name for r in results for name in r["latencies"]})
+    total_requests = total_errors = 0
+    for name in names:
+        samples = sorted(s for r in results for s in r["latencies"].get(name, []))
+        errors = sum(r["errors"].get(name, 0) for r in results)
+        bytes_in = sum(r["bytes_in"].get(name, 0) for r in results)
+        total_requests += len(samples)
+        total_errors += errors
+        endpoints[name] = {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / config.duration, 1),
+            "errors": errors,
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+            "p50_ms": percentile(samples, 0.50),
+            "p95_ms": percentile(samples, 0.95),
+            "p99_ms": percentile(samples, 0.99),
+            "max_ms": round(samples[-1] * 1000.0, 2) if samples else 0.0,
+            "bytes_in_per_s": round(bytes_in / config.duration),
+        }
+    return {
+        "config": asdict(config),
+        "total": {
+            "requests": total_requests,
+            "throughput_rps": round(total_requests / config.duration, 1),
+            "errors": total_errors,
+            "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def fetch_server_stats(url: str) -> dict | None:
+    parts = urlsplit(url)
+    try:
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=5)
+        conn.request("GET", "/stats")
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        return json.loads(data) if resp.status == 200 else None
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+
+
+def spawn_server(url: str, server_args: str) -> subprocess.Popen:
+    port = urlsplit(url).port or 80
+    proc = subprocess.Popen(
+        [sys.executable, "server.py", "--port", str(port), *shlex.split(server_args)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(50):
+        if proc.poll() is not None:
+            raise RuntimeError(f"server.py exited with code {proc.returncode}")
+        if fetch_server_stats(url) is not None:
+            return proc
+        time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("server.py did not come up")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL, help="server to load")
+    parser.add_argument("--clients", type=int, default=100, help="simulated players")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which clients start (not measured)")
+    parser.add_argument("--rate", type=float, default=1.0 / 0.03, help="cycles per second per client (OnlineManager polls every 30 ms)")
+    parser.add_argument("--protocol", choices=("sync", "poll"), default="sync",
+                        help="sync: one POST /sync per cycle; poll: the separate /players and /chat endpoints")
+    parser.add_argument("--binary", action="store_true", help="use the binary format for /sync")
+    parser.add_argument("--radius", type=float, default=1024.0, help="view radius (0: everyone)")
+    parser.add_argument("--chat-interval", type=float, default=10.0, help="mean seconds between chat messages per client (0: never)")
+    parser.add_argument("--maps", default="map.tmx", help="comma-separated maps the clients are spread over")
+    parser.add_argument("--no-keep-alive", action="store_true", help="open a new connection for every request")
+    parser.add_argument("--processes", type=int, default=1, help="generator processes the clients are split over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", action="store_true", help="start server.py on the --url port for the run")
+    parser.add_argument("--server-args", default="", help="extra server.py arguments with --spawn (pass as --server-args=\"...\")")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    if args.clients <= 0 or args.duration <= 0 or args.rate <= 0 or args.processes <= 0:
+        parser.error("--clients, --duration, --rate and --processes must be positive")
+
+    config = Config(
+        url=args.url.rstrip("/"),
+        clients=args.clients,
+        duration=args.duration,
+        ramp=args.ramp,
+        rate=args.rate,
+        protocol=args.protocol,
+        binary=args.binary,
+        radius=args.radius,
+        chat_interval=args.chat_interval,
+        maps=tuple(name.strip() for name in args.maps.split(",") if name.strip()),
+        keep_alive=not args.no_keep_alive,
+        seed=args.seed,
+    )
+
+    server = spawn_server(config.url, args.server_args) if args.spawn else None
+    try:
+        processes = min(args.processes, config.clients)
+        per_process = math.ceil(config.clients / processes)
+        start = time.time() + 0.5
+        jobs = [
+            (config, first, min(per_process, config.clients - first), start)
+            for first in range(0, config.clients, per_process)
+        ]
+        if len(jobs) == 1:
+            results = [run_clients(*jobs[0])]
+        else:
+            with multiprocessing.Pool(len(jobs)) as pool:
+                results = pool.map(_run_clients_star, jobs)
+
+        report = summarize(config, results)
+        report["server"] = fetch_server_stats(config.url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=5)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
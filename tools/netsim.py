@@ -0,0 +1,491 @@
+"""
+Network condition simulator: a local proxy between clients and server.py that adds delay,
+jitter, packet loss, reordering, a bandwidth cap and outages, so OnlineManager and the server
+can be measured under realistic conditions on one machine.
+
+    python server.py --port 8989 --udp-port 8990 --udp-public-port 9990
+    python -m tools.netsim --listen 9989 --upstream 127.0.0.1:8989 --udp-listen 9990 --udp-upstream 8990 \\
+        --delay-ms 60 --jitter-ms 15 --loss 0.02 --bandwidth 64k
+
+then point the game (ONLINE_SERVER_URL) or tools/loadgen.py (--url) at port 9989.
+
+Conditions apply to each direction separately (--delay-ms is one way). Over TCP nothing is
+actually lost or reordered: a lost segment shows up as a retransmission delay and everything
+behind it waits, as with real TCP. UDP datagrams are dropped and reordered for real.
+
+--script runs timed phases for automated tests; each step changes some conditions at a time
+offset (seconds from the start), and {"end": true} stops the run:
+
+    [{"at": 0, "delay_ms": 20},
+     {"at": 10, "loss": 0.1, "jitter_ms": 40},
+     {"at": 20, "outage": true},
+     {"at": 25, "outage": false},
+     {"at": 35, "end": true}]
+
+With the same --seed the same sequence of delays and losses is drawn. On exit, a JSON report
+with what each direction carried, dropped and delayed is printed (or written to --output).
+Tests can also use NetSim directly: start() runs it on a background thread, set_conditions()
+changes it while running.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict, fields, replace
+
+DISTRIBUTIONS = ("constant", "uniform", "normal", "exponential", "pareto")
+# TCP segment size; each one is lost independently
+MSS = 1460
+# Minimum retransmission timeout of common TCP stacks (Linux: 200 ms)
+TCP_MIN_RTO = 0.2
+# A reordered datagram is held back this long on top of its delay, so later ones overtake it
+MIN_REORDER_HOLD = 0.01
+READ_SIZE = 65536
+
+
+@dataclass
+class Conditions:
+    delay_ms: float = 0.0
+    # Spread of the delay; its meaning depends on the distribution
+    jitter_ms: float = 0.0
+    distribution: str = "normal"
+    # Probability that a datagram (UDP) or a segment (TCP) is lost
+    loss: float = 0.0
+    # Probability that a datagram is held back behind later ones (UDP only)
+    reorder: float = 0.0
+    # Bytes per second each way (0: unlimited)
+    bandwidth: float = 0.0
+    # Server unreachable: connections are cut and refused, datagrams dropped
+    outage: bool = False
+
+    def validate(self) -> None:
+        if self.delay_ms < 0 or self.jitter_ms < 0 or self.bandwidth < 0:
+            raise ValueError("delay_ms, jitter_ms and bandwidth must not be negative")
+        if not 0.0 <= self.loss < 1.0 or not 0.0 <= self.reorder <= 1.0:
+            raise ValueError("loss must be in [0, 1) and reorder in [0, 1]")
+        if self.distribution not in DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {', '.join(DISTRIBUTIONS)}")
+
+
+class Link:
+    """One direction of the simulated network: draws delays and losses, and queues for the bandwidth."""
+    name: str
+    _rng: random.Random
+    # When the bandwidth queue is empty again (event loop time)
+    _free_at: float
+
+    # Counters for the report
+    bytes: int
+    packets: int
+    dropped: int
+    reordered: int
+    retransmitted: int
+    total_delay: float
+
+    def __init__(self, name: str, rng: random.Random):
+        self.name = name
+        self._rng = rng
+        self._free_at = 0.0
+        self.bytes = 0
+        self.packets = 0
+        self.dropped = 0
+        self.reordered = 0
+        self.retransmitted = 0
+        self.total_delay = 0.0
+
+    def delay(self, c: Conditions) -> float:
+        """One-way delay in seconds, drawn from the configured distribution."""
+        base, spread = c.delay_ms / 1000.0, c.jitter_ms / 1000.0
+        rng = self._rng
+        if spread == 0 or c.distribution == "constant":
+            return base
+        if c.distribution == "uniform":
+            return max(0.0, base + rng.uniform(-spread, spread))
+        if c.distribution == "normal":
+            return max(0.0, rng.gauss(base, spread))
+        if c.distribution == "exponential":
+            return base + rng.expovariate(1.0 / spread)
+        # Pareto (shape 2.5): mostly close to the base delay, with rare long stalls
+        return base + spread * (rng.paretovariate(2.5) - 1.0)
+
+    def transmit(self, size: int, now: float, c: Conditions) -> float:
+        """When `size` bytes sent at `now` have left the sender, after the bandwidth queue."""
+        self.bytes += size
+        self.packets += 1
+        if c.bandwidth <= 0:
+            return now
+        start = max(now, self._free_at)
+        self._free_at = start + size / c.bandwidth
+        return self._free_at
+
+    def lost(self, c: Conditions, segments: int = 1) -> bool:
+        """Whether any of `segments` packets is lost."""
+        if c.loss <= 0:
+            return False
+        return self._rng.random() < 1.0 - (1.0 - c.loss) ** segments
+
+    def hold_back(self, c: Conditions) -> bool:
+        return c.reorder > 0 and self._rng.random() < c.reorder
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self.bytes,
+            "packets": self.packets,
+            "dropped": self.dropped,
+            "reordered": self.reordered,
+            "retransmitted": self.retransmitted,
+            "mean_delay_ms": round(self.total_delay / delivered * 1000.0, 2) if (delivered := self.packets - self.dropped) else 0.0,
+        }
+
+
+class _UdpListener(asyncio.DatagramProtocol):
+    def __init__(self, sim: "NetSim"):
+        self._sim = sim
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._sim._udp_from_client(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        pass
+
+
+class _UdpUpstream(asyncio.DatagramProtocol):
+    def __init__(self, sim: "NetSim", client: tuple):
+        self._sim = sim
+        self._client = client
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._sim._udp_from_server(data, self._client)
+
+    def error_received(self, exc: Exception) -> None:
+        pass # The server's UDP port is closed; the client will notice the silence
+
+
+class NetSim:
+    """
+    The proxy. TCP connections to `listen` are forwarded to `upstream`, and with `udp_listen`
+    datagrams are relayed to the upstream host's `udp_upstream` port. Runs on its own event
+    loop, either in a background thread (start/stop) or from the command line (main).
+    """
+    listen: tuple[str, int]
+    upstream: tuple[str, int]
+    udp_listen: int | None
+    udp_upstream: int | None
+    conditions: Conditions
+    # Client -> server and server -> client
+    up: Link
+    down: Link
+
+    _loop: asyncio.AbstractEventLoop | None
+    _thread: threading.Thread | None
+    _stopped: asyncio.Event | None
+    _error: BaseException | None
+    # Open connections (client writer, server writer), cut by an outage
+    _connections: set[tuple[asyncio.StreamWriter, asyncio.StreamWriter]]
+    _udp: asyncio.DatagramTransport | None
+    # Client address -> endpoint connected to the server's UDP port, one per client
+    _udp_upstreams: dict[tuple, asyncio.Task]
+    accepted: int
+    refused: int
+
+    def __init__(self, listen: tuple[str, int], upstream: tuple[str, int], conditions: Conditions | None = None, *,
+                 udp_listen: int | None = None, udp_upstream: int | None = None, seed: int = 0):
+        self.listen = listen
+        self.upstream = upstream
+        self.udp_listen = udp_listen
+        self.udp_upstream = udp_upstream if udp_upstream is not None else udp_listen
+        self.conditions = conditions or Conditions()
+        self.conditions.validate()
+        # Separate generators, so traffic in one direction doesn't change the other's draws
+        self.up = Link("up", random.Random(seed * 2 + 1))
+        self.down = Link("down", random.Random(seed * 2 + 2))
+        self._loop = None
+        self._thread = None
+        self._stopped = None
+        self._error = None
+        self._connections = set()
+        self._udp = None
+        self._udp_upstreams = {}
+        self.accepted = 0
+        self.refused = 0
+
+    # Threading
+    def start(self) -> None:
+        """Runs the proxy on a background thread; returns once it is listening."""
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="NetSim", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self) -> None:
+        if self._loop is not None and self._thread and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._thread.join()
+
+    def __enter__(self) -> "NetSim":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def set_conditions(self, **changes) -> None:
+        """Changes some conditions (Conditions field names) while running; thread-safe."""
+        conditions = replace(self.conditions, **changes)
+        conditions.validate()
+        if self._loop is not None and self._thread is not threading.current_thread():
+            self._loop.call_soon_threadsafe(self._apply, conditions)
+        else:
+            self._apply(conditions)
+
+    def run_script(self, steps: list[dict]):
+        """Starts a script (see load_script) on the running proxy; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(self._script(steps), self._loop)
+
+    def stats(self) -> dict:
+        return {
+            "conditions": asdict(self.conditions),
+            "connections": {"accepted": self.accepted, "refused": self.refused, "open": len(self._connections)},
+            "udp_clients": len(self._udp_upstreams),
+            "up": self.up.stats(),
+            "down": self.down.stats(),
+        }
+
+    def _run(self, ready: threading.Event) -> None:
+        try:
+            asyncio.run(self._serve(ready))
+        except BaseException as e:
+            self._error = e
+        finally:
+            ready.set()
+
+    async def _serve(self, ready: threading.Event) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_tcp, *self.listen)
+        if self.udp_listen is not None:
+            self._udp, _ = await self._loop.create_datagram_endpoint(
+                lambda: _UdpListener(self), local_addr=(self.listen[0], self.udp_listen))
+        ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            self._cut_connections()
+            if self._udp is not None:
+                self._udp.close()
+            for task in self._udp_upstreams.values():
+                if task.done() and not task.exception():
+                    task.result()[0].close()
+
+    def _apply(self, conditions: Conditions) -> None:
+        self.conditions = conditions
+        if conditions.outage:
+            self._cut_connections()
+
+    async def _script(self, steps: list[dict]) -> bool:
+        """Applies the steps at their times; True when a step ended the run."""
+        start = self._loop.time()
+        for step in steps:
+            await asyncio.sleep(max(0.0, start + step["at"] - self._loop.time()))
+            if step.get("end"):
+                return True
+            changes = {key: value for key, value in step.items() if key != "at"}
+            self._apply(replace(self.conditions, **changes))
+            print(f"[netsim] t={step['at']:g}s {json.dumps(changes)}", file=sys.stderr)
+        return False
+
+    # TCP
+    async def _handle_tcp(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        if self.conditions.outage:
+            self.refused += 1
+            client_writer.transport.abort()
+            return
+        try:
+            server_reader, server_writer = await asyncio.open_connection(*self.upstream)
+        except OSError:
+            self.refused += 1
+            client_writer.transport.abort()
+            return
+        self.accepted += 1
+        pair = (client_writer, server_writer)
+        self._connections.add(pair)
+        try:
+            await asyncio.gather(
+                self._pump(client_reader, server_writer, self.up),
+                self._pump(server_reader, client_writer, self.down),
+                return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            pass # Proxy stopping; asyncio's stream callback would report a cancelled handler as an error
+        finally:
+            self._connections.discard(pair)
+            client_writer.close()
+            server_writer.close()
+
+    async def _pump(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, link: Link) -> None:
+        """Forwards one direction of a connection; bytes arrive in order, each chunk at its delivery time."""
+        queue: asyncio.Queue[tuple[float, bytes] | None] = asyncio.Queue()
+
+        async def deliver() -> None:
+            while (item := await queue.get()) is not None:
+                at, data = item
+                await asyncio.sleep(max(0.0, at - self._loop.time()))
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+
+        delivering = asyncio.create_task(deliver())
+        last = 0.0
+        try:
+            while data := await reader.read(READ_SIZE):
+                c = self.conditions
+                now = self._loop.time()
+                delay = link.delay(c)
+                if link.lost(c, math.ceil(len(data) / MSS)):
+                    # Sent again after the retransmission timeout
+                    link.retransmitted += 1
+                    delay += max(TCP_MIN_RTO, 2 * delay) + link.delay(c)
+                # A stream never overtakes itself
+                at = max(link.transmit(len(data), now, c) + delay, last)
+                link.total_delay += at - now
+                last = at
+                queue.put_nowait((at, data))
+        finally:
+            queue.put_nowait(None)
+            try:
+                await delivering
+            except ConnectionError:
+                pass
+
+    def _cut_connections(self) -> None:
+        for client_writer, server_writer in list(self._connections):
+            client_writer.transport.abort()
+            server_writer.transport.abort()
+
+    # UDP
+    def _udp_from_client(self, data: bytes, client: tuple) -> None:
+        at = self._udp_schedule(data, self.up)
+        if at is None:
+            return
+        endpoint = self._udp_upstreams.get(client)
+        if endpoint is None:
+            endpoint = self._udp_upstreams[client] = self._loop.create_task(self._loop.create_datagram_endpoint(
+                lambda: _UdpUpstream(self, client), remote_addr=(self.upstream[0], self.udp_upstream)))
+        self._loop.create_task(self._udp_send_up(endpoint, data, at))
+
+    async def _udp_send_up(self, endpoint: asyncio.Task, data: bytes, at: float) -> None:
+        await asyncio.sleep(max(0.0, at - self._loop.time()))
+        try:
+            transport, _ = await endpoint
+        except OSError:
+            return
+        transport.sendto(data)
+
+    def _udp_from_server(self, data: bytes, client: tuple) -> None:
+        at = self._udp_schedule(data, self.down)
+        if at is not None and self._udp is not None:
+            self._loop.call_at(at, self._udp.sendto, data, client)
+
+    def _udp_schedule(self, data: bytes, link: Link) -> float | None:
+        """Delivery time of a datagram, or None when it is lost."""
+        c = self.conditions
+        now = self._loop.time()
+        at = link.transmit(len(data), now, c) + link.delay(c)
+        if c.outage or link.lost(c):
+            link.dropped += 1
+            return None
+        if link.hold_back(c):
+            link.reordered += 1
+            at += max(MIN_REORDER_HOLD, 2 * c.jitter_ms / 1000.0)
+        link.total_delay += at - now
+        return at
+
+
+def load_script(path: str) -> list[dict]:
+    """Reads and checks a script: a JSON list of steps with "at" and Conditions fields, or "end"."""
+    with open(path, encoding="utf-8") as f:
+        steps = json.load(f)
+    names = {field.name for field in fields(Conditions)}
+    conditions = Conditions()
+    for step in sorted(steps, key=lambda step: step["at"]):
+        unknown = set(step) - names - {"at", "end"}
+        if unknown:
+            raise ValueError(f"unknown keys in script step: {', '.join(sorted(unknown))}")
+        conditions = replace(conditions, **{key: value for key, value in step.items() if key in names})
+        conditions.validate()
+    return sorted(steps, key=lambda step: step["at"])
+
+
+def parse_address(text: str, default_host: str = "127.0.0.1") -> tuple[str, int]:
+    host, _, port = text.rpartition(":")
+    return host or default_host, int(port)
+
+
+def parse_bandwidth(text: str) -> float:
+    """Bytes per second, with an optional k or m suffix (1000s)."""
+    text = text.strip().lower()
+    scale = {"k": 1e3, "m": 1e6}.get(text[-1:], 1.0)
+    return float(text[:-1] if scale != 1.0 else text) * scale
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listen", default="127.0.0.1:9989", help="[host:]port clients connect to")
+    parser.add_argument("--upstream", default="127.0.0.1:8989", help="host:port of server.py")
+    parser.add_argument("--udp-listen", type=int, default=None, help="also relay UDP datagrams received on this port")
+    parser.add_argument("--udp-upstream", type=int, default=None, help="server's --udp-port (default: --udp-listen)")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="one-way delay")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="spread of the delay")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="normal", help="how delays are drawn around --delay-ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability a datagram or TCP segment is lost")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability a datagram is overtaken by later ones")
+    parser.add_argument("--bandwidth", type=parse_bandwidth, default=0.0, help="bytes per second each way, e.g. 64k (0: unlimited)")
+    parser.add_argument("--script", help="JSON file of timed condition changes (see above)")
+    parser.add_argument("--duration", type=float, default=0.0, help="stop after this many seconds (0: run until Ctrl+C or the script ends)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    try:
+        conditions = Conditions(delay_ms=args.delay_ms, jitter_ms=args.jitter_ms, distribution=args.distribution,
+                                loss=args.loss, reorder=args.reorder, bandwidth=args.bandwidth)
+        conditions.validate()
+        steps = load_script(args.script) if args.script else None
+        listen, upstream = parse_address(args.listen), parse_address(args.upstream)
+    except (ValueError, OSError, KeyError) as e:
+        parser.error(str(e))
+
+    sim = NetSim(listen, upstream, conditions, udp_listen=args.udp_listen, udp_upstream=args.udp_upstream, seed=args.seed)
+    sim.start()
+    udp = f", UDP {args.udp_listen} -> {sim.udp_upstream}" if args.udp_listen is not None else ""
+    print(f"[netsim] {listen[0]}:{listen[1]} -> {upstream[0]}:{upstream[1]}{udp}", file=sys.stderr)
+    script = sim.run_script(steps) if steps else None
+    deadline = time.monotonic() + args.duration if args.duration > 0 else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            if script is not None and script.done() and script.result():
+                break
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+
+    text = json.dumps(sim.stats(), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""
+Replays a traffic capture (server.py --capture, or ONLINE_CAPTURE in the game settings).
+
+Against a server, every recorded connection is played back on a connection of its own at the
+recorded times, and latencies are reported per endpoint next to the recorded ones, so a server
+change can be measured on real traffic:
+
+    python server.py --capture session.cap          # play, then stop the server
+    python server.py --port 8999 &
+    python -m tools.replay session.cap --server http://127.0.0.1:8999 --speed 4
+
+A fresh server hands out other player ids, map ids and snapshot versions, so requests are
+rewritten as they go: recorded ids are mapped to the ids the replayed /register calls returned
+(players registered before the capture started get a new registration), map ids go through the
+map names, and the since/chat cursors follow the replayed responses. /stream connections are held
+open as long as they were. Datagrams need --udp-port.
+
+Into a headless client, the recorded responses of a client capture are fed to an OnlineManager
+that never touches the network, and its view of the world is printed when it changes. The same
+capture gives the same timeline every time (compare --timeline files or the digest):
+
+    python -m tools.replay session.cap --client --timeline timeline.jsonl
+
+--speed scales time (2: twice as fast); 0 plays everything as fast as possible, the default in
+client mode. --info summarizes a capture without replaying it.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import struct
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl
+
+from server.capture import Exchange, read_capture, KIND_HTTP, KIND_DATAGRAM, KIND_EVENT
+from server.protocol import (
+    MapTable, BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, encode_update, decode_update, encode_sync_request,
+    decode_sync_request, decode_sync_response, decode_players, encode_datagram, decode_datagram, DATAGRAM_REPLY
+)
+from src.utils.async_http import AsyncHttpClient
+
+# Seconds a request may wait for the /register it depends on (played on another connection)
+REGISTER_WAIT = 10.0
+REQUEST_TIMEOUT = 15.0
+
+
+def percentile(samples: list[float], q: float) -> float:
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000.0, 2) if samples else 0.0
+
+
+def endpoint(record: Exchange) -> str:
+    if record.kind == KIND_DATAGRAM:
+        return "udp"
+    if record.kind == KIND_EVENT:
+        return f"event {record.target}"
+    return f"{record.method} {record.path}"
+
+
+class ServerReplay:
+    """Plays the client side of a capture against a server, rewriting ids and cursors."""
+    url: str
+    udp_port: int | None
+    speed: float
+    _sources: dict[int, list[Exchange]]
+    # Player ids whose /register is in the capture, and recorded -> replayed player ids
+    _registered: set[int]
+    _ids: dict[int, asyncio.Future]
+    # Replayed player id -> its UDP token on the replayed server
+    _tokens: dict[int, int]
+    # Map ids as recorded, and names -> ids on the replayed server
+    _recorded_maps: MapTable
+    _maps: dict[str, int]
+    # Replayed player id -> [players version or None, chat seq] from its replayed responses
+    _cursors: dict[int, list]
+    # Per endpoint: replayed and recorded seconds, errors, status mismatches, bytes received
+    _latencies: dict[str, list[float]]
+    _recorded: dict[str, list[float]]
+    _errors: Counter
+    _mismatches: Counter
+    _bytes_in: Counter
+    _lag: float
+    _start: float
+
+    def __init__(self, records: list[Exchange], url: str, udp_port: int | None = None, speed: float = 1.0):
+        self.url = url
+        self.udp_port = udp_port
+        self.speed = speed
+        self._sources = {}
+        self._registered = set()
+        self._recorded_maps = MapTable()
+        for record in records:
+            if record.kind == KIND_EVENT:
+                continue # The server's side
+            self._sources.setdefault(record.source, []).append(record)
+            if record.kind != KIND_HTTP or record.status != 200 or not record.response:
+                continue
+            if record.path == "/register":
+                self._registered.add(json.loads(record.response)["id"])
+            elif record.path == "/maps":
+                for name, map_id in json.loads(record.response)["maps"].items():
+                    self._recorded_maps.assign(name, map_id)
+        for source in self._sources.values():
+            # Written as they completed; replayed as they started
+            source.sort(key=lambda r: r.t)
+        self._ids = {}
+        self._tokens = {}
+        self._maps = {}
+        self._cursors = {}
+        self._latencies = {}
+        self._recorded = {}
+        self._errors = Counter()
+        self._mismatches = Counter()
+        self._bytes_in = Counter()
+        self._lag = 0.0
+        self._start = 0.0
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        asyncio.run(self._run())
+        return self._report(time.perf_counter() - started)
+
+    async def _run(self) -> None:
+        self._start = time.monotonic()
+        await asyncio.gather(*(self._play(records) for records in self._sources.values()))
+
+    async def _play(self, records: list[Exchange]) -> None:
+        client = AsyncHttpClient(self.url, 1, REQUEST_TIMEOUT)
+        udp = None
+        try:
+            for record in records:
+                await self._wait_until(record.t)
+                name = endpoint(record)
+                if record.kind == KIND_HTTP:
+                    self._recorded.setdefault(name, []).append(record.duration)
+                try:
+                    if record.kind == KIND_DATAGRAM:
+                        if not record.request:
+                            continue # An answer received by a client
+                        if udp is None:
+                            udp = await self._open_udp(client)
+                        await self._datagram(client, udp, record)
+                    elif record.path == "/stream":
+                        await self._stream(client, record)
+                    else:
+                        await self._http(client, record)
+                except (OSError, TimeoutError, ValueError, KeyError, struct.error):
+                    self._errors[name] += 1
+        finally:
+            await client.close()
+            if udp is not None:
+                udp[0].close()
+
+    async def _wait_until(self, t: float) -> None:
+        if self.speed <= 0:
+            return
+        delay = self._start + t / self.speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            self._lag = max(self._lag, -delay)
+
+    # Requests
+    async def _http(self, client: AsyncHttpClient, record: Exchange) -> None:
+        url = urlsplit(record.target.partition(" ")[2])
+        params = dict(parse_qsl(url.query))
+        pid = None
+        if "id" in params:
+            pid = params["id"] = await self._player_id(client, int(params["id"]))
+            if "since" in params:
+                since = self._cursor(pid)[0]
+                if since is None:
+                    params.pop("since")
+                else:
+                    params["since"] = since
+        body, pid = await self._rewrite_body(client, url.path, record, pid)
+        headers = {"Content-Type": record.request_type} if record.request_type else {}
+        if record.response_type == BINARY_CONTENT_TYPE:
+            headers["Accept"] = BINARY_CONTENT_TYPE
+
+        name = endpoint(record)
+        started = time.perf_counter()
+        resp = await client.request(record.method, url.path, params=params or None, data=body, headers=headers)
+        self._latencies.setdefault(name, []).append(time.perf_counter() - started)
+        self._bytes_in[name] += len(resp.body)
+        if resp.status != record.status:
+            self._mismatches[name] += 1
+        if resp.status == 200:
+            self._learn(url.path, record, resp.body, resp.headers.get("content-type", ""), pid)
+
+    async def _rewrite_body(self, client: AsyncHttpClient, path: str, record: Exchange, pid: int | None) -> tuple[bytes, int | None]:
+        """The request body with replayed ids and cursors, and the player it is for."""
+        if not record.request:
+            return b"", pid
+        if record.request_type == JSON_CONTENT_TYPE:
+            body = json.loads(record.request)
+            if "id" not in body:
+                return record.request, pid
+            pid = body["id"] = await self._player_id(client, body["id"])
+            if path == "/sync":
+                self._rewind(body, pid)
+            return json.dumps(body).encode("utf-8"), pid
+        if record.request_type != BINARY_CONTENT_TYPE:
+            return record.request, pid
+        if path == "/players":
+            old_pid, x, y, map_id, moving, direction = decode_update(record.request)
+            pid = await self._player_id(client, old_pid)
+            return encode_update(pid, x, y, await self._map_id(client, map_id), moving, direction), pid
+        return await self._rewrite_sync(client, record.request)
+
+    async def _rewrite_sync(self, client: AsyncHttpClient, data: bytes) -> tuple[bytes, int]:
+        body = decode_sync_request(data, self._recorded_maps)
+        pid = body["id"] = await self._player_id(client, body["id"])
+        self._rewind(body, pid)
+        map_id = 0
+        if body["state"]:
+            map_id = await self._map_name_id(client, body["state"]["map"])
+        return encode_sync_request(body, map_id), pid
+
+    def _rewind(self, body: dict, pid: int) -> None:
+        # A delta request asks for the changes since the replayed server's last answer to us
+        since, chat_seq = self._cursor(pid)
+        if body.get("since") is not None:
+            body["since"] = since
+        body["chat_after"] = chat_seq
+
+    async def _stream(self, client: AsyncHttpClient, record: Exchange) -> None:
+        url = urlsplit(record.target.partition(" ")[2])
+        params = dict(parse_qsl(url.query))
+        if "id" in params:
+            params["id"] = await self._player_id(client, int(params["id"]))
+        name = endpoint(record)
+        started = time.perf_counter()
+        status, reader, writer = await client.stream(url.path, params=params or None)
+        self._latencies.setdefault(name, []).append(time.perf_counter() - started)
+        if status != record.status:
+            self._mismatches[name] += 1
+        try:
+            hold = record.duration / self.speed if self.speed > 0 else 0.0
+            deadline = time.monotonic() + hold
+            while (left := deadline - time.monotonic()) > 0:
+                try:
+                    chunk = await asyncio.wait_for(reader.read(65536), left)
+                except asyncio.TimeoutError:
+                    break
+                if not chunk:
+                    break
+                self._bytes_in[name] += len(chunk)
+        finally:
+            writer.close()
+
+    # Datagrams
+    async def _open_udp(self, client: AsyncHttpClient) -> tuple[asyncio.DatagramTransport, "_Answers"]:
+        answers = _Answers(self)
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: answers, remote_addr=(client.host, self.udp_port))
+        return transport, answers
+
+    async def _datagram(self, client: AsyncHttpClient, udp: tuple, record: Exchange) -> None:
+        transport, answers = udp
+        kind, seq, _, payload = decode_datagram(record.request)
+        payload, pid = await self._rewrite_sync(client, payload)
+        answers.pid = pid
+        answers.sent_at = time.perf_counter()
+        transport.sendto(encode_datagram(kind, seq, payload, self._tokens.get(pid, 0)))
+        # In the report even if nothing comes back
+        self._latencies.setdefault("udp", [])
+        if record.response:
+            self._recorded.setdefault("udp", []).append(record.duration)
+
+    def _answered(self, answers: "_Answers", data: bytes) -> None:
+        kind, _, _, payload = decode_datagram(data)
+        if kind != DATAGRAM_REPLY:
+            return
+        if answers.sent_at is not None:
+            self._latencies["udp"].append(time.perf_counter() - answers.sent_at)
+            answers.sent_at = None
+        self._bytes_in["udp"] += len(data)
+        self._learn("/sync", None, payload, BINARY_CONTENT_TYPE, answers.pid)
+
+    # Ids and cursors
+    async def _player_id(self, client: AsyncHttpClient, recorded: int) -> int:
+        future = self._ids.get(recorded)
+        if future is None:
+            future = self._ids[recorded] = asyncio.get_running_loop().create_future()
+            if recorded not in self._registered:
+                # Registered before the capture started: stands in with a registration of its own
+                try:
+                    resp = await client.request("GET", "/register")
+                    future.set_result(self._registered_as(resp.json()))
+                except (OSError, TimeoutError, ValueError, KeyError) as e:
+                    future.set_exception(e)
+                    future.exception() # Raised to every request for this player
+        return await asyncio.wait_for(asyncio.shield(future), REGISTER_WAIT)
+
+    def _registered_as(self, data: dict) -> int:
+        """The replayed player id of a /register answer, keeping its UDP token."""
+        pid = data["id"]
+        self._tokens[pid] = int(data.get("udp_token") or 0)
+        return pid
+
+    def _cursor(self, pid: int) -> list:
+        return self._cursors.setdefault(pid, [None, 0])
+
+    async def _map_id(self, client: AsyncHttpClient, recorded: int) -> int:
+        name = self._recorded_maps.name(recorded)
+        if name is None:
+            raise ValueError(f"unknown recorded map id {recorded}")
+        return await self._map_name_id(client, name)
+
+    async def _map_name_id(self, client: AsyncHttpClient, name: str) -> int:
+        map_id = self._maps.get(name)
+        if map_id is None:
+            resp = await client.request("GET", "/maps", params={"name": name})
+            data = resp.json()
+            self._maps.update(data["maps"])
+            map_id = data["id"]
+        return map_id
+
+    def _learn(self, path: str, record: Exchange | None, body: bytes, content_type: str, pid: int | None) -> None:
+        """Takes the new ids and cursors from a replayed response."""
+        binary = content_type.startswith(BINARY_CONTENT_TYPE)
+        if path == "/register" and record is not None:
+            recorded = json.loads(record.response)["id"]
+            future = self._ids.setdefault(recorded, asyncio.get_running_loop().create_future())
+            if not future.done():
+                future.set_result(self._registered_as(json.loads(body)))
+        elif path == "/maps":
+            self._maps.update(json.loads(body)["maps"])
+        elif pid is None:
+            return
+        elif path == "/sync":
+            payload = decode_sync_response(body, {}) if binary else json.loads(body)
+            cursor = self._cursor(pid)
+            if payload.get("players"):
+                cursor[0] = payload["players"]["version"]
+            if payload.get("messages"):
+                cursor[1] = payload["messages"][-1]["seq"]
+        elif path == "/players" and record is not None and record.method == "GET":
+            payload = decode_players(body, {}) if binary else json.loads(body)
+            self._cursor(pid)[0] = payload["version"]
+
+    def _report(self, seconds: float) -> dict:
+        endpoints = {}
+        for name in sorted(set(self._latencies) | set(self._recorded)):
+            samples = sorted(self._latencies.get(name, []))
+            recorded = sorted(self._recorded.get(name, []))
+            endpoints[name] = {
+                "requests": len(samples),
+                "recorded": len(recorded),
+                "errors": self._errors[name],
+                "status_mismatches": self._mismatches[name],
+                "p50_ms": percentile(samples, 0.50),
+                "p95_ms": percentile(samples, 0.95),
+                "p99_ms": percentile(samples, 0.99),
+                "recorded_p50_ms": percentile(recorded, 0.50),
+                "recorded_p95_ms": percentile(recorded, 0.95),
+                "bytes_in": self._bytes_in[name],
+            }
+        return {
+            "url": self.url,
+            "speed": self.speed,
+            "seconds": round(seconds, 2),
+            "connections": len(self._sources),
+            "players": len(self._ids),
+            "max_lag_ms": round(self._lag * 1000.0, 1),
+            "endpoints": endpoints,
+        }
+
+
+class _Answers(asyncio.DatagramProtocol):
+    """Server answers on one replayed UDP source; latency is counted from the newest datagram sent."""
+    pid: int | None
+    sent_at: float | None
+
+    def __init__(self, replay: ServerReplay):
+        self._replay = replay
+        self.pid = None
+        self.sent_at = None
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            self._replay._answered(self, data)
+        except (struct.error, ValueError, KeyError):
+            self._replay._errors["udp"] += 1
+
+    def error_received(self, exc: Exception) -> None:
+        self._replay._errors["udp"] += 1
+
+
+def replay_client(records: list[Exchange], speed: float = 0.0, timeline=None) -> dict:
+    """
+    Feeds the responses of a client capture to a headless OnlineManager in the order they
+    arrived. Each change of its view is written to `timeline` as a JSON line; the report has the
+    final view and a digest of the whole timeline.
+    """
+    from src.core.managers.online_manager import OnlineManager
+
+    manager = OnlineManager()
+    # Applied when they arrived, not when they were sent
+    records = sorted(records, key=lambda r: r.t + r.duration)
+    digest = hashlib.sha256()
+    errors = Counter()
+    changes = 0
+    last = None
+    start = time.monotonic()
+    for record in records:
+        if speed > 0:
+            delay = start + (record.t + record.duration) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            manager.replay(record)
+        except (ValueError, KeyError, TypeError, struct.error):
+            errors[endpoint(record)] += 1
+            continue
+        view = _client_view(manager)
+        if view == last:
+            continue
+        last = view
+        changes += 1
+        line = json.dumps({"t": round(record.t + record.duration, 4), "after": endpoint(record), **view}, sort_keys=True)
+        digest.update(line.encode("utf-8"))
+        if timeline is not None:
+            timeline.write(line + "\n")
+    view = _client_view(manager)
+    return {
+        "records": len(records),
+        "changes": changes,
+        "errors": dict(errors),
+        "player_id": view["player_id"],
+        "players": view["players"],
+        "chat_seq": view["chat_seq"],
+        "chat_messages": len(manager.chat_messages),
+        "digest": digest.hexdigest(),
+    }
+
+
+def _client_view(manager) -> dict:
+    players = sorted(manager.get_list_players(), key=lambda p: p["id"])
+    chat = manager.get_chat_history(limit=1)
+    return {
+        "player_id": manager.player_id,
+        "players": [[p["id"], p["x"], p["y"], p["map"], p["moving"], p["direction"]] for p in players],
+        "chat_seq": chat[-1]["seq"] if chat else 0,
+    }
+
+
+def summarize(records: list[Exchange]) -> dict:
+    counts = Counter(endpoint(r) for r in records)
+    sizes = Counter()
+    for r in records:
+        sizes[endpoint(r)] += len(r.request) + len(r.response)
+    return {
+        "records": len(records),
+        "seconds": round(max((r.t + r.duration for r in records), default=0.0), 2),
+        "sources": len({r.source for r in records}),
+        "endpoints": {name: {"records": counts[name], "bytes": sizes[name]} for name in sorted(counts)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="capture file")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--server", help="base URL of the server to replay against")
+    mode.add_argument("--client", action="store_true", help="feed the responses to a headless OnlineManager")
+    mode.add_argument("--info", action="store_true", help="summarize the capture")
+    parser.add_argument("--udp-port", type=int, default=None, help="server's --udp-port, to replay datagrams")
+    parser.add_argument("--speed", type=float, default=None,
+                        help="time scale, 0: as fast as possible (default: 1 against a server, 0 into a client)")
+    parser.add_argument("--timeline", help="client mode: write the view after every change to this JSON lines file")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.speed is not None and args.speed < 0:
+        parser.error("--speed must not be negative")
+    try:
+        records = list(read_capture(args.capture))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.info:
+        report = summarize(records)
+    elif args.client:
+        speed = args.speed if args.speed is not None else 0.0
+        if args.timeline:
+            with open(args.timeline, "w", encoding="utf-8") as timeline:
+                report = replay_client(records, speed, timeline)
+        else:
+            report = replay_client(records, speed)
+    else:
+        if args.udp_port is None and any(r.kind == KIND_DATAGRAM and r.request for r in records):
+            parser.error("the capture has datagrams, replaying them needs --udp-port")
+        speed = args.speed if args.speed is not None else 1.0
+        print(f"[replay] {len(records)} records -> {args.server} (speed {speed:g})", file=sys.stderr)
+        report = ServerReplay(records, args.server, args.udp_port, speed).run()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()